@@ -0,0 +1,248 @@
+"""
+Benchmark nnU-Net's data augmentation throughput and pick the worker count
+Builds the training dataloader of a fold exactly as nnUNetTrainer does (same
+plans, patch size, batch size and augmentation pipeline, read from the
+preprocessed dataset), then measures batches per second for a range of
+augmentation worker counts, with and without pinned memory.
+
+The recommendation is the smallest worker count within --tolerance of the
+best throughput. It is saved as a profile (dataloader_profile.json) that
+train_nnunet.py and train_single_fold.py apply as nnUNet_n_proc_DA before
+starting a fold, unless that variable is already set. fold_scheduler.py
+divides it between the folds it runs concurrently.
+
+Example:
+    python benchmark_dataloader.py --workers 2 4 6 8 12 --batches 60
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime
+
+DATASET_NAME = 'Dataset001_LowerLimb'
+PLANS_NAME = 'nnUNetPlans'
+CONFIGURATION = '3d_fullres'
+PROFILE_FILE = Path(__file__).parent.absolute() / 'dataloader_profile.json'
+WORKERS_VARIABLE = 'nnUNet_n_proc_DA'
+
+
+def load_dataloader_profile(profile_file=PROFILE_FILE):
+    if not Path(profile_file).exists():
+        return None
+    with open(profile_file, 'r') as f:
+        return json.load(f)
+
+
+def recommended_dataloader_workers(profile_file=PROFILE_FILE):
+    """Worker count recommended for one fold on this machine, or None without a profile benchmarked here"""
+    profile = load_dataloader_profile(profile_file)
+    if profile is None:
+        return None
+    if profile.get('hostname') != socket.gethostname():
+        print(f"WARNING: {Path(profile_file).name} was benchmarked on {profile.get('hostname')}, not applying it")
+        print("  Re-run: python benchmark_dataloader.py")
+        return None
+    return int(profile['recommended'][WORKERS_VARIABLE])
+
+
+def apply_dataloader_profile(profile_file=PROFILE_FILE):
+    """Set nnUNet_n_proc_DA from the benchmark profile of this machine; returns the value used, if any"""
+    if WORKERS_VARIABLE in os.environ:
+        return os.environ[WORKERS_VARIABLE]
+    workers = recommended_dataloader_workers(profile_file)
+    if workers is None:
+        return None
+    os.environ[WORKERS_VARIABLE] = str(workers)
+    print(f"Using {WORKERS_VARIABLE}={workers} from {Path(profile_file).name}")
+    return os.environ[WORKERS_VARIABLE]
+
+
+def verify_nnunet():
+    """Verify nnunetv2, batchgenerators and PyTorch are installed"""
+    try:
+        import torch
+        import nnunetv2
+        import batchgenerators
+    except ImportError:
+        print("ERROR: nnunetv2 (and PyTorch) not installed!")
+        print("Install with: pip install nnunetv2")
+        sys.exit(1)
+
+
+def candidate_workers(cpu_count):
+    candidates = {w for w in (1, 2, 4, 6, 8, 12, 16, 24, 32) if w <= cpu_count}
+    candidates.add(cpu_count)
+    return sorted(candidates)
+
+
+def create_train_loader(preprocessed_dir, configuration, fold):
+    """
+    The training data loader of nnUNetTrainer and its augmentation transform.
+    Taken from a single-threaded get_dataloaders(), so the benchmark uses the
+    same pipeline as training in whichever nnU-Net version is installed.
+    """
+    import torch
+    from nnunetv2.training.nnUNetTrainer.nnUNetTrainer import nnUNetTrainer
+
+    with open(preprocessed_dir / f'{PLANS_NAME}.json', 'r') as f:
+        plans = json.load(f)
+    with open(preprocessed_dir / 'dataset.json', 'r') as f:
+        dataset_json = json.load(f)
+
+    trainer = nnUNetTrainer(plans, configuration, fold, dataset_json, device=torch.device('cpu'))
+    if getattr(trainer, 'dataset_class', False) is None:
+        # Set by initialize() in recent versions; the network is not needed here
+        from nnunetv2.training.dataloading.nnunet_dataset import infer_dataset_class
+        trainer.dataset_class = infer_dataset_class(trainer.preprocessed_dataset_folder)
+
+    os.environ[WORKERS_VARIABLE] = '0'
+    train_gen, val_gen = trainer.get_dataloaders()
+    for gen in (train_gen, val_gen):
+        if hasattr(gen, '_finish'):
+            gen._finish()
+    return trainer, train_gen.data_loader, train_gen.transform
+
+
+def measure(data_loader, transform, workers, pin_memory, batches, warmup):
+    """Batches and samples per second of a multi-threaded augmenter over the loader"""
+    from batchgenerators.dataloading.nondet_multi_threaded_augmenter import NonDetMultiThreadedAugmenter
+
+    # Same arguments as nnUNetTrainer.get_dataloaders
+    augmenter = NonDetMultiThreadedAugmenter(data_loader=data_loader, transform=transform, num_processes=workers,
+                                             num_cached=max(6, workers // 2), seeds=None, pin_memory=pin_memory,
+                                             wait_time=0.002)
+    try:
+        start = time.perf_counter()
+        for _ in range(warmup):
+            next(augmenter)
+        startup = time.perf_counter() - start
+
+        samples = 0
+        start = time.perf_counter()
+        for _ in range(batches):
+            samples += next(augmenter)['data'].shape[0]
+        elapsed = time.perf_counter() - start
+    finally:
+        augmenter._finish()
+    return {'workers': workers, 'pin_memory': pin_memory, 'batches_per_s': round(batches / elapsed, 3),
+            'samples_per_s': round(samples / elapsed, 3), 'startup_s': round(startup, 2)}
+
+
+def benchmark(args, preprocessed_dir):
+    import torch
+    from nnunetv2.utilities.default_n_proc_DA import get_allowed_n_proc_DA
+
+    user_setting = os.environ.pop(WORKERS_VARIABLE, None)
+    nnunet_default = get_allowed_n_proc_DA()
+    cpu_count = os.cpu_count() or 1
+    workers = args.workers or candidate_workers(cpu_count)
+    pin_choice = args.pin_memory or ('both' if torch.cuda.is_available() else 'off')
+    pin_settings = {'both': [False, True], 'on': [True], 'off': [False]}[pin_choice]
+
+    trainer, data_loader, transform = create_train_loader(preprocessed_dir, args.configuration, args.fold)
+    print(f"Dataset: {preprocessed_dir}")
+    print(f"Configuration: {args.configuration}, patch {list(trainer.configuration_manager.patch_size)}, "
+          f"batch {trainer.configuration_manager.batch_size}")
+    print(f"CPU cores: {cpu_count}, nnU-Net default workers: {nnunet_default}"
+          f"{f' (currently set: {user_setting})' if user_setting else ''}")
+    print("-" * 60)
+
+    results = []
+    for pin_memory in pin_settings:
+        for count in workers:
+            try:
+                result = measure(data_loader, transform, count, pin_memory, args.batches, args.warmup)
+            except Exception as e:
+                print(f"✗ {count:>3} workers, pin_memory={pin_memory}: {e}")
+                continue
+            results.append(result)
+            print(f"✓ {count:>3} workers, pin_memory={str(pin_memory):<5} -> {result['batches_per_s']:.2f} batches/s "
+                  f"({result['samples_per_s']:.2f} samples/s, start-up {result['startup_s']:.1f} s)")
+    if not results:
+        print("ERROR: No setting could be measured")
+        sys.exit(1)
+
+    # nnU-Net pins memory whenever it trains on CUDA; the worker count is what can be set
+    pin_used = torch.cuda.is_available() and pin_choice != 'off'
+    comparable = [r for r in results if r['pin_memory'] == pin_used] or results
+    best = max(comparable, key=lambda r: r['batches_per_s'])
+    recommended = min((r for r in comparable if r['batches_per_s'] >= (1 - args.tolerance) * best['batches_per_s']),
+                      key=lambda r: r['workers'])
+
+    profile = {
+        'hostname': socket.gethostname(),
+        'cpu_count': cpu_count,
+        'dataset': args.dataset,
+        'configuration': args.configuration,
+        'patch_size': list(trainer.configuration_manager.patch_size),
+        'batch_size': trainer.configuration_manager.batch_size,
+        'nnunet_default_workers': nnunet_default,
+        'recommended': {WORKERS_VARIABLE: recommended['workers'],
+                        'batches_per_s': recommended['batches_per_s'],
+                        'pin_memory': recommended['pin_memory']},
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'results': results
+    }
+    with open(args.profile, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    default_result = next((r for r in comparable if r['workers'] == nnunet_default), None)
+    print("\n" + "=" * 60)
+    print(f"Best: {best['workers']} workers, {best['batches_per_s']:.2f} batches/s")
+    print(f"Recommended: {WORKERS_VARIABLE}={recommended['workers']} ({recommended['batches_per_s']:.2f} batches/s)")
+    if default_result:
+        print(f"nnU-Net default ({nnunet_default} workers): {default_result['batches_per_s']:.2f} batches/s")
+    print(f"Profile saved: {args.profile} (applied by train_nnunet.py before each fold)")
+    print("Or set it yourself:")
+    print(f"  PowerShell: $env:{WORKERS_VARIABLE} = \"{recommended['workers']}\"")
+    print(f"  bash:       export {WORKERS_VARIABLE}={recommended['workers']}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nnU-Net data augmentation workers')
+    parser.add_argument('--dataset', default=DATASET_NAME, help=f'Preprocessed dataset (default: {DATASET_NAME})')
+    parser.add_argument('-c', '--configuration', default=CONFIGURATION, help=f'Configuration (default: {CONFIGURATION})')
+    parser.add_argument('--fold', type=int, default=0, help='Fold whose training split is loaded (default: 0)')
+    parser.add_argument('--workers', type=int, nargs='+', help='Worker counts to try (default: 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--pin-memory', choices=['both', 'on', 'off'],
+                        help='Pinned-memory settings to try (default: both with CUDA, off without)')
+    parser.add_argument('--batches', type=int, default=50, help='Timed batches per setting (default: 50)')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed batches per setting (default: 10)')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Recommend the fewest workers within this fraction of the best (default: 0.05)')
+    parser.add_argument('--profile', default=str(PROFILE_FILE), help=f'Profile to write (default: {PROFILE_FILE.name})')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net Data Augmentation Benchmark")
+    print("=" * 60)
+
+    preprocessed = os.environ.get('nnUNet_preprocessed')
+    if not preprocessed:
+        print("ERROR: nnUNet_preprocessed is not set")
+        sys.exit(1)
+    preprocessed_dir = Path(preprocessed) / args.dataset
+    if not (preprocessed_dir / f'{PLANS_NAME}.json').exists():
+        print(f"ERROR: No preprocessed plans found at {preprocessed_dir}")
+        print("Run: python preprocess_only.py")
+        sys.exit(1)
+
+    # Constructing a trainer creates its output folder; keep that out of the real results
+    scratch_results = tempfile.mkdtemp(prefix='nnunet_dataloader_benchmark_')
+    os.environ['nnUNet_results'] = scratch_results
+    verify_nnunet()
+    try:
+        benchmark(args, preprocessed_dir)
+    finally:
+        shutil.rmtree(scratch_results, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,62 @@
 """
 Check nnU-Net training progress
 Shows status of all folds and recent training metrics
+
+The training logs are parsed incrementally (see training_log_parser.py):
+--watch refreshes every fold reading only the lines appended since the last
+refresh, and --export-json / --export-csv write the per-epoch series.
+
+Examples:
+    python check_training_progress.py
+    python check_training_progress.py --watch 60 --export-csv training_progress.csv
 """
 import os
+import sys
 import json
+import time
+import argparse
 from pathlib import Path
 from datetime import datetime
 
+from training_log_parser import FoldLog, export_csv, export_json, load_class_names
+from checkpoint_metadata import fold_checkpoint_metadata
+
+DATASET_NAME = "Dataset001_LowerLimb"
+NUM_EPOCHS = 1000  # nnUNetTrainer default
+
 def set_environment_variables():
     """Set nnU-Net environment variables"""
     base_path = Path(__file__).parent.absolute()
     os.environ['nnUNet_results'] = str(base_path / 'nnUNet_results')
 
-def check_fold_status(fold_path):
-    """Check status of a single fold"""
-    fold_name = fold_path.name
-    
-    # Check for checkpoints
+def fold_status(fold_path):
+    """Status, marker and last checkpoint time of a fold"""
     checkpoint_final = fold_path / "checkpoint_final.pth"
     checkpoint_latest = fold_path / "checkpoint_latest.pth"
-    checkpoint_best = fold_path / "checkpoint_best.pth"
-    
+
     if checkpoint_final.exists():
-        status = "COMPLETED"
-        color = "✓"
-        last_update = checkpoint_final.stat().st_mtime
-    elif checkpoint_latest.exists():
-        status = "IN PROGRESS"
-        color = "⟳"
-        last_update = checkpoint_latest.stat().st_mtime
-    else:
-        status = "NOT STARTED"
-        color = "○"
-        last_update = None
+        return "COMPLETED", "✓", checkpoint_final.stat().st_mtime
+    if checkpoint_latest.exists():
+        return "IN PROGRESS", "⟳", checkpoint_latest.stat().st_mtime
+    return "NOT STARTED", "○", None
+
+def remaining_hours(records):
+    """Estimated hours left, from the mean of the last 20 epoch times"""
+    if not records:
+        return None
+    times = [r['epoch_time_s'] for r in records[-20:] if r['epoch_time_s']]
+    if not times:
+        return None
+    return (NUM_EPOCHS - 1 - records[-1]['epoch']) * sum(times) / len(times) / 3600
+
+def fmt(value, spec):
+    """A log value formatted with `spec`, or '-' when the log line was missing"""
+    return '-' if value is None else format(value, spec)
+
+def check_fold_status(fold_path, fold_log):
+    """Check status of a single fold"""
+    fold_name = fold_path.name
+    status, color, last_update = fold_status(fold_path)
     
     print(f"\n{color} {fold_name}:")
     print(f"  Status: {status}")
@@ -40,6 +64,13 @@ def check_fold_status(fold_path):
     if last_update:
         last_update_str = datetime.fromtimestamp(last_update).strftime('%Y-%m-%d %H:%M:%S')
         print(f"  Last update: {last_update_str}")
+
+    # Epoch and best EMA Dice from the checkpoint, without loading the weights
+    checkpoint = fold_checkpoint_metadata(fold_path)
+    if checkpoint:
+        best = checkpoint['best_ema_dice']
+        print(f"  Checkpoint: {checkpoint['file']}, {checkpoint['epochs_completed']} epochs"
+              f"{f', best EMA Dice {best:.4f}' if best is not None else ''}")
     
     # Check for training progress
     progress_file = fold_path / "progress.png"
@@ -51,22 +82,23 @@ def check_fold_status(fold_path):
     if validation_raw.exists():
         print(f"  Validation results: Available")
     
-    # Try to read training log for latest metrics
-    log_files = sorted(fold_path.glob("training_log*.txt"))
-    if log_files:
-        latest_log = log_files[-1]
-        try:
-            with open(latest_log, 'r') as f:
-                lines = f.readlines()
-                if len(lines) > 5:
-                    # Get last few lines with metrics
-                    print(f"  Latest log: {latest_log.name}")
-                    for line in lines[-5:]:
-                        line = line.strip()
-                        if line and ('epoch' in line.lower() or 'loss' in line.lower() or 'dice' in line.lower()):
-                            print(f"    {line[:80]}")
-        except:
-            pass
+    # Latest metrics from the training log
+    fold_log.update()
+    records = fold_log.records
+    if records:
+        last = records[-1]
+        best = [r['new_best_ema_dice'] for r in records if r['new_best_ema_dice'] is not None]
+        print(f"  Epoch: {last['epoch']} (lr {last['lr']})")
+        print(f"  Loss: train {fmt(last['train_loss'], '.4f')}, val {fmt(last['val_loss'], '.4f')}")
+        if last['mean_pseudo_dice'] is not None:
+            print(f"  Pseudo Dice: {last['mean_pseudo_dice']:.4f} "
+                  f"[{', '.join(f'{d:.2f}' for d in last['pseudo_dice'])}]")
+        if best:
+            print(f"  Best EMA pseudo Dice: {best[-1]:.4f}")
+        print(f"  Epoch time: {fmt(last['epoch_time_s'], '.1f')} s")
+        hours = remaining_hours(records)
+        if status != "COMPLETED" and hours is not None:
+            print(f"  Estimated time left: {hours:.1f} h")
     
     # Check validation summary if completed
     val_summary = fold_path / "validation_raw_postprocessed" / "summary.json"
@@ -81,7 +113,43 @@ def check_fold_status(fold_path):
     
     return status
 
+def print_watch_table(fold_paths, fold_logs):
+    """One line per fold, for --watch"""
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
+    print(f"  {'Fold':<8} {'Status':<12} {'Ckpt':>5} {'Epoch':>6} {'Train':>8} {'Val':>8} {'Dice':>7} {'s/ep':>6} "
+          f"{'Left':>7}")
+    for fold_path in fold_paths:
+        status, _, _ = fold_status(fold_path)
+        checkpoint = fold_checkpoint_metadata(fold_path)
+        saved = checkpoint['epochs_completed'] if checkpoint else '-'
+        fold_log = fold_logs[fold_path.name]
+        fold_log.update()
+        records = fold_log.records
+        if not records:
+            print(f"  {fold_path.name:<8} {status:<12} {saved:>5} {'-':>6}")
+            continue
+        last = records[-1]
+        hours = remaining_hours(records) if status != "COMPLETED" else None
+        print(f"  {fold_path.name:<8} {status:<12} {saved:>5} {last['epoch']:>6} {fmt(last['train_loss'], '.4f'):>8} "
+              f"{fmt(last['val_loss'], '.4f'):>8} {fmt(last['mean_pseudo_dice'], '.4f'):>7} "
+              f"{fmt(last['epoch_time_s'], '.1f'):>6} {f'{hours:.1f} h' if hours is not None else '-':>7}")
+
+def export(args, fold_logs, class_names):
+    if args.export_json:
+        export_json(args.export_json, fold_logs, class_names)
+    if args.export_csv:
+        export_csv(args.export_csv, fold_logs, class_names)
+
 def main():
+    parser = argparse.ArgumentParser(description='Check nnU-Net training progress')
+    parser.add_argument('--results', help='nnUNet_results folder (default: the one next to this script)')
+    parser.add_argument('--dataset', default=DATASET_NAME, help=f'Dataset folder (default: {DATASET_NAME})')
+    parser.add_argument('--watch', type=float, nargs='?', const=60, metavar='SECONDS',
+                        help='Keep refreshing all folds every SECONDS (default: 60)')
+    parser.add_argument('--export-json', help='Write the per-epoch records of all folds to this JSON file')
+    parser.add_argument('--export-csv', help='Write the per-epoch records of all folds to this CSV file')
+    args = parser.parse_args()
+
     print("=" * 60)
     print("nnU-Net Training Progress")
     print("=" * 60)
@@ -89,7 +157,7 @@ def main():
     # Set environment variables
     set_environment_variables()
     
-    results_dir = Path(os.environ['nnUNet_results']) / "Dataset001_LowerLimb"
+    results_dir = Path(args.results or os.environ['nnUNet_results']) / args.dataset
     
     if not results_dir.exists():
         print(f"\nNo training results found.")
@@ -116,11 +184,28 @@ def main():
         return
     
     print(f"\nFolds found: {len(fold_paths)}")
+
+    # Parsed logs are cached per fold, so a rerun only reads the new lines
+    fold_logs = {p.name: FoldLog(p, use_state_file=True) for p in fold_paths}
+    dataset_json = trainer_dir / "dataset.json"
+    class_names = load_class_names(dataset_json) if dataset_json.exists() else None
+
+    if args.watch:
+        print(f"Refreshing every {args.watch:g} s (Ctrl+C to stop)")
+        try:
+            while True:
+                print_watch_table(fold_paths, fold_logs)
+                export(args, fold_logs, class_names)
+                time.sleep(args.watch)
+        except KeyboardInterrupt:
+            print("\nStopped.")
+            return
     
     statuses = {}
     for fold_path in fold_paths:
-        status = check_fold_status(fold_path)
+        status = check_fold_status(fold_path, fold_logs[fold_path.name])
         statuses[fold_path.name] = status
+    export(args, fold_logs, class_names)
     
     # Summary
     print("\n" + "=" * 60)
@@ -145,6 +230,11 @@ def main():
         print(f"\nℹ Training not started or paused")
         print("  Continue: python train_nnunet.py")
     
+    if args.export_json:
+        print(f"\nEpoch records: {args.export_json}")
+    if args.export_csv:
+        print(f"\nEpoch records: {args.export_csv}")
+
     print("\nDetailed logs location:")
     print(f"  {trainer_dir}")
     print("=" * 60)
@@ -0,0 +1,259 @@
+"""
+Read nnU-Net checkpoint metadata without loading the model weights
+A checkpoint_*.pth written by torch.save is a zip archive: data.pkl holds the
+pickled dict (epoch, best EMA Dice, logging lists, init args) and the tensor
+data sits in separate data/<key> entries. This reads only data.pkl, with an
+unpickler that knows a few safe types and replaces everything else (tensors,
+storages, devices, ...) by inert placeholders, so no tensor data is read and
+no code from the file is run. torch does not need to be installed.
+
+Results are cached per file (modification time and size), so polling many
+folds repeatedly only re-reads checkpoints that changed.
+
+Examples:
+    python checkpoint_metadata.py ../nnUNet_results/Dataset001_LowerLimb/nnUNetTrainer__nnUNetPlans__3d_fullres/fold_0/checkpoint_latest.pth
+    python checkpoint_metadata.py ../nnUNet_results --json checkpoints.json
+"""
+import io
+import sys
+import json
+import time
+import pickle
+import zipfile
+import argparse
+import collections
+from pathlib import Path
+
+import numpy as np
+
+CHECKPOINT_NAMES = ('checkpoint_final.pth', 'checkpoint_latest.pth', 'checkpoint_best.pth')
+
+_cache = {}
+
+
+class Placeholder:
+    """Stands in for any object the unpickler does not rebuild (tensors, storages, devices, ...)"""
+    type_name = 'object'
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.state = None
+        self.items = {}
+
+    def __setstate__(self, state):
+        self.state = state
+
+    def __setitem__(self, key, value):
+        self.items[key] = value
+
+    def append(self, value):
+        self.items[len(self.items)] = value
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __repr__(self):
+        return f"<{self.type_name}>"
+
+
+class TensorPlaceholder(Placeholder):
+    """A tensor whose storage was not read; keeps the shape"""
+    type_name = 'tensor'
+
+    @property
+    def shape(self):
+        # _rebuild_tensor_v2(storage, storage_offset, size, stride, ...)
+        return tuple(self.args[2]) if len(self.args) > 2 else None
+
+    def __repr__(self):
+        return f"<tensor {self.shape}>"
+
+
+def placeholder_type(module, name):
+    base = TensorPlaceholder if name.startswith('_rebuild_') else Placeholder
+    return type(name, (base,), {'type_name': f'{module}.{name}'})
+
+
+def numpy_scalar(dtype, data=None):
+    """numpy.core.multiarray.scalar, as pickled for numpy floats in nnU-Net's logging"""
+    if data is None:
+        return dtype.type(0).item()
+    if isinstance(data, str):
+        data = data.encode('latin1')
+    return np.frombuffer(data, dtype=dtype, count=1)[0].item()
+
+
+def encode_bytes(text, encoding='latin1'):
+    """_codecs.encode, how protocol 2 pickles store bytes"""
+    return text.encode(encoding)
+
+
+SAFE_GLOBALS = {
+    ('collections', 'OrderedDict'): collections.OrderedDict,
+    ('collections', 'defaultdict'): collections.defaultdict,
+    ('builtins', 'set'): set,
+    ('builtins', 'frozenset'): frozenset,
+    ('builtins', 'complex'): complex,
+    ('builtins', 'slice'): slice,
+    ('_codecs', 'encode'): encode_bytes,
+    ('numpy', 'dtype'): np.dtype,
+    ('numpy.core.multiarray', 'scalar'): numpy_scalar,
+    ('numpy._core.multiarray', 'scalar'): numpy_scalar,
+}
+
+
+class MetadataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) in SAFE_GLOBALS:
+            return SAFE_GLOBALS[(module, name)]
+        return placeholder_type(module, name)
+
+    def persistent_load(self, pid):
+        # ('storage', storage_type, key, location, numel): the data stays in the zip
+        return Placeholder(*pid[1:]) if isinstance(pid, tuple) else Placeholder(pid)
+
+
+def read_data_pkl(path):
+    """The raw data.pkl bytes of a torch.save zip archive"""
+    with zipfile.ZipFile(path) as archive:
+        names = [n for n in archive.namelist() if n.endswith('/data.pkl') or n == 'data.pkl']
+        if not names:
+            raise ValueError(f"{path}: no data.pkl in the archive (not a torch.save checkpoint?)")
+        return archive.read(names[0])
+
+
+def load_checkpoint_dict(path):
+    """The pickled checkpoint dict, with placeholders for the tensors"""
+    if not zipfile.is_zipfile(path):
+        raise ValueError(f"{path}: legacy (non-zip) checkpoint format is not supported")
+    return MetadataUnpickler(io.BytesIO(read_data_pkl(path))).load()
+
+
+def last(values):
+    return values[-1] if isinstance(values, list) and values else None
+
+
+def summarize_checkpoint(checkpoint, include_logging=False):
+    """Scalar fields and the last logged epoch of an nnU-Net checkpoint dict"""
+    init_args = checkpoint.get('init_args') or {}
+    logging = checkpoint.get('logging') or {}
+    weights = checkpoint.get('network_weights')
+    metadata = {
+        # nnU-Net saves current_epoch + 1: the number of finished epochs
+        'epochs_completed': checkpoint.get('current_epoch'),
+        'best_ema_dice': checkpoint.get('_best_ema'),
+        'trainer_name': checkpoint.get('trainer_name'),
+        'fold': init_args.get('fold') if isinstance(init_args, dict) else None,
+        'configuration': init_args.get('configuration') if isinstance(init_args, dict) else None,
+        'mirroring_axes': checkpoint.get('inference_allowed_mirroring_axes'),
+        'last_epoch': {
+            'ema_fg_dice': last(logging.get('ema_fg_dice')),
+            'mean_fg_dice': last(logging.get('mean_fg_dice')),
+            'dice_per_class': last(logging.get('dice_per_class_or_region')),
+            'train_loss': last(logging.get('train_losses')),
+            'val_loss': last(logging.get('val_losses')),
+            'lr': last(logging.get('lrs')),
+            'end_timestamp': last(logging.get('epoch_end_timestamps')),
+        },
+        'weight_tensors': (sum(isinstance(v, TensorPlaceholder) for v in weights.values())
+                           if isinstance(weights, dict) else None)
+    }
+    if include_logging:
+        metadata['logging'] = logging
+    return metadata
+
+
+def read_checkpoint_metadata(path, include_logging=False):
+    """Metadata of one checkpoint; cached until the file changes"""
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path.absolute()), include_logging)
+    cached = _cache.get(key)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    metadata = summarize_checkpoint(load_checkpoint_dict(path), include_logging)
+    metadata['file'] = path.name
+    metadata['size_mb'] = round(stat.st_size / 1024 ** 2, 1)
+    metadata['modified'] = stat.st_mtime
+    _cache[key] = ((stat.st_mtime_ns, stat.st_size), metadata)
+    return metadata
+
+
+def fold_checkpoint_metadata(fold_dir):
+    """Metadata of the most advanced checkpoint of a fold (final, else latest, else best), or None"""
+    for name in CHECKPOINT_NAMES:
+        checkpoint = Path(fold_dir) / name
+        if checkpoint.exists():
+            try:
+                return read_checkpoint_metadata(checkpoint)
+            except (OSError, ValueError, pickle.UnpicklingError, EOFError, zipfile.BadZipFile):
+                # Being written by the trainer right now: try the next one
+                continue
+    return None
+
+
+def to_plain(value):
+    """JSON-friendly copy: placeholders become their repr, tuples lists"""
+    if isinstance(value, Placeholder):
+        return repr(value)
+    if isinstance(value, dict):
+        return {str(k): to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_plain(v) for v in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def find_checkpoints(paths):
+    checkpoints = []
+    for path in map(Path, paths):
+        if path.is_file():
+            checkpoints.append(path)
+        else:
+            checkpoints.extend(sorted(p for name in CHECKPOINT_NAMES for p in path.rglob(name)))
+    return checkpoints
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read nnU-Net checkpoint metadata without the model weights')
+    parser.add_argument('paths', nargs='+', help='Checkpoint files, or folders to search for checkpoint_*.pth')
+    parser.add_argument('--logging', action='store_true', help='Include the full per-epoch logging lists')
+    parser.add_argument('--json', help='Write the metadata to this JSON file')
+    args = parser.parse_args()
+
+    checkpoints = find_checkpoints(args.paths)
+    if not checkpoints:
+        print("ERROR: No checkpoints found")
+        sys.exit(1)
+
+    results = {}
+    failed = 0
+    for checkpoint in checkpoints:
+        start = time.perf_counter()
+        try:
+            metadata = read_checkpoint_metadata(checkpoint, args.logging)
+        except Exception as e:
+            failed += 1
+            print(f"✗ {checkpoint}: {e}")
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+        results[str(checkpoint)] = metadata
+        best = metadata['best_ema_dice']
+        print(f"✓ {checkpoint.parent.name}/{checkpoint.name}: {metadata['epochs_completed']} epochs, "
+              f"best EMA Dice {best if best is None else f'{best:.4f}'} "
+              f"({metadata['size_mb']} MB file, metadata read in {elapsed:.1f} ms)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(to_plain(results), f, indent=2)
+        print(f"Metadata: {args.json}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
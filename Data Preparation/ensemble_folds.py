@@ -0,0 +1,260 @@
+"""
+Ensemble nnU-Net fold predictions with bounded memory
+Averages the softmax probabilities (.npz, from --save_probabilities) of each
+fold and writes the argmax label map, like nnUNetv2_ensemble, without ever
+holding a full multi-class volume in memory:
+
+  - folds are added one at a time to a running sum kept in a disk-backed
+    float16 array, streamed out of each .npz in z-slabs
+  - the label map is computed and written to the .nii.gz slab by slab
+  - stray islands are removed from the label map before writing: only the
+    largest connected component of each bone is kept (--keep-islands skips it)
+
+Peak memory is a few slabs per case, whatever the number of folds, plus the
+bounding box of one label while islands are removed.
+
+Example:
+    python ensemble_folds.py -i preds_fold_0 preds_fold_1 preds_fold_2 preds_fold_3 preds_fold_4 \\
+        -o nnUNet_preds_ensemble --workers 4
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import pickle
+import zipfile
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+PROBABILITIES_MEMBER = 'probabilities.npy'
+# Labels that are not single bones, so may have several components
+ISLAND_SKIP_LABEL_NAMES = ('Threshold-200-MAX',)
+ISLAND_SKIP_LABELS_DEFAULT = (8,)
+
+
+def read_exact(stream, num_bytes):
+    """Read exactly num_bytes from a (decompressing) stream"""
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < num_bytes:
+        chunk = stream.read(num_bytes - filled)
+        if not chunk:
+            raise EOFError(f"Unexpected end of data ({filled}/{num_bytes} bytes)")
+        view[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+    return buffer
+
+
+def open_probabilities(npz_path):
+    """Open the probability array of an .npz as a stream; returns (zip, stream, shape, dtype)"""
+    archive = zipfile.ZipFile(npz_path)
+    stream = archive.open(PROBABILITIES_MEMBER)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order or len(shape) != 4:
+        archive.close()
+        raise ValueError(f"{npz_path}: expected a C-ordered (classes, z, y, x) array, got {shape}")
+    return archive, stream, shape, dtype
+
+
+def read_affine(fold_dirs, case):
+    """Affine of the original image, from nnU-Net's .pkl properties or a predicted .nii.gz"""
+    for fold_dir in fold_dirs:
+        properties_file = Path(fold_dir) / f"{case}.pkl"
+        if properties_file.exists():
+            with open(properties_file, 'rb') as f:
+                properties = pickle.load(f)
+            nibabel_stuff = properties.get('nibabel_stuff', {})
+            if 'original_affine' in nibabel_stuff:
+                return np.asarray(nibabel_stuff['original_affine'])
+        segmentation = Path(fold_dir) / f"{case}.nii.gz"
+        if segmentation.exists():
+            return nib.load(str(segmentation)).affine
+    raise FileNotFoundError(f"No {case}.pkl or {case}.nii.gz found to take the image geometry from")
+
+
+def read_island_skip_labels(fold_dirs):
+    """Label IDs exempt from island removal, from the dataset.json nnU-Net writes next to its predictions"""
+    for fold_dir in fold_dirs:
+        dataset_file = Path(fold_dir) / 'dataset.json'
+        if dataset_file.exists():
+            with open(dataset_file) as f:
+                labels = json.load(f).get('labels', {})
+            return tuple(int(labels[name]) for name in ISLAND_SKIP_LABEL_NAMES if name in labels)
+    return ISLAND_SKIP_LABELS_DEFAULT
+
+
+def remove_islands(labels, skip_labels=()):
+    """Keep only the largest connected component of each label, in place; returns the voxels removed"""
+    removed = 0
+    for label, box in enumerate(ndimage.find_objects(labels), start=1):
+        if box is None or label in skip_labels:
+            continue
+        region = labels[box]
+        components, count = ndimage.label(region == label)
+        if count < 2:
+            continue
+        sizes = np.bincount(components.ravel())
+        sizes[0] = 0
+        islands = (components > 0) & (components != np.argmax(sizes))
+        removed += int(islands.sum())
+        region[islands] = 0
+    return removed
+
+
+def write_nifti_header(f, spatial_shape, affine):
+    """Write a uint8 NIfTI header for a (z, y, x) C-ordered array, i.e. nibabel (x, y, z)"""
+    header = nib.Nifti1Header()
+    header.set_data_dtype(np.uint8)
+    header.set_data_shape(spatial_shape[::-1])
+    header.set_qform(affine, code=1)
+    header.set_sform(affine, code=1)
+    header.set_xyzt_units('mm')
+    header['vox_offset'] = 352
+    f.write(header.binaryblock)
+    f.write(b'\x00' * 4)  # no extensions
+
+
+def ensemble_case(case, fold_dirs, output_dir, slab=16, accumulator_dtype='float16', tmp_dir=None,
+                  keep_islands=False):
+    """Average one case over all folds and write {case}.nii.gz; runs in a worker process"""
+    start = time.time()
+    npz_files = [Path(d) / f"{case}.npz" for d in fold_dirs]
+    affine = read_affine(fold_dirs, case)
+    output_file = Path(output_dir) / f"{case}.nii.gz"
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        running_sum = None
+        for fold_index, npz_file in enumerate(npz_files):
+            archive, stream, shape, dtype = open_probabilities(npz_file)
+            try:
+                if running_sum is None:
+                    running_sum = np.lib.format.open_memmap(os.path.join(work_dir, 'sum.npy'), mode='w+',
+                                                            dtype=accumulator_dtype, shape=shape)
+                elif tuple(shape) != running_sum.shape:
+                    raise ValueError(f"{npz_file}: shape {shape} differs from {running_sum.shape}")
+
+                num_classes, depth = shape[0], shape[1]
+                # Classes are stored one after the other, each as z-slabs of (y, x)
+                for c in range(num_classes):
+                    for z in range(0, depth, slab):
+                        z_end = min(z + slab, depth)
+                        count = (z_end - z) * shape[2] * shape[3]
+                        chunk = np.frombuffer(read_exact(stream, count * dtype.itemsize), dtype=dtype)
+                        chunk = chunk.reshape(z_end - z, shape[2], shape[3])
+                        if fold_index == 0:
+                            running_sum[c, z:z_end] = chunk
+                        else:
+                            running_sum[c, z:z_end] = running_sum[c, z:z_end].astype(np.float32) + chunk
+            finally:
+                stream.close()
+                archive.close()
+
+        # The argmax of the sum is the argmax of the mean
+        num_classes, depth = running_sum.shape[:2]
+        if num_classes > 256:
+            raise ValueError(f"{case}: {num_classes} classes do not fit a uint8 label map")
+        # The label map is kept on disk next to the running sum, so islands can be removed before writing
+        labels = np.lib.format.open_memmap(os.path.join(work_dir, 'labels.npy'), mode='w+',
+                                           dtype=np.uint8, shape=running_sum.shape[1:])
+        for z in range(0, depth, slab):
+            labels[z:z + slab] = np.argmax(running_sum[:, z:z + slab], axis=0)
+        del running_sum
+        removed = 0 if keep_islands else remove_islands(labels, read_island_skip_labels(fold_dirs))
+
+        label_counts = np.zeros(num_classes, dtype=np.int64)
+        tmp_output = output_file.with_name(f".{output_file.name}")
+        with gzip.open(tmp_output, 'wb', compresslevel=6) as f:
+            write_nifti_header(f, labels.shape, affine)
+            for z in range(0, depth, slab):
+                label_counts += np.bincount(labels[z:z + slab].ravel(), minlength=num_classes)
+                f.write(np.ascontiguousarray(labels[z:z + slab]).tobytes())
+        tmp_output.replace(output_file)
+        del labels
+
+    return {
+        'case': case,
+        'shape': list(shape[1:]),
+        'labels': [int(i) for i in np.flatnonzero(label_counts[1:]) + 1],
+        'removed_voxels': removed,
+        'seconds': round(time.time() - start, 2)
+    }
+
+
+def find_cases(fold_dirs):
+    """Cases with probabilities in every fold folder, and those missing in some"""
+    per_fold = [{p.name[:-len('.npz')] for p in Path(d).glob('*.npz')} for d in fold_dirs]
+    common = set.intersection(*per_fold) if per_fold else set()
+    incomplete = set.union(*per_fold) - common if per_fold else set()
+    return sorted(common), sorted(incomplete)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ensemble nnU-Net fold probabilities with bounded memory')
+    parser.add_argument('-i', '--inputs', nargs='+', required=True,
+                       help='Prediction folders of the folds (with .npz probabilities)')
+    parser.add_argument('-o', '--output', required=True, help='Output folder for the ensembled .nii.gz')
+    parser.add_argument('--workers', type=int, default=2, help='Cases processed in parallel (default: 2)')
+    parser.add_argument('--slab', type=int, default=16, help='z-slices per slab (default: 16)')
+    parser.add_argument('--precision', choices=['float16', 'float32'], default='float16',
+                       help='Precision of the running sum (default: float16)')
+    parser.add_argument('--tmp-dir', help='Where to keep the running sums (default: system temp dir)')
+    parser.add_argument('--keep-islands', action='store_true',
+                       help='Write the argmax as is, without keeping only the largest component of each bone')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net Fold Ensembling")
+    print("=" * 60)
+
+    for fold_dir in args.inputs:
+        if not Path(fold_dir).is_dir():
+            print(f"ERROR: Folder not found: {fold_dir}")
+            sys.exit(1)
+
+    cases, incomplete = find_cases(args.inputs)
+    print(f"Folds: {len(args.inputs)}")
+    print(f"Cases: {len(cases)}")
+    if incomplete:
+        print(f"WARNING: Skipping {len(incomplete)} cases missing in some folds: {', '.join(incomplete[:5])}"
+              f"{' ...' if len(incomplete) > 5 else ''}")
+    if not cases:
+        print("ERROR: No cases with probabilities in every fold (predict with --save_probabilities)")
+        sys.exit(1)
+
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(ensemble_case, case, args.inputs, args.output, args.slab, args.precision,
+                               args.tmp_dir, args.keep_islands): case for case in cases}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                print(f"✓ {result['case']}: {result['shape']} labels {result['labels']}, "
+                      f"{result['removed_voxels']} island voxels removed ({result['seconds']:.1f} s)")
+            except Exception as e:
+                failed += 1
+                print(f"✗ {futures[future]}: {e}")
+
+    print("=" * 60)
+    print(f"Ensembled: {len(cases) - failed}/{len(cases)} in {time.time() - start:.1f} s")
+    print(f"Output: {args.output}")
+    print("=" * 60)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Evaluate nnU-Net predictions against the ground-truth labels
+Scores every case in a prediction folder against labelsTr:
+
+  - Dice, IoU and voxel counts for all labels from one confusion matrix per
+    case (a single np.bincount over gt * K + pred)
+  - HD95 and ASSD (mm) from distance transforms of each label's surfaces,
+    restricted to the box around that label in either volume. A label
+    present in only one of the two volumes (a missed or a spurious bone)
+    scores the worst case, the image diagonal in mm, so that it raises the
+    cohort means instead of dropping out of them; the summary also counts
+    those cases per label.
+
+Cases are scored in parallel. Writes per_case.csv, per_label.csv and
+summary.json (cohort means) to the output folder.
+
+Example:
+    python evaluate_predictions.py --pred ../nnUNet_preds --workers 4
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+CASE_COLUMNS = ['case', 'label', 'name', 'dice', 'iou', 'hd95_mm', 'assd_mm',
+                'gt_voxels', 'pred_voxels', 'true_positive', 'false_positive', 'false_negative']
+
+
+def default_paths():
+    base_path = Path(__file__).parent.absolute()
+    return (base_path.parent / 'nnUNet_preds',
+            base_path / 'nnUNet_raw_data_new' / 'Dataset001_PelvisThighs' / 'labelsTr')
+
+
+def load_labels(dataset_json):
+    """Label id -> name from an nnU-Net dataset.json"""
+    with open(dataset_json, 'r') as f:
+        labels = json.load(f)['labels']
+    return {int(v): k for k, v in labels.items()}
+
+
+def load_segmentation(path):
+    image = nib.load(str(path))
+    data = np.asanyarray(image.dataobj)
+    if not np.issubdtype(data.dtype, np.integer):
+        data = np.rint(data)
+    return data.astype(np.uint8), np.asarray(image.header.get_zooms()[:3], dtype=np.float64)
+
+
+def surface_distances(gt_mask, pred_mask, spacing):
+    """Distances (mm) from each surface voxel of one mask to the other mask's surface, both ways"""
+    gt_surface = gt_mask & ~ndimage.binary_erosion(gt_mask)
+    pred_surface = pred_mask & ~ndimage.binary_erosion(pred_mask)
+    to_gt = ndimage.distance_transform_edt(~gt_surface, sampling=spacing)
+    to_pred = ndimage.distance_transform_edt(~pred_surface, sampling=spacing)
+    return to_gt[pred_surface], to_pred[gt_surface]
+
+
+def union_box(a, b):
+    boxes = [box for box in (a, b) if box is not None]
+    return tuple(slice(min(box[i].start for box in boxes), max(box[i].stop for box in boxes))
+                 for i in range(3))
+
+
+def evaluate_case(case, pred_file, gt_file, labels):
+    """Score one case; runs in a worker process"""
+    start = time.time()
+    pred, spacing = load_segmentation(pred_file)
+    gt, _ = load_segmentation(gt_file)
+    if pred.shape != gt.shape:
+        raise ValueError(f"Shape mismatch: prediction {pred.shape} vs ground truth {gt.shape}")
+
+    k = max(max(labels), int(gt.max()), int(pred.max())) + 1
+    # Rows: ground truth, columns: prediction
+    confusion = np.bincount((gt.astype(np.int32) * k + pred).ravel(), minlength=k * k).reshape(k, k)
+
+    gt_boxes = ndimage.find_objects(gt, max_label=k - 1)
+    pred_boxes = ndimage.find_objects(pred, max_label=k - 1)
+    # Worst-case surface distance, for a label found in only one of the volumes
+    diagonal = float(np.linalg.norm(np.asarray(gt.shape) * spacing))
+
+    rows = []
+    for label_id, name in labels.items():
+        if label_id == 0:
+            continue
+        tp = int(confusion[label_id, label_id])
+        fn = int(confusion[label_id].sum()) - tp
+        fp = int(confusion[:, label_id].sum()) - tp
+        gt_voxels, pred_voxels = tp + fn, tp + fp
+
+        row = {
+            'case': case, 'label': label_id, 'name': name,
+            # Undefined when the label is absent from both, as in nnU-Net's summary
+            'dice': 2 * tp / (2 * tp + fp + fn) if gt_voxels + pred_voxels else float('nan'),
+            'iou': tp / (tp + fp + fn) if gt_voxels + pred_voxels else float('nan'),
+            'hd95_mm': float('nan'), 'assd_mm': float('nan'),
+            'gt_voxels': gt_voxels, 'pred_voxels': pred_voxels,
+            'true_positive': tp, 'false_positive': fp, 'false_negative': fn
+        }
+        if gt_voxels and pred_voxels:
+            box = union_box(gt_boxes[label_id - 1], pred_boxes[label_id - 1])
+            to_gt, to_pred = surface_distances(gt[box] == label_id, pred[box] == label_id, spacing)
+            distances = np.concatenate([to_gt, to_pred])
+            row['hd95_mm'] = float(np.percentile(distances, 95))
+            row['assd_mm'] = float((to_gt.mean() + to_pred.mean()) / 2)
+        elif gt_voxels or pred_voxels:
+            row['hd95_mm'] = row['assd_mm'] = diagonal
+        rows.append(row)
+
+    return {'case': case, 'rows': rows, 'seconds': round(time.time() - start, 2)}
+
+
+def summarize(rows, labels):
+    """Per-label cohort statistics and the foreground mean over labels"""
+    per_label = []
+    for label_id, name in labels.items():
+        if label_id == 0:
+            continue
+        label_rows = [r for r in rows if r['label'] == label_id]
+        stats = {'label': label_id, 'name': name, 'cases': len(label_rows),
+                 'missed': sum(1 for r in label_rows if r['gt_voxels'] and not r['pred_voxels']),
+                 'spurious': sum(1 for r in label_rows if r['pred_voxels'] and not r['gt_voxels'])}
+        for metric in ('dice', 'iou', 'hd95_mm', 'assd_mm'):
+            values = np.array([r[metric] for r in label_rows], dtype=np.float64)
+            values = values[~np.isnan(values)]
+            stats[f'{metric}_mean'] = float(values.mean()) if len(values) else float('nan')
+            stats[f'{metric}_std'] = float(values.std()) if len(values) else float('nan')
+            stats[f'{metric}_median'] = float(np.median(values)) if len(values) else float('nan')
+        per_label.append(stats)
+
+    foreground = {}
+    for metric in ('dice', 'iou', 'hd95_mm', 'assd_mm'):
+        means = [s[f'{metric}_mean'] for s in per_label if not np.isnan(s[f'{metric}_mean'])]
+        foreground[metric] = float(np.mean(means)) if means else float('nan')
+    return per_label, foreground
+
+
+def write_csv(path, rows, columns):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({c: (round(row[c], 6) if isinstance(row[c], float) else row[c]) for c in columns})
+
+
+def to_json(value):
+    """NaN is not valid JSON; write null instead"""
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {k: to_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    return value
+
+
+def main():
+    default_pred, default_gt = default_paths()
+    parser = argparse.ArgumentParser(description='Evaluate nnU-Net predictions against ground-truth labels')
+    parser.add_argument('--pred', default=str(default_pred), help=f'Prediction folder (default: {default_pred})')
+    parser.add_argument('--gt', default=str(default_gt), help=f'Ground-truth folder (default: {default_gt})')
+    parser.add_argument('--dataset-json', help='dataset.json with the label names (default: the one in --pred)')
+    parser.add_argument('--output', help='Output folder (default: <pred>/evaluation)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net Prediction Evaluation")
+    print("=" * 60)
+
+    pred_dir, gt_dir = Path(args.pred), Path(args.gt)
+    dataset_json = Path(args.dataset_json) if args.dataset_json else pred_dir / 'dataset.json'
+    if not dataset_json.exists():
+        print(f"ERROR: dataset.json not found: {dataset_json}")
+        sys.exit(1)
+    if not gt_dir.is_dir():
+        print(f"ERROR: Ground-truth folder not found: {gt_dir}")
+        sys.exit(1)
+    labels = load_labels(dataset_json)
+
+    cases = []
+    missing = []
+    for pred_file in sorted(pred_dir.glob('*.nii.gz')):
+        gt_file = gt_dir / pred_file.name
+        if gt_file.exists():
+            cases.append((pred_file.name[:-len('.nii.gz')], pred_file, gt_file))
+        else:
+            missing.append(pred_file.name)
+    print(f"Predictions: {pred_dir}")
+    print(f"Ground truth: {gt_dir}")
+    print(f"Cases: {len(cases)}")
+    if missing:
+        print(f"WARNING: No ground truth for {len(missing)} predictions: {', '.join(missing[:5])}"
+              f"{' ...' if len(missing) > 5 else ''}")
+    if not cases:
+        print("ERROR: Nothing to evaluate")
+        sys.exit(1)
+
+    output_dir = Path(args.output) if args.output else pred_dir / 'evaluation'
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.time()
+    rows = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(evaluate_case, case, pred_file, gt_file, labels): case
+                   for case, pred_file, gt_file in cases}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"✗ {futures[future]}: {e}")
+                continue
+            dice = [r['dice'] for r in result['rows'] if not np.isnan(r['dice'])]
+            print(f"✓ {result['case']}: mean Dice {np.mean(dice) if dice else float('nan'):.4f} "
+                  f"({result['seconds']:.1f} s)")
+            rows.extend(result['rows'])
+
+    rows.sort(key=lambda r: (r['case'], r['label']))
+    per_label, foreground = summarize(rows, labels)
+
+    write_csv(output_dir / 'per_case.csv', rows, CASE_COLUMNS)
+    write_csv(output_dir / 'per_label.csv', per_label, list(per_label[0].keys()))
+    with open(output_dir / 'summary.json', 'w') as f:
+        json.dump(to_json({
+            'prediction_folder': str(pred_dir),
+            'ground_truth_folder': str(gt_dir),
+            'cases': len(cases) - len(failed),
+            'failed_cases': sorted(failed),
+            'foreground_mean': foreground,
+            'per_label': per_label
+        }), f, indent=2)
+
+    print("\n" + "=" * 60)
+    print(f"{'Label':<20} {'Dice':>8} {'IoU':>8} {'HD95 mm':>9} {'ASSD mm':>9} {'Missed':>7}")
+    print("-" * 60)
+    for s in per_label:
+        print(f"{s['name']:<20} {s['dice_mean']:>8.4f} {s['iou_mean']:>8.4f} "
+              f"{s['hd95_mm_mean']:>9.2f} {s['assd_mm_mean']:>9.2f} {s['missed']:>7}")
+    print("-" * 60)
+    print(f"{'Foreground mean':<20} {foreground['dice']:>8.4f} {foreground['iou']:>8.4f} "
+          f"{foreground['hd95_mm']:>9.2f} {foreground['assd_mm']:>9.2f}")
+    print("=" * 60)
+    missed, spurious = sum(s['missed'] for s in per_label), sum(s['spurious'] for s in per_label)
+    if missed or spurious:
+        print(f"Missed labels: {missed}, spurious labels: {spurious} "
+              f"(scored at the image diagonal for HD95 / ASSD)")
+    print(f"Evaluated {len(cases) - len(failed)}/{len(cases)} cases in {time.time() - start:.1f} s")
+    print(f"Results: {output_dir}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Train nnU-Net folds concurrently on a set of resource slots
+Each fold is a job. Jobs run on slots (one GPU each, or a set of CPU cores)
+as soon as one is free:
+
+  - a fold with checkpoint_final.pth is skipped, one with
+    checkpoint_latest.pth is resumed (--c)
+  - a failed fold is retried (resuming from its latest checkpoint) up to
+    --retries times, while the other folds keep going
+  - the output of each fold goes to its own log file (appended per attempt)
+  - the augmentation workers recommended by benchmark_dataloader.py are
+    shared between the concurrent folds: a CPU slot gets at most one per
+    core, GPU slots split the recommendation evenly
+
+The command is a template, so a stub trainer can stand in for nnUNetv2_train:
+{fold}, {dataset}, {configuration} and {device} are filled in, and
+--resume-flag is appended when resuming.
+
+Examples:
+    python fold_scheduler.py --gpus 0 1
+    python fold_scheduler.py --cpu-sets 0-15 16-31 --folds 3 4
+    python fold_scheduler.py --command "python stub_trainer.py {fold}" --trainer-dir /tmp/results --retries 1
+"""
+import os
+import sys
+import time
+import shlex
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+from checkpoint_metadata import fold_checkpoint_metadata
+from benchmark_dataloader import recommended_dataloader_workers, WORKERS_VARIABLE
+
+DATASET_ID = '1'
+DATASET_NAME = 'Dataset001_LowerLimb'
+CONFIGURATION = '3d_fullres'
+TRAINER_FOLDER = 'nnUNetTrainer__nnUNetPlans__3d_fullres'
+DEFAULT_COMMAND = 'nnUNetv2_train {dataset} {configuration} {fold} --npz -device {device}'
+POLL_SECONDS = 1.0
+
+
+def default_trainer_dir():
+    base_path = Path(__file__).parent.absolute()
+    results = os.environ.get('nnUNet_results', str(base_path / 'nnUNet_results'))
+    return Path(results) / DATASET_NAME / TRAINER_FOLDER
+
+
+def parse_cores(spec):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    cores = []
+    for part in spec.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+class Slot:
+    """Where a fold runs: a GPU, a set of CPU cores, or the inherited environment"""
+
+    def __init__(self, name, device='cuda', env=None, cores=None):
+        self.name = name
+        self.device = device
+        self.env = env or {}
+        self.cores = cores
+        self.job = None
+
+    @classmethod
+    def gpu(cls, gpu_id):
+        return cls(f'gpu{gpu_id}', 'cuda', {'CUDA_VISIBLE_DEVICES': str(gpu_id)})
+
+    @classmethod
+    def cpu(cls, spec):
+        cores = parse_cores(spec)
+        threads = str(len(cores))
+        return cls(f'cpu{spec}', 'cpu', {'CUDA_VISIBLE_DEVICES': '', 'OMP_NUM_THREADS': threads,
+                                         'MKL_NUM_THREADS': threads}, cores)
+
+    def share_dataloader_workers(self, recommended, concurrent):
+        """nnUNet_n_proc_DA for this slot: the benchmark measured one fold with the whole machine"""
+        if self.cores:
+            workers = min(recommended, len(self.cores))
+        else:
+            workers = max(1, recommended // concurrent)
+        self.env[WORKERS_VARIABLE] = str(workers)
+        return workers
+
+    def preexec(self):
+        """Pin the child to the slot's cores (Linux only)"""
+        if self.cores and hasattr(os, 'sched_setaffinity'):
+            cores = self.cores
+            return lambda: os.sched_setaffinity(0, cores)
+        return None
+
+
+class FoldJob:
+    def __init__(self, fold, fold_dir, log_file):
+        self.fold = fold
+        self.fold_dir = fold_dir
+        self.log_file = log_file
+        self.status = 'pending'
+        self.attempts = 0
+        self.returncode = None
+        self.process = None
+        self.log = None
+        self.started = None
+        self.not_before = 0.0
+        self.seconds = 0.0
+
+
+class FoldScheduler:
+    def __init__(self, folds, slots, trainer_dir, log_dir, command=DEFAULT_COMMAND, resume_flag='--c',
+                 retries=2, retry_delay=30.0, dataset=DATASET_ID, configuration=CONFIGURATION):
+        self.slots = slots
+        self.command = command
+        self.resume_flag = resume_flag
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dataset = dataset
+        self.configuration = configuration
+        log_dir = Path(log_dir)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs = [FoldJob(fold, Path(trainer_dir) / f'fold_{fold}', log_dir / f'fold_{fold}.log')
+                     for fold in folds]
+
+    def build_command(self, job, slot, resume):
+        cmd = shlex.split(self.command.format(fold=job.fold, dataset=self.dataset,
+                                              configuration=self.configuration, device=slot.device))
+        if resume and self.resume_flag:
+            cmd.append(self.resume_flag)
+        return cmd
+
+    def start(self, job, slot):
+        if (job.fold_dir / 'checkpoint_final.pth').exists():
+            job.status = 'done'
+            print(f"✓ fold {job.fold}: already completed (checkpoint_final.pth), skipping")
+            return
+
+        resume = (job.fold_dir / 'checkpoint_latest.pth').exists()
+        cmd = self.build_command(job, slot, resume)
+        job.attempts += 1
+        job.log = open(job.log_file, 'a')
+        job.log.write(f"\n===== {datetime.now().isoformat(timespec='seconds')} attempt {job.attempts} "
+                      f"on {slot.name}: {' '.join(cmd)}\n")
+        job.log.flush()
+
+        if resume:
+            checkpoint = fold_checkpoint_metadata(job.fold_dir)
+            epoch = f" from epoch {checkpoint['epochs_completed']}" if checkpoint else ''
+            print(f"⟳ fold {job.fold}: resuming{epoch} on {slot.name} (attempt {job.attempts})")
+        else:
+            print(f"▶ fold {job.fold}: starting on {slot.name} (attempt {job.attempts})")
+
+        try:
+            job.process = subprocess.Popen(cmd, stdout=job.log, stderr=subprocess.STDOUT,
+                                           env=dict(os.environ, **slot.env), preexec_fn=slot.preexec())
+        except (OSError, subprocess.SubprocessError) as e:
+            job.log.write(f"Could not start: {e}\n")
+            job.log.close()
+            self.finished(job, error=str(e))
+            return
+        job.status = 'running'
+        job.started = time.time()
+        slot.job = job
+
+    def release(self, job, slot):
+        """Close the log of a job whose process has exited and free its slot"""
+        slot.job = None
+        job.returncode = job.process.returncode
+        job.seconds += time.time() - job.started
+        job.log.close()
+        job.process = None
+
+    def finished(self, job, error=None):
+        if job.returncode == 0 and error is None:
+            job.status = 'done'
+            print(f"✓ fold {job.fold}: completed ({job.seconds / 3600:.1f} h)")
+        elif job.attempts <= self.retries:
+            job.status = 'pending'
+            job.not_before = time.time() + self.retry_delay
+            print(f"✗ fold {job.fold}: failed ({error or f'exit code {job.returncode}'}), "
+                  f"retrying in {self.retry_delay:g} s; see {job.log_file}")
+        else:
+            job.status = 'failed'
+            print(f"✗ fold {job.fold}: failed after {job.attempts} attempts; see {job.log_file}")
+
+    def run(self):
+        """Run every job to completion or final failure; returns True if all folds are done"""
+        try:
+            while True:
+                for slot in self.slots:
+                    if slot.job is not None and slot.job.process.poll() is not None:
+                        job = slot.job
+                        self.release(job, slot)
+                        self.finished(job)
+
+                now = time.time()
+                for slot in self.slots:
+                    while slot.job is None:
+                        job = next((j for j in self.jobs if j.status == 'pending' and j.not_before <= now), None)
+                        if job is None:
+                            break
+                        self.start(job, slot)
+
+                if all(j.status in ('done', 'failed') for j in self.jobs):
+                    break
+                time.sleep(POLL_SECONDS)
+        except KeyboardInterrupt:
+            print("\nInterrupted: stopping running folds (they resume from checkpoint_latest.pth next time)")
+            running = [(slot.job, slot) for slot in self.slots if slot.job is not None]
+            for job, _ in running:
+                job.process.terminate()
+            for job, slot in running:
+                job.process.wait()
+                self.release(job, slot)
+                job.status = 'interrupted'
+        return all(j.status == 'done' for j in self.jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train nnU-Net folds concurrently on GPUs or CPU core sets')
+    parser.add_argument('--folds', type=int, nargs='+', default=[0, 1, 2, 3, 4], help='Folds to train (default: 0-4)')
+    parser.add_argument('--gpus', nargs='+', help='One slot per GPU id, e.g. --gpus 0 1')
+    parser.add_argument('--cpu-sets', nargs='+', help='One slot per CPU core set, e.g. --cpu-sets 0-15 16-31')
+    parser.add_argument('--retries', type=int, default=2, help='Retries per failed fold (default: 2)')
+    parser.add_argument('--retry-delay', type=float, default=30, help='Seconds before a retry (default: 30)')
+    parser.add_argument('--trainer-dir', default=str(default_trainer_dir()),
+                        help='Results folder with the fold_N directories (for skip / resume)')
+    parser.add_argument('--log-dir', default='fold_logs', help='Folder for the per-fold logs (default: fold_logs)')
+    parser.add_argument('--command', default=DEFAULT_COMMAND, help=f'Command template (default: "{DEFAULT_COMMAND}")')
+    parser.add_argument('--resume-flag', default='--c', help='Appended to the command when resuming (default: --c)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net Fold Scheduler")
+    print("=" * 60)
+
+    slots = [Slot.gpu(g) for g in args.gpus or []] + [Slot.cpu(c) for c in args.cpu_sets or []]
+    if not slots:
+        slots = [Slot('default')]
+    try:
+        scheduler = FoldScheduler(args.folds, slots, args.trainer_dir, args.log_dir, args.command,
+                                  args.resume_flag, args.retries, args.retry_delay)
+        scheduler.build_command(scheduler.jobs[0], slots[0], False)
+    except (KeyError, IndexError, ValueError) as e:
+        print(f"ERROR: Invalid command template: {e}")
+        sys.exit(1)
+
+    print(f"Folds: {', '.join(map(str, args.folds))}")
+    print(f"Slots: {', '.join(s.name for s in slots)}")
+    print(f"Logs: {Path(args.log_dir).absolute()}")
+    # Augmentation workers per fold, from benchmark_dataloader.py if it was run on this machine
+    if WORKERS_VARIABLE in os.environ:
+        print(f"{WORKERS_VARIABLE}: {os.environ[WORKERS_VARIABLE]} per fold (set in the environment)")
+    else:
+        recommended = recommended_dataloader_workers()
+        if recommended is not None:
+            concurrent = min(len(slots), len(args.folds))
+            shares = [f"{slot.name}={slot.share_dataloader_workers(recommended, concurrent)}" for slot in slots]
+            print(f"{WORKERS_VARIABLE}: {', '.join(shares)} (benchmark recommends {recommended} for one fold)")
+    print("-" * 60)
+
+    start = time.time()
+    success = scheduler.run()
+
+    print("\n" + "=" * 60)
+    print(f"{'Fold':<6} {'Status':<12} {'Attempts':>8} {'Hours':>7}")
+    for job in scheduler.jobs:
+        print(f"{job.fold:<6} {job.status:<12} {job.attempts:>8} {job.seconds / 3600:>7.2f}")
+    print(f"Wall time: {(time.time() - start) / 3600:.2f} h")
+    print("=" * 60)
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
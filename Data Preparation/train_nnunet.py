@@ -7,6 +7,8 @@ import sys
 import subprocess
 from pathlib import Path
 
+from benchmark_dataloader import apply_dataloader_profile
+
 def set_environment_variables():
     """Set nnU-Net environment variables"""
     base_path = Path(__file__).parent.absolute()
@@ -146,6 +148,9 @@ def train_fold(fold, continue_training=False):
     
     if continue_training:
         cmd.append('--c')
+
+    # Augmentation workers from benchmark_dataloader.py, if it was run on this machine
+    apply_dataloader_profile()
     
     try:
         result = subprocess.run(cmd, check=False)
@@ -177,6 +182,7 @@ def train_all_folds(start_fold=0):
         if not success:
             print(f"\nTraining stopped at fold {fold}.")
             print(f"To resume, run: python train_single_fold.py --fold {fold}")
+            print(f"Or resume and retry the remaining folds: python fold_scheduler.py --folds {' '.join(map(str, range(fold, 5)))}")
             return False
     
     print("\n" + "=" * 60)
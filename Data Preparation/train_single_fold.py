@@ -8,6 +8,8 @@ import argparse
 import subprocess
 from pathlib import Path
 
+from benchmark_dataloader import apply_dataloader_profile
+
 def set_environment_variables():
     """Set nnU-Net environment variables"""
     base_path = Path(__file__).parent.absolute()
@@ -47,6 +49,9 @@ def train_fold(fold, continue_training=False):
     if continue_training:
         cmd.append('--c')
         print("Continuing from previous checkpoint...")
+
+    # Augmentation workers from benchmark_dataloader.py, if it was run on this machine
+    apply_dataloader_profile()
     
     try:
         result = subprocess.run(cmd, check=False)
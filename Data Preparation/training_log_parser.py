@@ -0,0 +1,279 @@
+"""
+Incremental parser for nnU-Net training logs (training_log_*.txt)
+Turns the per-epoch blocks of a log into records:
+
+  epoch, timestamp, lr, train_loss, val_loss, pseudo_dice (per class),
+  mean_pseudo_dice, epoch_time_s, new_best_ema_dice
+
+Each parser remembers the byte offset it has read up to, so calling update()
+again only reads what nnU-Net appended since. A fold's parsers can be saved
+to a small state file and picked up from there by the next run.
+
+Example:
+    python training_log_parser.py ../nnUNet_results/Dataset001_LowerLimb/nnUNetTrainer__nnUNetPlans__3d_fullres/fold_0
+"""
+import re
+import sys
+import csv
+import json
+import math
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+STATE_FILE = '.training_log_state.json'
+STATE_VERSION = 1
+RECORD_COLUMNS = ['fold', 'epoch', 'timestamp', 'lr', 'train_loss', 'val_loss', 'mean_pseudo_dice',
+                  'epoch_time_s', 'new_best_ema_dice']
+
+TIMESTAMP = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d+): ?(.*)$')
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf', re.IGNORECASE)
+
+
+def parse_float(text):
+    match = NUMBER.search(text)
+    return float(match.group()) if match else None
+
+
+def parse_dice_list(text):
+    """'[0.45, 0.0, ...]', also as written by newer numpy: '[np.float32(0.45), ...]'"""
+    text = re.sub(r'np\.float\d+\(', '', text)
+    return [float(v) for v in NUMBER.findall(text)]
+
+
+class TrainingLogParser:
+    """Parser of one training log; keeps its position between update() calls"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = 0
+        self.fold = None
+        self.records = []
+        self.current = None     # epoch in progress (no 'Epoch time' line yet)
+        self._partial = b''     # trailing bytes of a line nnU-Net is still writing
+
+    def reset(self):
+        self.__init__(self.path)
+
+    def update(self):
+        """Parse what was appended since the last call; returns the newly completed records"""
+        size = self.path.stat().st_size
+        if size < self.offset:
+            # Shorter than what we have read: the log was replaced, start over
+            self.reset()
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        completed = len(self.records)
+        for line in lines:
+            self._parse_line(line.decode('utf-8', errors='replace').rstrip('\r'))
+        return self.records[completed:]
+
+    def _parse_line(self, line):
+        match = TIMESTAMP.match(line)
+        if not match:
+            return
+        timestamp, message = match.group(1), match.group(2).strip()
+        if not message:
+            return
+
+        if message.startswith('Epoch time:'):
+            if self.current is not None:
+                self.current['epoch_time_s'] = parse_float(message[len('Epoch time:'):])
+                self.records.append(self.current)
+                self.current = None
+        elif message.startswith('Epoch '):
+            epoch = message[len('Epoch '):]
+            if epoch.isdigit():
+                self.current = {'epoch': int(epoch), 'timestamp': timestamp, 'lr': None, 'train_loss': None,
+                                'val_loss': None, 'pseudo_dice': [], 'mean_pseudo_dice': None,
+                                'epoch_time_s': None, 'new_best_ema_dice': None}
+        elif message.startswith('Yayy! New best EMA pseudo Dice:'):
+            # Logged after 'Epoch time', so it belongs to the last completed epoch
+            if self.records:
+                self.records[-1]['new_best_ema_dice'] = parse_float(message.split(':', 1)[1])
+        elif message.startswith('Desired fold for training:'):
+            self.fold = int(parse_float(message.split(':', 1)[1]))
+        elif self.current is not None:
+            if message.startswith('Current learning rate:'):
+                self.current['lr'] = parse_float(message.split(':', 1)[1])
+            elif message.startswith('train_loss'):
+                self.current['train_loss'] = parse_float(message[len('train_loss'):])
+            elif message.startswith('val_loss'):
+                self.current['val_loss'] = parse_float(message[len('val_loss'):])
+            elif message.startswith('Pseudo dice'):
+                dice = parse_dice_list(message[len('Pseudo dice'):])
+                self.current['pseudo_dice'] = dice
+                self.current['mean_pseudo_dice'] = sum(dice) / len(dice) if dice else None
+
+    def state(self):
+        return {'path': self.path.name, 'offset': self.offset, 'fold': self.fold, 'records': self.records,
+                'current': self.current, 'partial': self._partial.decode('utf-8', errors='replace')}
+
+    @classmethod
+    def from_state(cls, fold_dir, state):
+        parser = cls(Path(fold_dir) / state['path'])
+        parser.offset = state['offset']
+        parser.fold = state['fold']
+        parser.records = state['records']
+        parser.current = state['current']
+        parser._partial = state['partial'].encode('utf-8')
+        return parser
+
+
+class FoldLog:
+    """
+    All training logs of one fold directory. Continuing a training writes a
+    new log that repeats epochs from the last checkpoint; the most recent log
+    wins for those epochs.
+    """
+
+    def __init__(self, fold_dir, use_state_file=False):
+        self.fold_dir = Path(fold_dir)
+        self.use_state_file = use_state_file
+        self.parsers = {}
+        if use_state_file:
+            self._load_state()
+
+    def update(self):
+        """Read new log files and appended lines; returns the number of newly completed epochs"""
+        new_records = 0
+        for log_file in sorted(self.fold_dir.glob('training_log*.txt')):
+            parser = self.parsers.get(log_file.name)
+            if parser is None:
+                parser = self.parsers[log_file.name] = TrainingLogParser(log_file)
+            new_records += len(parser.update())
+        if new_records and self.use_state_file:
+            self._save_state()
+        return new_records
+
+    @property
+    def fold(self):
+        folds = [p.fold for p in self.parsers.values() if p.fold is not None]
+        return folds[-1] if folds else None
+
+    @property
+    def records(self):
+        by_epoch = {}
+        for name in sorted(self.parsers):
+            for record in self.parsers[name].records:
+                by_epoch[record['epoch']] = record
+        return [by_epoch[epoch] for epoch in sorted(by_epoch)]
+
+    @property
+    def current(self):
+        """The epoch in progress in the latest log, if any"""
+        if not self.parsers:
+            return None
+        return self.parsers[max(self.parsers)].current
+
+    def _load_state(self):
+        state_file = self.fold_dir / STATE_FILE
+        if not state_file.exists():
+            return
+        try:
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+            if state.get('version') != STATE_VERSION:
+                return
+            for log_state in state['logs']:
+                if (self.fold_dir / log_state['path']).exists():
+                    parser = TrainingLogParser.from_state(self.fold_dir, log_state)
+                    self.parsers[parser.path.name] = parser
+        except (OSError, ValueError, KeyError):
+            self.parsers = {}   # unreadable state: parse the logs from the start
+
+    def _save_state(self):
+        state = {'version': STATE_VERSION, 'logs': [p.state() for p in self.parsers.values()]}
+        try:
+            tmp_file = self.fold_dir / f"{STATE_FILE}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(state, f)
+            tmp_file.replace(self.fold_dir / STATE_FILE)
+        except OSError:
+            pass    # read-only results folder: just parse from the start next time
+
+
+def clean(value):
+    """NaN / inf are not valid JSON; write null instead"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: clean(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clean(v) for v in value]
+    return value
+
+
+def export_json(path, fold_logs, class_names=None):
+    data = {
+        'exported': datetime.now().isoformat(timespec='seconds'),
+        'class_names': class_names,
+        'folds': {name: {'fold': log.fold, 'epochs': log.records} for name, log in fold_logs.items()}
+    }
+    with open(path, 'w') as f:
+        json.dump(clean(data), f, indent=2)
+
+
+def export_csv(path, fold_logs, class_names=None):
+    """One row per fold and epoch; the per-class pseudo Dice as one column per class"""
+    num_classes = max((len(r['pseudo_dice']) for log in fold_logs.values() for r in log.records), default=0)
+    names = list(class_names or [])[:num_classes]
+    names += [f'class_{i + 1}' for i in range(len(names), num_classes)]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RECORD_COLUMNS + [f'dice_{name}' for name in names])
+        for name, log in fold_logs.items():
+            for record in log.records:
+                row = dict(record, fold=name)
+                dice = record['pseudo_dice'] + [None] * (num_classes - len(record['pseudo_dice']))
+                writer.writerow([row[c] for c in RECORD_COLUMNS] + dice)
+
+
+def load_class_names(dataset_json):
+    """Foreground label names in label order, as the pseudo Dice lists them"""
+    with open(dataset_json, 'r') as f:
+        labels = json.load(f)['labels']
+    return [name for name, value in sorted(labels.items(), key=lambda item: int(item[1])) if int(value) != 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse nnU-Net training logs into per-epoch records')
+    parser.add_argument('folds', nargs='+', help='Fold directories (with training_log_*.txt)')
+    parser.add_argument('--json', help='Write the records to this JSON file')
+    parser.add_argument('--csv', help='Write the records to this CSV file')
+    args = parser.parse_args()
+
+    fold_logs = {}
+    for fold_dir in args.folds:
+        if not Path(fold_dir).is_dir():
+            print(f"ERROR: Folder not found: {fold_dir}")
+            sys.exit(1)
+        fold_logs[Path(fold_dir).name] = log = FoldLog(fold_dir)
+        log.update()
+        last = log.records[-1] if log.records else None
+        if last:
+            print(f"{Path(fold_dir).name}: {len(log.records)} epochs, last {last['epoch']} "
+                  f"(val_loss {last['val_loss']}, mean pseudo Dice {last['mean_pseudo_dice']})")
+        else:
+            print(f"{Path(fold_dir).name}: no completed epochs")
+
+    dataset_json = Path(args.folds[0]).parent / 'dataset.json'
+    class_names = load_class_names(dataset_json) if dataset_json.exists() else None
+    if args.json:
+        export_json(args.json, fold_logs, class_names)
+        print(f"✓ JSON: {args.json}")
+    if args.csv:
+        export_csv(args.csv, fold_logs, class_names)
+        print(f"✓ CSV: {args.csv}")
+
+
+if __name__ == '__main__':
+    main()
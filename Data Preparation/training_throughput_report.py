@@ -0,0 +1,294 @@
+"""
+Training throughput report from nnU-Net fold logs
+For every fold of a trainer folder, from the epoch times in training_log_*.txt
+(see training_log_parser.py) and the trainer settings in debug.json:
+
+  - epoch-time distribution (median, mean, p5/p95, coefficient of variation)
+    and iterations / samples per second
+  - drift: fitted slope over the run and last- vs first-quarter median
+  - gaps between epochs (checkpointing, progress plot) and interruptions
+  - outlier epochs: more than --threshold robust deviations from the median
+    of their neighbours (the first epoch of each log is warm-up and ignored)
+  - estimated time to completion of num_epochs
+
+With two trainer or plan folders, the folds are compared side by side.
+
+Examples:
+    python training_throughput_report.py
+    python training_throughput_report.py ../nnUNet_results/Dataset001_LowerLimb/nnUNetTrainer__nnUNetPlans__3d_fullres \\
+        ../nnUNet_results/Dataset001_LowerLimb/nnUNetTrainer__nnUNetResEncUNetMPlans__3d_fullres --json throughput.json
+"""
+import os
+import ast
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from training_log_parser import FoldLog, clean
+
+DATASET_NAME = "Dataset001_LowerLimb"
+TRAINER_FOLDER = "nnUNetTrainer__nnUNetPlans__3d_fullres"
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+INTERRUPTION_S = 600        # longer gaps between epochs are restarts, not overhead
+OUTLIER_WINDOW = 25         # epochs around each epoch for its expected time
+ETA_EPOCHS = 50             # recent epochs used for the time-to-completion estimate
+
+# nnUNetTrainer defaults, for folds without debug.json
+DEFAULT_SETTINGS = {'num_epochs': 1000, 'num_iterations_per_epoch': 250, 'num_val_iterations_per_epoch': 50}
+
+
+def default_trainer_dir():
+    base_path = Path(__file__).parent.absolute()
+    results = os.environ.get('nnUNet_results', str(base_path / 'nnUNet_results'))
+    return Path(results) / DATASET_NAME / TRAINER_FOLDER
+
+
+def load_debug(fold_dir):
+    """Trainer settings relevant to throughput from nnU-Net's debug.json"""
+    settings = dict(DEFAULT_SETTINGS)
+    debug_file = Path(fold_dir) / 'debug.json'
+    if not debug_file.exists():
+        return settings
+    with open(debug_file, 'r') as f:
+        debug = json.load(f)
+
+    for key in ('num_epochs', 'num_iterations_per_epoch', 'num_val_iterations_per_epoch', 'batch_size'):
+        if key in debug:
+            settings[key] = int(debug[key])
+    for key in ('gpu_name', 'device', 'torch_version', 'is_ddp', 'dataloader_train.num_processes',
+                'dataloader_val.num_processes'):
+        if key in debug:
+            settings[key] = debug[key]
+    try:
+        # Written as the repr of a dict
+        configuration = ast.literal_eval(debug.get('configuration_manager', ''))
+        settings['patch_size'] = configuration['patch_size']
+        settings['configured_batch_size'] = configuration['batch_size']
+    except (ValueError, SyntaxError, KeyError, TypeError):
+        pass
+    return settings
+
+
+def parse_time(timestamp):
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+def robust_sigma(values):
+    """Standard deviation estimated from the median absolute deviation"""
+    return 1.4826 * float(np.median(np.abs(values - np.median(values))))
+
+
+def find_outliers(epochs, times, threshold):
+    """Epochs whose time is off the median of their neighbours by more than threshold robust sigmas"""
+    outliers = []
+    half = OUTLIER_WINDOW // 2
+    for i in range(len(times)):
+        window = times[max(0, i - half):i + half + 1]
+        expected = float(np.median(window))
+        sigma = max(robust_sigma(window), 0.005 * expected)  # floor for very steady runs
+        deviation = (times[i] - expected) / sigma
+        if abs(deviation) > threshold:
+            outliers.append({'epoch': int(epochs[i]), 'epoch_time_s': float(times[i]),
+                             'expected_s': round(expected, 2), 'deviation': round(float(deviation), 1)})
+    return outliers
+
+
+def analyze_fold(fold_dir, threshold):
+    fold_log = FoldLog(fold_dir)
+    fold_log.update()
+    records = [r for r in fold_log.records if r['epoch_time_s']]
+    settings = load_debug(fold_dir)
+    result = {'fold': Path(fold_dir).name, 'settings': settings, 'epochs_logged': len(records)}
+    if not records:
+        return result
+
+    # The first epoch of every log pays for torch.compile and worker start-up
+    warmup = {p.records[0]['epoch'] for p in fold_log.parsers.values() if p.records}
+    steady = [r for r in records if r['epoch'] not in warmup]
+    if len(steady) < 2:
+        return result
+    epochs = np.array([r['epoch'] for r in steady], dtype=np.float64)
+    times = np.array([r['epoch_time_s'] for r in steady], dtype=np.float64)
+
+    median = float(np.median(times))
+    iterations = settings['num_iterations_per_epoch'] + settings['num_val_iterations_per_epoch']
+    result['epoch_time_s'] = {
+        'median': median,
+        'mean': float(times.mean()),
+        'p5': float(np.percentile(times, 5)),
+        'p95': float(np.percentile(times, 95)),
+        'min': float(times.min()),
+        'max': float(times.max()),
+        'cv_percent': float(100 * times.std() / times.mean()),
+        'warmup': [float(r['epoch_time_s']) for r in records if r['epoch'] in warmup]
+    }
+    result['iterations_per_s'] = iterations / median
+    if 'batch_size' in settings:
+        # batch_size in debug.json is per process; DDP runs one process per GPU
+        result['train_samples_per_s'] = settings['num_iterations_per_epoch'] * settings.get(
+            'configured_batch_size', settings['batch_size']) / median
+
+    quarter = max(1, len(times) // 4)
+    first, last = float(np.median(times[:quarter])), float(np.median(times[-quarter:]))
+    slope = float(np.polyfit(epochs, times, 1)[0])
+    result['drift'] = {
+        'slope_s_per_100_epochs': 100 * slope,
+        'first_quarter_median_s': first,
+        'last_quarter_median_s': last,
+        'change_percent': 100 * (last - first) / first
+    }
+
+    # Wall-clock time between the end of an epoch and the start of the next
+    gaps, interruptions = [], []
+    for previous, record in zip(records, records[1:]):
+        if record['epoch'] != previous['epoch'] + 1:
+            continue
+        end = parse_time(previous['timestamp']) + timedelta(seconds=previous['epoch_time_s'])
+        gap = (parse_time(record['timestamp']) - end).total_seconds()
+        if gap > INTERRUPTION_S:
+            interruptions.append({'after_epoch': previous['epoch'], 'hours': round(gap / 3600, 2)})
+        else:
+            gaps.append(gap)
+    result['between_epochs_s'] = float(np.median(gaps)) if gaps else None
+    result['interruptions'] = interruptions
+
+    result['outliers'] = find_outliers(epochs, times, threshold)
+
+    last_epoch = records[-1]['epoch']
+    remaining = max(0, settings['num_epochs'] - 1 - last_epoch)
+    per_epoch = float(np.median(times[-ETA_EPOCHS:])) + (result['between_epochs_s'] or 0.0)
+    result['progress'] = {
+        'last_epoch': last_epoch,
+        'num_epochs': settings['num_epochs'],
+        'remaining_epochs': remaining,
+        'remaining_hours': remaining * per_epoch / 3600,
+        'last_logged': records[-1]['timestamp']
+    }
+    return result
+
+
+def analyze_trainer(trainer_dir, threshold):
+    fold_dirs = sorted(p for p in Path(trainer_dir).iterdir() if p.is_dir() and p.name.startswith('fold_'))
+    return {'trainer_dir': str(trainer_dir), 'folds': [analyze_fold(d, threshold) for d in fold_dirs]}
+
+
+def print_report(report):
+    print(f"\nTrainer: {report['trainer_dir']}")
+    for fold in report['folds']:
+        print(f"\n{fold['fold']}: {fold['epochs_logged']} epochs logged")
+        if 'epoch_time_s' not in fold:
+            print("  Not enough epochs yet")
+            continue
+        s, t, d, p = fold['settings'], fold['epoch_time_s'], fold['drift'], fold['progress']
+        if 'gpu_name' in s:
+            print(f"  Setup: {s['gpu_name']}, batch {s.get('configured_batch_size', s.get('batch_size'))}, "
+                  f"patch {s.get('patch_size')}, {s.get('dataloader_train.num_processes')} DA workers")
+        print(f"  Epoch time: median {t['median']:.1f} s, mean {t['mean']:.1f} s, "
+              f"p5-p95 {t['p5']:.1f}-{t['p95']:.1f} s, CV {t['cv_percent']:.1f}%")
+        print(f"  Warm-up epochs: {', '.join(f'{w:.0f} s' for w in t['warmup'])}")
+        line = f"  Throughput: {fold['iterations_per_s']:.2f} it/s"
+        if 'train_samples_per_s' in fold:
+            line += f", {fold['train_samples_per_s']:.2f} training samples/s"
+        print(line)
+        print(f"  Drift: {d['slope_s_per_100_epochs']:+.2f} s per 100 epochs, last vs first quarter "
+              f"{d['last_quarter_median_s']:.1f} vs {d['first_quarter_median_s']:.1f} s ({d['change_percent']:+.1f}%)")
+        if fold['between_epochs_s'] is not None:
+            print(f"  Between epochs: {fold['between_epochs_s']:.1f} s (checkpoint / plot)")
+        for interruption in fold['interruptions']:
+            print(f"  Interrupted after epoch {interruption['after_epoch']} for {interruption['hours']:.1f} h")
+        if fold['outliers']:
+            worst = sorted(fold['outliers'], key=lambda o: -abs(o['deviation']))[:5]
+            print(f"  Outlier epochs: {len(fold['outliers'])} "
+                  f"(worst: {', '.join(f'''{o['epoch']} ({o['epoch_time_s']:.0f} s)''' for o in worst)})")
+        else:
+            print("  Outlier epochs: none")
+        if p['remaining_epochs']:
+            finish = parse_time(p['last_logged']) + timedelta(hours=p['remaining_hours'])
+            print(f"  Remaining: {p['remaining_epochs']} epochs, {p['remaining_hours']:.1f} h "
+                  f"(done around {finish.strftime('%Y-%m-%d %H:%M')} if running since the last log line)")
+        else:
+            print("  Remaining: none")
+
+    medians = [(f['fold'], f['epoch_time_s']['median']) for f in report['folds'] if 'epoch_time_s' in f]
+    if len(medians) > 1:
+        (fast, low), (slow, high) = min(medians, key=lambda m: m[1]), max(medians, key=lambda m: m[1])
+        print(f"\nAcross folds: {low:.1f} s/epoch ({fast}) to {high:.1f} s/epoch ({slow}), "
+              f"{100 * (high - low) / low:.1f}% apart")
+
+
+def print_comparison(a, b):
+    """Side-by-side median epoch time and throughput of two trainer folders, per fold"""
+    print("\n" + "=" * 60)
+    print("Comparison (B / A)")
+    print(f"  A: {a['trainer_dir']}")
+    print(f"  B: {b['trainer_dir']}")
+    print("-" * 60)
+    print(f"{'Fold':<10} {'A s/epoch':>10} {'B s/epoch':>10} {'A it/s':>8} {'B it/s':>8} {'B/A':>7}")
+    folds_b = {f['fold']: f for f in b['folds']}
+    medians_a, medians_b = [], []
+    for fold_a in a['folds']:
+        fold_b = folds_b.get(fold_a['fold'])
+        if not fold_b or 'epoch_time_s' not in fold_a or 'epoch_time_s' not in fold_b:
+            continue
+        ma, mb = fold_a['epoch_time_s']['median'], fold_b['epoch_time_s']['median']
+        medians_a.append(ma)
+        medians_b.append(mb)
+        print(f"{fold_a['fold']:<10} {ma:>10.1f} {mb:>10.1f} {fold_a['iterations_per_s']:>8.2f} "
+              f"{fold_b['iterations_per_s']:>8.2f} {mb / ma:>7.2f}")
+    if medians_a:
+        print("-" * 60)
+        ma, mb = float(np.median(medians_a)), float(np.median(medians_b))
+        print(f"{'Median':<10} {ma:>10.1f} {mb:>10.1f} {'':>8} {'':>8} {mb / ma:>7.2f}")
+    else:
+        print("No fold with epochs in both folders")
+
+    # Settings of the first fold with a debug.json on each side
+    settings_a = next((f['settings'] for f in a['folds'] if len(f['settings']) > len(DEFAULT_SETTINGS)), {})
+    settings_b = next((f['settings'] for f in b['folds'] if len(f['settings']) > len(DEFAULT_SETTINGS)), {})
+    differences = [k for k in sorted(set(settings_a) | set(settings_b)) if settings_a.get(k) != settings_b.get(k)]
+    for key in differences:
+        print(f"  {key}: {settings_a.get(key)} -> {settings_b.get(key)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Epoch-time throughput report of nnU-Net training folds')
+    parser.add_argument('trainer_dirs', nargs='*', help='One trainer folder, or two to compare '
+                                                         '(default: the 3d_fullres results)')
+    parser.add_argument('--threshold', type=float, default=4.0,
+                        help='Robust deviations from the local median that make an outlier epoch (default: 4)')
+    parser.add_argument('--json', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net Training Throughput")
+    print("=" * 60)
+
+    trainer_dirs = args.trainer_dirs or [str(default_trainer_dir())]
+    if len(trainer_dirs) > 2:
+        print("ERROR: Give one trainer folder, or two to compare")
+        sys.exit(1)
+    for trainer_dir in trainer_dirs:
+        if not Path(trainer_dir).is_dir():
+            print(f"ERROR: Folder not found: {trainer_dir}")
+            sys.exit(1)
+
+    reports = [analyze_trainer(d, args.threshold) for d in trainer_dirs]
+    for report in reports:
+        print_report(report)
+    if len(reports) == 2:
+        print_comparison(*reports)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(clean({'created': datetime.now().isoformat(timespec='seconds'), 'reports': reports}), f,
+                      indent=2)
+        print(f"\n✓ Report: {args.json}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
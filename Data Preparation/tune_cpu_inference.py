@@ -0,0 +1,301 @@
+"""
+CPU inference launcher for the trained nnU-Net model
+Tunes nnU-Net inference for a machine without GPU and reuses the result:
+
+  tune     benchmark a short calibration set and pick, one after the other,
+           the torch intra-op thread count, the preprocessing and export
+           worker counts and the largest tile step size whose predictions
+           still agree with the default (step 0.5) ones. The profile is
+           saved next to the model (cpu_inference_profile.json).
+           An untimed warm-up run comes first. Worker counts only matter
+           across cases, so they are tried up to the number of calibration
+           cases (4 by default); with a single case they keep the defaults
+           and the profile records them as not tuned.
+  predict  run inference on a folder with the saved profile
+
+Seconds per case are reported for the default settings
+(predict_from_raw_data_args.json) and for the tuned profile.
+
+Examples:
+    python tune_cpu_inference.py tune -i nnUNet_raw_data_new/Dataset001_PelvisThighs/imagesTr
+    python tune_cpu_inference.py predict -i new_scans -o ../nnUNet_preds
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import nibabel as nib
+
+DATASET_NAME = 'Dataset001_PelvisThighs'
+TRAINER_FOLDER = 'nnUNetTrainer__nnUNetPlans__3d_fullres'
+PROFILE_FILE = 'cpu_inference_profile.json'
+
+# Settings used so far (predict_from_raw_data_args.json) and nnU-Net's default step
+DEFAULT_SETTINGS = {
+    'num_processes_preprocessing': 3,
+    'num_processes_segmentation_export': 3,
+    'tile_step_size': 0.5
+}
+STEP_SIZES = [0.5, 0.6, 0.7, 0.8]
+
+
+def default_model_dir():
+    base_path = Path(__file__).parent.absolute()
+    results = os.environ.get('nnUNet_results', str(base_path / 'nnUNet_results'))
+    return Path(results) / DATASET_NAME / TRAINER_FOLDER
+
+
+def load_default_settings():
+    """Worker counts from the last nnUNetv2_predict run, if its args file is around"""
+    settings = dict(DEFAULT_SETTINGS)
+    args_file = Path(__file__).parent.absolute().parent / 'nnUNet_preds' / 'predict_from_raw_data_args.json'
+    if args_file.exists():
+        with open(args_file, 'r') as f:
+            saved = json.load(f)
+        for key in ('num_processes_preprocessing', 'num_processes_segmentation_export'):
+            if key in saved:
+                settings[key] = int(saved[key])
+    return settings
+
+
+def find_cases(input_dir):
+    """nnU-Net input cases (CASE_0000.nii.gz) of a folder, as lists of channel files"""
+    files = sorted(Path(input_dir).glob('*_0000.nii.gz'))
+    return [[str(f)] for f in files]
+
+
+def verify_nnunet():
+    """Verify nnunetv2 and PyTorch are installed"""
+    try:
+        import torch
+        import nnunetv2
+    except ImportError:
+        print("ERROR: nnunetv2 (and PyTorch) not installed!")
+        print("Install with: pip install nnunetv2")
+        sys.exit(1)
+
+
+def create_predictor(model_dir, folds, use_mirroring):
+    import torch
+    from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+
+    predictor = nnUNetPredictor(tile_step_size=0.5, use_gaussian=True, use_mirroring=use_mirroring,
+                                perform_everything_on_device=False, device=torch.device('cpu'),
+                                verbose=False, verbose_preprocessing=False, allow_tqdm=False)
+    predictor.initialize_from_trained_model_folder(str(model_dir), use_folds=folds,
+                                                   checkpoint_name='checkpoint_final.pth')
+    return predictor
+
+
+def run_inference(predictor, cases, output_dir, settings):
+    """Predict the cases with the given settings; returns seconds per case"""
+    import torch
+    torch.set_num_threads(settings['torch_threads'])
+    predictor.tile_step_size = settings['tile_step_size']
+
+    start = time.time()
+    predictor.predict_from_files(cases, str(output_dir), save_probabilities=False, overwrite=True,
+                                 num_processes_preprocessing=settings['num_processes_preprocessing'],
+                                 num_processes_segmentation_export=settings['num_processes_segmentation_export'],
+                                 folder_with_segs_from_prev_stage=None, num_parts=1, part_id=0)
+    return (time.time() - start) / len(cases)
+
+
+def mean_dice(reference_dir, output_dir):
+    """Mean foreground Dice of two prediction folders, over all cases and labels"""
+    scores = []
+    for reference_file in sorted(Path(reference_dir).glob('*.nii.gz')):
+        a = np.asanyarray(nib.load(str(reference_file)).dataobj).astype(np.uint8)
+        b = np.asanyarray(nib.load(str(Path(output_dir) / reference_file.name)).dataobj).astype(np.uint8)
+        k = int(max(a.max(), b.max())) + 1
+        confusion = np.bincount((a.astype(np.int32) * k + b).ravel(), minlength=k * k).reshape(k, k)
+        for label in range(1, k):
+            total = confusion[label].sum() + confusion[:, label].sum()
+            if total:
+                scores.append(2 * confusion[label, label] / total)
+    return float(np.mean(scores)) if scores else 1.0
+
+
+def candidate_threads(cpu_count):
+    candidates = {cpu_count, max(1, cpu_count // 2), max(1, cpu_count // 4), max(1, cpu_count * 3 // 4)}
+    return sorted(candidates, reverse=True)
+
+
+def tune(args):
+    model_dir = Path(args.model)
+    cases = find_cases(args.input)[:args.cases]
+    if not cases:
+        print(f"ERROR: No *_0000.nii.gz cases found in {args.input}")
+        sys.exit(1)
+
+    import torch
+    cpu_count = os.cpu_count() or 1
+    print(f"Model: {model_dir}")
+    print(f"Calibration cases: {', '.join(Path(c[0]).name for c in cases)}")
+    print(f"CPU cores: {cpu_count}")
+    workers_tuned = len(cases) >= 2
+    if not workers_tuned:
+        print("WARNING: Worker counts need at least 2 calibration cases, they will keep the defaults")
+
+    predictor = create_predictor(model_dir, args.folds, not args.disable_tta)
+    work_dir = Path(tempfile.mkdtemp(prefix='nnunet_cpu_tune_'))
+    trials = []
+
+    def trial(settings, name):
+        output_dir = work_dir / f"trial_{len(trials)}"
+        seconds = run_inference(predictor, cases, output_dir, settings)
+        trials.append({'name': name, 'settings': dict(settings), 'seconds_per_case': round(seconds, 2)})
+        print(f"  {name:<32} threads={settings['torch_threads']:<3} "
+              f"pre={settings['num_processes_preprocessing']} export={settings['num_processes_segmentation_export']} "
+              f"step={settings['tile_step_size']:<4} -> {seconds:.1f} s/case")
+        return seconds, output_dir
+
+    try:
+        baseline = dict(load_default_settings(), torch_threads=torch.get_num_threads())
+        # First-run costs (thread pools, allocator, file cache) would otherwise be charged to the baseline
+        print("\n[Warm-up, untimed]")
+        run_inference(predictor, cases[:1], work_dir / 'warmup', baseline)
+
+        print("\n[Baseline]")
+        baseline_seconds, reference_dir = trial(baseline, 'default settings')
+        best, best_seconds = dict(baseline), baseline_seconds
+
+        print("\n[Torch intra-op threads]")
+        for threads in candidate_threads(cpu_count):
+            if threads == best['torch_threads']:
+                continue
+            seconds, _ = trial(dict(best, torch_threads=threads), f'{threads} threads')
+            if seconds < best_seconds:
+                best, best_seconds = dict(best, torch_threads=threads), seconds
+
+        for key, label in (('num_processes_preprocessing', 'preprocessing workers'),
+                           ('num_processes_segmentation_export', 'export workers')):
+            print(f"\n[{label.capitalize()}]")
+            # Workers run cases in parallel: with fewer cases the extra ones sit idle
+            if not workers_tuned:
+                print(f"  skipped with one calibration case, keeping {best[key]} (use --cases 4 to tune)")
+                continue
+            for workers in range(1, min(4, cpu_count, len(cases)) + 1):
+                if workers == best[key]:
+                    continue
+                seconds, _ = trial(dict(best, **{key: workers}), f'{workers} {label}')
+                if seconds < best_seconds:
+                    best, best_seconds = dict(best, **{key: workers}), seconds
+
+        print(f"\n[Tile step size, keeping Dice >= {args.min_dice} vs step 0.5]")
+        for step in STEP_SIZES:
+            if step <= best['tile_step_size']:
+                continue
+            seconds, output_dir = trial(dict(best, tile_step_size=step), f'step {step}')
+            agreement = mean_dice(reference_dir, output_dir)
+            trials[-1]['dice_vs_default'] = round(agreement, 4)
+            print(f"    agreement with step 0.5: Dice {agreement:.4f}")
+            if agreement < args.min_dice:
+                break
+            if seconds < best_seconds:
+                best, best_seconds = dict(best, tile_step_size=step), seconds
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    profile = dict(best)
+    profile.update({
+        'use_mirroring': not args.disable_tta,
+        'folds': args.folds,
+        'cpu_count': cpu_count,
+        'calibration_cases': [Path(c[0]).name for c in cases],
+        'workers_tuned': workers_tuned,
+        'seconds_per_case_before': round(baseline_seconds, 2),
+        'seconds_per_case_after': round(best_seconds, 2),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'trials': trials
+    })
+    profile_file = Path(args.profile) if args.profile else model_dir / PROFILE_FILE
+    with open(profile_file, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    print("\n" + "=" * 60)
+    print("Tuned CPU inference profile:")
+    print(f"  torch threads:         {best['torch_threads']}")
+    untuned = '' if workers_tuned else ' (default, not tuned)'
+    print(f"  preprocessing workers: {best['num_processes_preprocessing']}{untuned}")
+    print(f"  export workers:        {best['num_processes_segmentation_export']}{untuned}")
+    print(f"  tile step size:        {best['tile_step_size']}")
+    print(f"Seconds per case: {baseline_seconds:.1f} -> {best_seconds:.1f} "
+          f"({baseline_seconds / best_seconds:.2f}x)")
+    print(f"Profile saved: {profile_file}")
+    print("=" * 60)
+
+
+def predict(args):
+    model_dir = Path(args.model)
+    profile_file = Path(args.profile) if args.profile else model_dir / PROFILE_FILE
+    if profile_file.exists():
+        with open(profile_file, 'r') as f:
+            profile = json.load(f)
+        print(f"Using profile: {profile_file} (tuned {profile['created']})")
+        if not profile.get('workers_tuned', True):
+            print("  Worker counts are the defaults (tuned with one case); re-tune with --cases 4 to tune them")
+    else:
+        import torch
+        profile = dict(load_default_settings(), torch_threads=torch.get_num_threads(), use_mirroring=True,
+                       folds=None)
+        print("WARNING: No tuned profile found, using the default settings")
+        print("  Tune first: python tune_cpu_inference.py tune -i <calibration cases>")
+
+    cases = find_cases(args.input)
+    if not cases:
+        print(f"ERROR: No *_0000.nii.gz cases found in {args.input}")
+        sys.exit(1)
+    folds = args.folds if args.folds is not None else profile.get('folds')
+    use_mirroring = profile.get('use_mirroring', True) and not args.disable_tta
+
+    predictor = create_predictor(model_dir, folds, use_mirroring)
+    print(f"Predicting {len(cases)} cases into {args.output}")
+    seconds = run_inference(predictor, cases, args.output, profile)
+    print(f"\n✓ Done: {seconds:.1f} s/case ({seconds * len(cases):.0f} s total)")
+    if 'seconds_per_case_before' in profile:
+        print(f"  Calibration: {profile['seconds_per_case_before']:.1f} s/case before tuning, "
+              f"{profile['seconds_per_case_after']:.1f} s/case after")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune and run nnU-Net inference on CPU')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('tune', 'Benchmark calibration cases and save a profile'),
+                            ('predict', 'Predict a folder with the saved profile')):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('-i', '--input', required=True, help='Folder of *_0000.nii.gz images')
+        sub.add_argument('--model', default=str(default_model_dir()),
+                         help='Trained model folder (default: the 3d_fullres results)')
+        sub.add_argument('--profile', help=f'Profile file (default: <model>/{PROFILE_FILE})')
+        sub.add_argument('-f', '--folds', type=int, nargs='+', help='Folds to use (default: all)')
+        sub.add_argument('--disable-tta', action='store_true', help='Disable mirroring (test-time augmentation)')
+        if name == 'tune':
+            sub.add_argument('--cases', type=int, default=4,
+                             help='Number of calibration cases; worker counts need at least 2 (default: 4)')
+            sub.add_argument('--min-dice', type=float, default=0.99,
+                             help='Agreement required to accept a larger tile step (default: 0.99)')
+        else:
+            sub.add_argument('-o', '--output', required=True, help='Output folder')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("nnU-Net CPU Inference")
+    print("=" * 60)
+    verify_nnunet()
+    if args.command == 'tune':
+        tune(args)
+    else:
+        predict(args)
+
+
+if __name__ == '__main__':
+    main()
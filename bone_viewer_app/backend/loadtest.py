@@ -0,0 +1,239 @@
+"""
+Load test for the Bone Viewer backend.
+
+Runs a weighted mix of workloads (segmentation uploads, metadata polls,
+PLY downloads, implant listings) with a configurable number of concurrent
+virtual users, either in-process against the FastAPI app or against a
+running server, and reports throughput, latency percentiles and error rates
+per endpoint. In-process runs also report the event-loop lag seen during
+the run; against a running server the loop measured would only be the
+client's, so it is left out.
+
+Examples:
+    python loadtest.py --users 16 --duration 30
+    python loadtest.py --url http://localhost:8001 --users 32 --mix upload=1,metadata=10,ply=10,implants=2
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+DEFAULT_MIX = "upload=1,metadata=8,ply=8,implants=2"
+
+
+def make_synthetic_segmentation(shape=(96, 96, 64), seed=0):
+    """Gzipped NIfTI with a few labelled blobs, standing in for an nnU-Net prediction."""
+    import nibabel as nib
+
+    rng = np.random.default_rng(seed)
+    labels = np.zeros(shape, dtype=np.uint8)
+    grid = np.indices(shape)
+    for label_id in range(1, 8):
+        centre = [rng.integers(s // 4, 3 * s // 4) for s in shape]
+        radius = rng.integers(4, max(5, min(shape) // 6))
+        dist2 = sum((g - c) ** 2 for g, c in zip(grid, centre))
+        labels[dist2 < radius ** 2] = label_id
+
+    img = nib.Nifti1Image(labels, np.diag([0.8, 0.8, 1.2, 1.0]))
+    img.header.set_zooms((0.8, 0.8, 1.2))
+    return gzip.compress(img.to_bytes(), compresslevel=1)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+
+class LoadTest:
+    def __init__(self, client, users, duration, mix, volume_shape, measure_loop_lag=True):
+        self.client = client
+        self.measure_loop_lag = measure_loop_lag
+        self.users = users
+        self.duration = duration
+        self.mix = mix
+        self.payload = make_synthetic_segmentation(volume_shape)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.loop_lag = []
+        self.jobs = []
+
+    async def timed(self, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies[name].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[name] += 1
+        return response if ok else None
+
+    # Workloads ------------------------------------------------------------
+    async def upload(self):
+        files = {'file': ('loadtest.nii.gz', self.payload, 'application/gzip')}
+        response = await self.timed('upload', 'POST', '/upload-segmentation', files=files)
+        if response is not None:
+            body = response.json()
+            self.jobs.append((body['job_id'], [b['filename'] for b in body['metadata']['bones']]))
+
+    async def metadata(self):
+        job_id, _ = random.choice(self.jobs)
+        await self.timed('metadata', 'GET', f'/bones/{job_id}')
+
+    async def ply(self):
+        job_id, files = random.choice(self.jobs)
+        if files:
+            await self.timed('ply', 'GET', f'/ply/{job_id}/{random.choice(files)}')
+
+    async def implants(self):
+        await self.timed('implants', 'GET', '/implants')
+
+    # Runner ---------------------------------------------------------------
+    async def monitor_loop_lag(self, stop, interval=0.01):
+        """Overshoot of a short sleep; blocking work on the loop shows up here."""
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(time.perf_counter() - start - interval)
+
+    async def user(self, deadline):
+        names = list(self.mix)
+        weights = [self.mix[n] for n in names]
+        while time.perf_counter() < deadline:
+            await getattr(self, random.choices(names, weights)[0])()
+
+    async def run(self):
+        # Seed one job so read workloads have something to fetch
+        await self.upload()
+        if not self.jobs:
+            raise RuntimeError("Seed upload failed; is the backend reachable?")
+        self.latencies.clear()
+        self.errors.clear()
+
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(self.monitor_loop_lag(stop)) if self.measure_loop_lag else None
+        start = time.perf_counter()
+        deadline = start + self.duration
+        await asyncio.gather(*(self.user(deadline) for _ in range(self.users)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        if monitor is not None:
+            await monitor
+        return self.report(elapsed)
+
+    async def cleanup(self):
+        for job_id, _ in self.jobs:
+            await self.client.delete(f'/jobs/{job_id}')
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            ms = [v * 1000 for v in values]
+            endpoints[name] = {
+                'requests': len(values),
+                'throughput_rps': round(len(values) / elapsed, 2),
+                'p50_ms': round(percentile(ms, 50), 2),
+                'p95_ms': round(percentile(ms, 95), 2),
+                'p99_ms': round(percentile(ms, 99), 2),
+                'error_rate': round(self.errors[name] / len(values), 4)
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        report = {
+            'users': self.users,
+            'duration_s': round(elapsed, 2),
+            'total_requests': total,
+            'throughput_rps': round(total / elapsed, 2),
+            'endpoints': endpoints
+        }
+        if self.measure_loop_lag:
+            lag_ms = [v * 1000 for v in self.loop_lag]
+            report['event_loop_lag'] = {
+                'p50_ms': round(percentile(lag_ms, 50), 2),
+                'p99_ms': round(percentile(lag_ms, 99), 2),
+                'max_ms': round(max(lag_ms), 2) if lag_ms else float('nan')
+            }
+        return report
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ('upload', 'metadata', 'ply', 'implants'):
+            raise argparse.ArgumentTypeError(f"Unknown workload: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(report, url):
+    print("=" * 78)
+    print(f"Load test: {url}")
+    print(f"  Users: {report['users']}  Duration: {report['duration_s']} s  "
+          f"Requests: {report['total_requests']}  Throughput: {report['throughput_rps']} req/s")
+    print("=" * 78)
+    print(f"{'endpoint':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    for name, stats in report['endpoints'].items():
+        print(f"{name:<10} {stats['requests']:>9} {stats['throughput_rps']:>8} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['error_rate']:>8.2%}")
+    lag = report.get('event_loop_lag')
+    if lag:
+        print("-" * 78)
+        print(f"Event-loop lag: p50 {lag['p50_ms']} ms  p99 {lag['p99_ms']} ms  max {lag['max_ms']} ms")
+    print("=" * 78)
+
+
+async def main_async(args):
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        target = args.url
+    else:
+        # In-process: requests go straight through the ASGI app on this event loop,
+        # so handlers that block the loop show up directly as loop lag.
+        from src.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest",
+                                   timeout=args.timeout)
+        target = "in-process (src.main:app)"
+
+    shape = tuple(int(x) for x in args.volume.split(','))
+    # The server's event loop is out of reach with --url; the client's own lag would mislead
+    test = LoadTest(client, args.users, args.duration, args.mix, shape, measure_loop_lag=not args.url)
+    try:
+        report = await test.run()
+    finally:
+        if not args.keep_jobs:
+            await test.cleanup()
+        await client.aclose()
+
+    print_report(report, target)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Bone Viewer backend')
+    parser.add_argument('--url', help='Base URL of a running server (default: in-process app)')
+    parser.add_argument('--users', type=int, default=8, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='Test duration in seconds')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Workload weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--volume', default='96,96,64', help='Shape of the synthetic segmentation')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--output', help='Write the report as JSON')
+    parser.add_argument('--keep-jobs', action='store_true', help='Do not delete jobs created by uploads')
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
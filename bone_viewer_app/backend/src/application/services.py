@@ -1,27 +1,70 @@
-from typing import List, Dict, Any, BinaryIO
+from typing import List, Dict, Any, BinaryIO, Optional, Tuple
+import base64
+import os
+import time
 import uuid
-from ..domain.interfaces import IBoneProcessor, IStorageService
+from functools import partial
+from pathlib import Path
+from ..domain.interfaces import (IBoneProcessor, IStorageService, ISliceRenderer, IProximityIndex,
+                                 IImplantRegistrar, IProgressBroker, ILabelEditor, IDisagreementAnalyzer,
+                                 IPredictor)
 from ..domain.entities import Implant
 
 class BoneService:
-    def __init__(self, bone_processor: IBoneProcessor, storage_service: IStorageService):
+    def __init__(self, bone_processor: IBoneProcessor, storage_service: IStorageService,
+                 slice_renderer: Optional[ISliceRenderer] = None,
+                 proximity_index: Optional[IProximityIndex] = None,
+                 implant_registrar: Optional[IImplantRegistrar] = None,
+                 progress_broker: Optional[IProgressBroker] = None,
+                 label_editor: Optional[ILabelEditor] = None,
+                 disagreement_analyzer: Optional[IDisagreementAnalyzer] = None,
+                 predictor: Optional[IPredictor] = None):
         self.bone_processor = bone_processor
         self.storage_service = storage_service
+        self.slice_renderer = slice_renderer
+        self.proximity_index = proximity_index
+        self.implant_registrar = implant_registrar
+        self.progress_broker = progress_broker
+        self.label_editor = label_editor
+        self.disagreement_analyzer = disagreement_analyzer
+        self.predictor = predictor
 
-    def process_segmentation(self, file_object: BinaryIO, filename: str) -> Dict[str, Any]:
-        # Generate job ID
-        job_id = str(uuid.uuid4())[:8]
+    def start_job(self, file_object: BinaryIO, filename: str, job_id: Optional[str] = None,
+                  directory_type: str = 'segmentation') -> Dict[str, Any]:
+        """Store an uploaded segmentation (or CT) under a new (or given) job ID; processing happens in `run_job`."""
+        job_id = job_id or str(uuid.uuid4())[:8]
         saved_filename = f"{job_id}_{filename}"
-        
-        # Save file
-        file_path = self.storage_service.save_file(file_object, saved_filename, 'segmentation')
-        
-        # Prepare output directory
+        file_path = self.storage_service.save_file(file_object, saved_filename, directory_type)
+
+        if self.progress_broker is not None:
+            self.progress_broker.open(job_id)
+            self.progress_broker.publish(job_id, 'received', filename=filename,
+                                         bytes=os.path.getsize(file_path))
+        return {"job_id": job_id, "filename": filename, "file_path": file_path}
+
+    def run_job(self, job_id: str, file_path: str, filename: str, revision_of: Optional[str] = None,
+                remove_islands: bool = False) -> Dict[str, Any]:
+        """Export the bones of a stored segmentation; `remove_islands` cleans up a model prediction first."""
         output_dir = self.storage_service.get_job_path(job_id)
-        
-        # Process
-        metadata = self.bone_processor.process_segmentation(file_path, output_dir)
-        
+        progress = partial(self.progress_broker.publish, job_id) if self.progress_broker is not None else None
+        # A revision only recomputes the labels that changed since `revision_of`
+        previous_dir = self.storage_service.get_job_path(revision_of) if revision_of else None
+
+        try:
+            metadata = self.bone_processor.process_segmentation(file_path, output_dir, progress=progress,
+                                                                previous_output_dir=previous_dir,
+                                                                remove_islands=remove_islands)
+
+            # Build the per-bone spatial index now so the first implant query is fast
+            if self.proximity_index is not None:
+                self.proximity_index.index_job(output_dir, metadata['bones'])
+        except Exception as e:
+            if progress is not None:
+                progress('error', detail=str(e))
+            raise
+
+        if progress is not None:
+            progress('complete', metadata=metadata)
         return {
             "success": True,
             "job_id": job_id,
@@ -29,6 +72,68 @@ class BoneService:
             "metadata": metadata
         }
 
+    def run_ct_job(self, job_id: str, file_path: str, filename: str) -> Dict[str, Any]:
+        """
+        Segment a CT and export its bones. The predicted labels go to the bone
+        processor in memory; the prediction is compressed to disk afterwards,
+        in the background, as {job_id}_{name}_pred.nii.gz.
+        """
+        if self.predictor is None:
+            raise RuntimeError("No predictor configured")
+        output_dir = self.storage_service.get_job_path(job_id)
+        progress = partial(self.progress_broker.publish, job_id) if self.progress_broker is not None else None
+        progress = progress or (lambda stage, **data: None)
+
+        try:
+            start = time.perf_counter()
+            image, spacing, affine = self.storage_service.load_image(file_path)
+            progress('decoded', shape=[int(x) for x in image.shape], spacing=[float(x) for x in spacing],
+                     stage_ms=round((time.perf_counter() - start) * 1000, 2))
+
+            predict_start = time.perf_counter()
+            progress('predicting')
+            labels = self.predictor.predict(image, spacing)
+            del image
+            progress('predicted', stage_ms=round((time.perf_counter() - predict_start) * 1000, 2))
+
+            # Islands are removed from `labels` in place, so the saved prediction matches the bones
+            metadata = self.bone_processor.process_volume(labels, spacing, output_dir, progress=progress,
+                                                          start_time=start, remove_islands=True)
+            stem = filename[:-len('.nii.gz')] if filename.endswith('.nii.gz') else Path(filename).stem
+            self.storage_service.save_label_volume(labels, affine, f"{job_id}_{stem}_pred.nii.gz")
+
+            if self.proximity_index is not None:
+                self.proximity_index.index_job(output_dir, metadata['bones'])
+        except Exception as e:
+            progress('error', detail=str(e))
+            raise
+
+        progress('complete', metadata=metadata)
+        return {
+            "success": True,
+            "job_id": job_id,
+            "filename": filename,
+            "metadata": metadata
+        }
+
+    def process_segmentation(self, file_object: BinaryIO, filename: str,
+                             revision_of: Optional[str] = None, remove_islands: bool = False) -> Dict[str, Any]:
+        job = self.start_job(file_object, filename)
+        return self.run_job(job["job_id"], job["file_path"], filename, revision_of, remove_islands)
+
+    def get_job_events(self, job_id: str, cursor: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """
+        Progress events of a job from `cursor` on. Jobs processed before this
+        process started only report their completion.
+        """
+        events = self.progress_broker.events_since(job_id, cursor) if self.progress_broker is not None else None
+        if events is not None:
+            return events
+        metadata = self.get_job_metadata(job_id)
+        if metadata is None:
+            return None
+        return [{'id': 0, 'stage': 'complete', 'metadata': metadata}][cursor:]
+
     def get_job_metadata(self, job_id: str) -> Dict[str, Any]:
         output_dir = self.storage_service.get_job_path(job_id)
         # In a real database, we'd query the DB. Here we read the JSON we saved.
@@ -42,6 +147,93 @@ class BoneService:
         with open(metadata_file, 'r') as f:
             return json.load(f)
 
+    def list_jobs(self, offset: int = 0, limit: int = 100, inline_thumbnails: bool = False) -> Dict[str, Any]:
+        """Lightweight job summaries for the gallery; no geometry is read."""
+        jobs = self.storage_service.list_jobs()
+        summaries = []
+        for job in jobs[offset:offset + limit]:
+            summary = {
+                "job_id": job.job_id,
+                "filename": job.filename,
+                "created_at": job.created_at.isoformat(),
+                "status": job.status,
+                "total_bones": job.metadata.get("total_bones", 0),
+                "bones": [bone["name"] for bone in job.metadata.get("bones", [])],
+                "thumbnail_url": None
+            }
+            thumbnail = job.metadata.get("thumbnail")
+            if thumbnail:
+                summary["thumbnail_url"] = f"/jobs/{job.job_id}/thumbnail.png"
+                # Thumbnails are cached by clients; a new URL per edit revision bypasses that
+                if job.metadata.get("edit_revision"):
+                    summary["thumbnail_url"] += f"?rev={job.metadata['edit_revision']}"
+                if inline_thumbnails:
+                    png = (Path(self.storage_service.get_job_path(job.job_id)) / thumbnail["filename"]).read_bytes()
+                    summary["thumbnail"] = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+            summaries.append(summary)
+        return {"jobs": summaries, "total": len(jobs), "offset": offset, "limit": limit}
+
+    def get_slice(self, job_id: str, axis: str, index: Optional[int] = None,
+                  fmt: str = 'png') -> Optional[Tuple[bytes, Tuple[int, int]]]:
+        volume = self.storage_service.get_label_volume(job_id)
+        if volume is None:
+            return None
+        return self.slice_renderer.render_slice(job_id, volume, axis, index, fmt)
+
+    def measure_implant(self, job_id: str, implant_filename: str, transform: List[List[float]]) -> Optional[Dict[str, Any]]:
+        metadata = self.get_job_metadata(job_id)
+        volume = self.storage_service.get_label_volume(job_id)
+        if metadata is None or volume is None:
+            return None
+        implant_path = self.storage_service.get_implant_path(implant_filename)
+        if implant_path is None:
+            raise FileNotFoundError(f"Implant not found: {implant_filename}")
+
+        result = self.proximity_index.implant_distances(
+            self.storage_service.get_job_path(job_id), metadata['bones'], volume,
+            metadata['spacing'], implant_path, transform
+        )
+        return {"job_id": job_id, "implant": implant_filename, **result}
+
+    def register_implant(self, job_id: str, implant_filename: str, bone_name: str,
+                         initial_transform: List[List[float]], overlap: float = 0.7,
+                         max_iterations: int = 30) -> Optional[Dict[str, Any]]:
+        metadata = self.get_job_metadata(job_id)
+        if metadata is None:
+            return None
+        bone = next((b for b in metadata['bones'] if b['name'] == bone_name), None)
+        if bone is None:
+            raise FileNotFoundError(f"Bone not found: {bone_name}")
+        implant_path = self.storage_service.get_implant_path(implant_filename)
+        if implant_path is None:
+            raise FileNotFoundError(f"Implant not found: {implant_filename}")
+
+        result = self.implant_registrar.register(
+            self.storage_service.get_job_path(job_id), bone, implant_path, initial_transform,
+            overlap=overlap, max_iterations=max_iterations
+        )
+        return {"job_id": job_id, "implant": implant_filename, **result}
+
+    def edit_labels(self, job_id: str, operations: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        volume = self.storage_service.get_label_volume(job_id)
+        if volume is None or self.get_job_metadata(job_id) is None:
+            return None
+        result = self.label_editor.apply(self.storage_service.get_job_path(job_id), volume, operations)
+        return {"job_id": job_id, **result}
+
+    def compare_jobs(self, job_id: str, reference_id: str) -> Optional[Dict[str, Any]]:
+        """Disagreement of job `job_id` (prediction) against `reference_id`; the point cloud is stored with the prediction."""
+        metadata = self.get_job_metadata(job_id)
+        prediction = self.storage_service.get_label_volume(job_id)
+        reference = self.storage_service.get_label_volume(reference_id)
+        if metadata is None or prediction is None or reference is None:
+            return None
+
+        filename = f"disagreement_{reference_id}.ply"
+        output_file = Path(self.storage_service.get_job_path(job_id)) / filename
+        result = self.disagreement_analyzer.compare(prediction, reference, metadata['spacing'], str(output_file))
+        return {"job_id": job_id, "reference_id": reference_id, "url": f"/ply/{job_id}/{filename}", **result}
+
     def upload_implant(self, file_object: BinaryIO, filename: str) -> Implant:
         self.storage_service.save_file(file_object, filename, 'implant')
         # We need to return the Implant object, but save_file doesn't return size.
@@ -1,11 +1,118 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from .entities import SegmentationJob, Implant
 
+class ILabelVolume(ABC):
+    shape: tuple
+    # Changes whenever the stored volume is rewritten (used as a cache key)
+    version: int
+
+    @abstractmethod
+    def read_region(self, start, stop):
+        """Read the dense label sub-volume [start, stop)."""
+        pass
+
+    @abstractmethod
+    def read_slice(self, axis: int, index: int):
+        """Read one orthogonal plane of the label volume."""
+        pass
+
+    @abstractmethod
+    def label_coords(self, label_id: int, start=None, stop=None):
+        """Voxel coordinates of a label, optionally restricted to an ROI."""
+        pass
+
+    @abstractmethod
+    def write_region(self, start, labels) -> int:
+        """Overwrite the dense sub-volume starting at `start`."""
+        pass
+
+class ISliceRenderer(ABC):
+    @abstractmethod
+    def render_slice(self, job_id: str, volume: ILabelVolume, axis: str, index: Optional[int] = None, fmt: str = 'png'):
+        """Render one orthogonal label slice (middle of the stack by default); returns (content, (rows, cols))."""
+        pass
+
+class IProximityIndex(ABC):
+    @abstractmethod
+    def index_job(self, job_dir: str, bones: List[Dict[str, Any]]) -> None:
+        """Build (and cache) the spatial index of every bone of a processed job."""
+        pass
+
+    @abstractmethod
+    def implant_distances(self, job_dir: str, bones: List[Dict[str, Any]], volume: ILabelVolume,
+                          spacing, implant_path: str, transform) -> Dict[str, Any]:
+        """Minimum distance, penetration depth and contact points of a placed implant per bone."""
+        pass
+
+class IImplantRegistrar(ABC):
+    @abstractmethod
+    def register(self, job_dir: str, bone: Dict[str, Any], implant_path: str, initial_transform,
+                 overlap: float = 0.7, max_iterations: int = 30) -> Dict[str, Any]:
+        """Rigidly register an implant onto a bone surface; returns the fitted transform."""
+        pass
+
+class IProgressBroker(ABC):
+    @abstractmethod
+    def open(self, job_id: str) -> None:
+        """Start (or restart) the event history of a job."""
+        pass
+
+    @abstractmethod
+    def publish(self, job_id: str, stage: str, **data) -> None:
+        """Record one progress event of a job."""
+        pass
+
+    @abstractmethod
+    def events_since(self, job_id: str, cursor: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """Events from position `cursor` on, or None if the job is unknown."""
+        pass
+
+class ILabelEditor(ABC):
+    @abstractmethod
+    def apply(self, job_dir: str, volume: ILabelVolume, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply brush / erase operations to a job's labels and update only the affected geometry."""
+        pass
+
+class IDisagreementAnalyzer(ABC):
+    @abstractmethod
+    def compare(self, prediction: ILabelVolume, reference: ILabelVolume, spacing, output_file: str) -> Dict[str, Any]:
+        """Per-label Dice and false positives / negatives; writes the disagreeing voxels as a point cloud."""
+        pass
+
+class IPredictor(ABC):
+    @abstractmethod
+    def load(self):
+        """Load the model (once); later calls return the loaded model."""
+        pass
+
+    @abstractmethod
+    def predict(self, image, spacing):
+        """Label volume (uint8, same shape) predicted for a CT volume with the given voxel spacing."""
+        pass
+
 class IBoneProcessor(ABC):
     @abstractmethod
-    def process_segmentation(self, nifti_path: str, output_dir: str, downsample_factor: int = 2) -> Dict[str, Any]:
-        """Process a NIfTI file and extract bones."""
+    def process_segmentation(self, nifti_path: str, output_dir: str, downsample_factor: int = 2,
+                             progress: Optional[Callable[..., None]] = None,
+                             previous_output_dir: Optional[str] = None,
+                             remove_islands: bool = False) -> Dict[str, Any]:
+        """
+        Process a NIfTI file and extract bones, reporting each stage to `progress(stage, **data)`.
+        Bones unchanged since the job in `previous_output_dir` reuse its geometry.
+        `remove_islands` is for predictions: manual labels are exported as they are.
+        """
+        pass
+
+    @abstractmethod
+    def process_volume(self, seg_data, spacing, output_dir: str, downsample_factor: int = 2,
+                       progress: Optional[Callable[..., None]] = None,
+                       previous_output_dir: Optional[str] = None,
+                       start_time: Optional[float] = None, remove_islands: bool = False) -> Dict[str, Any]:
+        """
+        Same as process_segmentation, for a label volume already in memory.
+        `remove_islands` drops stray components from a predicted volume first.
+        """
         pass
 
 class IStorageService(ABC):
@@ -14,12 +121,37 @@ class IStorageService(ABC):
         """Save a file to storage and return its path."""
         pass
 
+    @abstractmethod
+    def load_image(self, file_path: str):
+        """Image volume, voxel spacing and affine of a stored file."""
+        pass
+
+    @abstractmethod
+    def save_label_volume(self, labels, affine, filename: str):
+        """Write a label volume in the background; returns a future of the path."""
+        pass
+
     @abstractmethod
     def get_job_path(self, job_id: str) -> str:
         """Get the path for a specific job."""
         pass
     
+    @abstractmethod
+    def get_implant_path(self, filename: str) -> Optional[str]:
+        """Get the path of an uploaded implant, if it exists."""
+        pass
+
     @abstractmethod
     def list_implants(self) -> List[Implant]:
         """List all available implants."""
         pass
+
+    @abstractmethod
+    def list_jobs(self) -> List[SegmentationJob]:
+        """List all jobs, newest first."""
+        pass
+
+    @abstractmethod
+    def get_label_volume(self, job_id: str) -> Optional[ILabelVolume]:
+        """Open the stored label volume of a job, if it exists."""
+        pass
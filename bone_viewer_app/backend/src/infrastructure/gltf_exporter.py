@@ -0,0 +1,136 @@
+import json
+import logging
+import struct
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GLB_MAGIC = 0x46546C67  # b'glTF'
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+# glTF enums
+FLOAT = 5126
+ARRAY_BUFFER = 34962
+MODE_POINTS = 0
+
+
+def _srgb_to_linear(color: Sequence[int]) -> List[float]:
+    c = np.asarray(color, dtype=np.float64) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    return [float(x) for x in linear]
+
+
+def write_glb(output_path: str, bones: List[Tuple[str, int, np.ndarray, Sequence[int]]]) -> int:
+    """
+    Write every bone into one binary glTF scene.
+
+    `bones` holds (name, label_id, positions (N, 3), rgb color 0-255). Each
+    bone becomes a named node with a point-primitive mesh and its own
+    material; all positions share a single binary buffer. Bones without
+    points are left out (glTF forbids empty accessors and buffers), as is the
+    buffer when no bone has any. Returns the file size.
+    """
+    binary = bytearray()
+    gltf = {
+        'asset': {'version': '2.0', 'generator': '3D Bone Viewer'},
+        'scene': 0,
+        'scenes': [{'nodes': []}],
+        'nodes': [],
+        'meshes': [],
+        'materials': [],
+        'accessors': [],
+        'bufferViews': [],
+        'buffers': []
+    }
+
+    for name, label_id, positions, color in bones:
+        positions = np.ascontiguousarray(positions, dtype=np.float32)
+        if len(positions) == 0:
+            continue
+        offset = len(binary)
+        binary += positions.tobytes()
+
+        gltf['bufferViews'].append({
+            'buffer': 0,
+            'byteOffset': offset,
+            'byteLength': positions.nbytes,
+            'target': ARRAY_BUFFER
+        })
+        gltf['accessors'].append({
+            'bufferView': len(gltf['bufferViews']) - 1,
+            'componentType': FLOAT,
+            'count': int(len(positions)),
+            'type': 'VEC3',
+            'min': [float(x) for x in positions.min(axis=0)],
+            'max': [float(x) for x in positions.max(axis=0)]
+        })
+        gltf['materials'].append({
+            'name': name,
+            'pbrMetallicRoughness': {
+                'baseColorFactor': _srgb_to_linear(color) + [1.0],
+                'metallicFactor': 0.05,
+                'roughnessFactor': 0.4
+            }
+        })
+        gltf['meshes'].append({
+            'name': name,
+            'primitives': [{
+                'attributes': {'POSITION': len(gltf['accessors']) - 1},
+                'material': len(gltf['materials']) - 1,
+                'mode': MODE_POINTS
+            }]
+        })
+        gltf['nodes'].append({
+            'name': name,
+            'mesh': len(gltf['meshes']) - 1,
+            'extras': {'label_id': int(label_id), 'color': [int(c) for c in color]}
+        })
+        gltf['scenes'][0]['nodes'].append(len(gltf['nodes']) - 1)
+
+    if binary:
+        gltf['buffers'].append({'byteLength': len(binary)})
+    # Top-level arrays may not be empty either: a scene without bones is just the asset
+    gltf = {key: value for key, value in gltf.items() if value != []}
+    if not gltf['scenes'][0]['nodes']:
+        del gltf['scenes'][0]['nodes']
+
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    binary += b'\x00' * (-len(binary) % 4)
+
+    total = 12 + 8 + len(json_chunk) + (8 + len(binary) if binary else 0)
+    with open(output_path, 'wb') as f:
+        f.write(struct.pack('<III', GLB_MAGIC, 2, total))
+        f.write(struct.pack('<II', len(json_chunk), CHUNK_JSON))
+        f.write(json_chunk)
+        if binary:
+            f.write(struct.pack('<II', len(binary), CHUNK_BIN))
+            f.write(bytes(binary))
+
+    logger.info(f"Wrote GLB scene: {output_path} ({len(gltf.get('nodes', []))} bones, {total / 1024:.0f} KB)")
+    return total
+
+
+def read_glb_points(path: str) -> Dict[str, np.ndarray]:
+    """Positions of every named point mesh in a GLB written by `write_glb`."""
+    data = Path(path).read_bytes()
+    magic, _, _ = struct.unpack_from('<III', data, 0)
+    if magic != GLB_MAGIC:
+        raise ValueError(f"Not a GLB file: {path}")
+    json_length, _ = struct.unpack_from('<II', data, 12)
+    gltf = json.loads(data[20:20 + json_length])
+    bin_start = 20 + json_length + 8
+
+    points = {}
+    for mesh in gltf.get('meshes', []):
+        accessor = gltf['accessors'][mesh['primitives'][0]['attributes']['POSITION']]
+        view = gltf['bufferViews'][accessor['bufferView']]
+        points[mesh['name']] = np.frombuffer(
+            data, dtype='<f4', count=accessor['count'] * 3,
+            offset=bin_start + view.get('byteOffset', 0)
+        ).reshape(-1, 3)
+    return points
@@ -0,0 +1,43 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+def label_color_lut() -> np.ndarray:
+    """RGB lookup table indexed by label id (background is black)."""
+    # Imported here: the processor itself renders thumbnails with this module
+    from .nifti_processor import LABELS, BONE_COLORS
+
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    for label_id, bone_name in LABELS.items():
+        if bone_name != "background":
+            lut[label_id] = BONE_COLORS.get(bone_name, (150, 150, 150))
+    return lut
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    chunk = tag + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def encode_png(image: np.ndarray, compress_level: int = 6) -> bytes:
+    """Encode an (H, W) grayscale or (H, W, 3) RGB uint8 image as PNG."""
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        color_type = 0
+    elif image.ndim == 3 and image.shape[2] == 3:
+        color_type = 2
+    else:
+        raise ValueError(f"Unsupported image shape for PNG: {image.shape}")
+
+    height, width = image.shape[:2]
+    rows = image.reshape(height, -1)
+    # Filter type 0 (None) prepended to every scanline
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", header)
+            + _png_chunk(b"IDAT", zlib.compress(raw, compress_level))
+            + _png_chunk(b"IEND", b""))
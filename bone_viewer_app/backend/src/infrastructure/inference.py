@@ -0,0 +1,218 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+from ..domain.interfaces import IPredictor
+
+logger = logging.getLogger(__name__)
+
+DATASET_NAME = "Dataset001_PelvisThighs"
+TRAINER_FOLDER = "nnUNetTrainer__nnUNetPlans__3d_fullres"
+
+# Label of the dataset's intensity-threshold class, used by the stub predictor
+THRESHOLD_LABEL = 8
+
+# Saved by Data Preparation/tune_cpu_inference.py next to the model
+CPU_PROFILE_FILE = "cpu_inference_profile.json"
+
+
+def default_model_dir() -> str:
+    """Trained model folder: BONE_VIEWER_MODEL_DIR, else the 3d_fullres results under nnUNet_results."""
+    if os.environ.get("BONE_VIEWER_MODEL_DIR"):
+        return os.environ["BONE_VIEWER_MODEL_DIR"]
+    results = os.environ.get("nnUNet_results", str(Path("..") / ".." / "Data Preparation" / "nnUNet_results"))
+    return str(Path(results) / DATASET_NAME / TRAINER_FOLDER)
+
+
+class NnUNetPredictor(IPredictor):
+    """
+    The trained nnU-Net 3d_fullres model, loaded once on first use and kept
+    in memory. Arrays are passed in the NibabelIO layout the model was
+    trained with (axes reversed), so predictions match `nnUNetv2_predict`.
+    On CPU, the thread count and tile step size of a tuned CPU profile in
+    the model folder are used unless given here.
+    """
+
+    def __init__(self, model_dir: Optional[str] = None, folds: Optional[Sequence[int]] = None,
+                 checkpoint: str = "checkpoint_final.pth", device: Optional[str] = None,
+                 tile_step_size: Optional[float] = None, use_mirroring: bool = True):
+        self.model_dir = model_dir or default_model_dir()
+        self.folds = tuple(folds) if folds is not None else None
+        self.checkpoint = checkpoint
+        self.device = device
+        self.tile_step_size = tile_step_size
+        self.use_mirroring = use_mirroring
+        self._predictor = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._predictor is None:
+                self._predictor = self._load()
+            return self._predictor
+
+    def _load(self):
+        try:
+            import torch
+            from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+        except ImportError as e:
+            raise RuntimeError("nnU-Net inference needs torch and nnunetv2 (pip install nnunetv2)") from e
+
+        start = time.perf_counter()
+        device = torch.device(self.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        tile_step_size = self.tile_step_size
+        profile_file = Path(self.model_dir) / CPU_PROFILE_FILE
+        if device.type == "cpu" and profile_file.exists():
+            with open(profile_file, 'r') as f:
+                profile = json.load(f)
+            torch.set_num_threads(profile['torch_threads'])
+            tile_step_size = tile_step_size or profile['tile_step_size']
+            logger.info(f"Using CPU profile {profile_file}: {profile['torch_threads']} threads, "
+                        f"tile step {tile_step_size}")
+        predictor = nnUNetPredictor(tile_step_size=tile_step_size or 0.5, use_gaussian=True,
+                                    use_mirroring=self.use_mirroring, device=device,
+                                    verbose=False, allow_tqdm=False)
+        predictor.initialize_from_trained_model_folder(self.model_dir, use_folds=self.folds,
+                                                       checkpoint_name=self.checkpoint)
+        logger.info(f"Loaded nnU-Net model from {self.model_dir} on {device} "
+                    f"in {time.perf_counter() - start:.1f} s")
+        return predictor
+
+    def predict(self, image: np.ndarray, spacing: Sequence[float]) -> np.ndarray:
+        predictor = self.load()
+        # NibabelIO hands nnU-Net (c, z, y, x) arrays with reversed spacing
+        data = np.ascontiguousarray(image.transpose(2, 1, 0))[None]
+        properties = {'spacing': [float(s) for s in spacing][::-1]}
+        seg = predictor.predict_single_npy_array(data, properties, None, None, False)
+        return np.ascontiguousarray(np.asarray(seg).transpose(2, 1, 0)).astype(np.uint8, copy=False)
+
+
+class StubPredictor(IPredictor):
+    """
+    Model-free stand-in for tests and CPU-only setups: voxels above a HU
+    threshold get the dataset's threshold class, everything else background.
+    """
+
+    def __init__(self, threshold: float = 200.0, label_id: int = THRESHOLD_LABEL):
+        self.threshold = threshold
+        self.label_id = label_id
+
+    def load(self):
+        return self
+
+    def predict(self, image: np.ndarray, spacing: Sequence[float]) -> np.ndarray:
+        return np.where(image > self.threshold, self.label_id, 0).astype(np.uint8)
+
+
+def load_plans(model_dir: str, configuration: str = "3d_fullres") -> Optional[Dict[str, Any]]:
+    """Patch size, target spacing and axis order of a trained configuration, if its plans.json exists."""
+    plans_file = Path(model_dir) / "plans.json"
+    if not plans_file.exists():
+        return None
+    with open(plans_file, 'r') as f:
+        plans = json.load(f)
+    config = plans['configurations'][configuration]
+    return {'patch_size': config['patch_size'], 'spacing': config['spacing'],
+            'transpose_forward': plans['transpose_forward']}
+
+
+def sliding_window_tiles(shape: Sequence[int], spacing: Sequence[float], plans: Dict[str, Any],
+                         tile_step_size: float = 0.5) -> int:
+    """Number of patches nnU-Net's sliding window needs for a volume (nibabel axis order)."""
+    # NibabelIO reverses the axes, then the plans transpose them
+    order = [2 - axis for axis in plans['transpose_forward']]
+    tiles = 1
+    for axis, patch, target in zip(order, plans['patch_size'], plans['spacing']):
+        size = int(round(shape[axis] * spacing[axis] / target))
+        if size > patch:
+            tiles *= math.ceil((size - patch) / (patch * tile_step_size)) + 1
+    return tiles
+
+
+def body_box(image: np.ndarray, spacing: Sequence[float], threshold_hu: float = -500.0,
+             step_mm: float = 4.0, margin_mm: float = 10.0) -> Optional[Tuple[slice, slice, slice]]:
+    """
+    Box around the patient's body: the largest connected region above
+    `threshold_hu` on a ~`step_mm` grid, opened to cut it off the table and
+    thin artefacts, then grown by `margin_mm` on every side.
+    """
+    steps = [max(1, int(round(step_mm / s))) for s in spacing]
+    small = image[::steps[0], ::steps[1], ::steps[2]] > threshold_hu
+    small = ndimage.binary_opening(small, iterations=2)
+    components, count = ndimage.label(small)
+    if count == 0:
+        return None
+    body = int(np.argmax(np.bincount(components.ravel())[1:]))
+    box = ndimage.find_objects(components)[body]
+    return tuple(
+        slice(max(0, sl.start * step - int(math.ceil(margin_mm / s))),
+              min(size, sl.stop * step + int(math.ceil(margin_mm / s))))
+        for sl, step, s, size in zip(box, steps, spacing, image.shape))
+
+
+class BodyCropPredictor(IPredictor):
+    """
+    Runs the wrapped predictor only on the box around the body, so the
+    sliding window skips the air and the table around it, and pastes the
+    result back into a full-size label map on the original grid.
+
+    nnU-Net normalises CT with fixed dataset statistics, so cropping does
+    not change the intensities the model sees.
+    """
+
+    def __init__(self, predictor: IPredictor, plans: Optional[Dict[str, Any]] = None,
+                 threshold_hu: float = -500.0, margin_mm: float = 10.0):
+        self.predictor = predictor
+        self.plans = plans
+        self.threshold_hu = threshold_hu
+        self.margin_mm = margin_mm
+
+    def load(self):
+        return self.predictor.load()
+
+    def predict(self, image: np.ndarray, spacing: Sequence[float]) -> np.ndarray:
+        start = time.perf_counter()
+        box = body_box(image, spacing, self.threshold_hu, margin_mm=self.margin_mm)
+        if box is None:
+            logger.warning("No body found above the HU threshold; predicting the full volume")
+            return self.predictor.predict(image, spacing)
+
+        cropped = image[box]
+        message = (f"Body crop {image.shape} -> {cropped.shape} "
+                   f"({cropped.size / image.size:.0%} of the voxels) in {(time.perf_counter() - start) * 1000:.0f} ms")
+        if self.plans is not None:
+            full_tiles = sliding_window_tiles(image.shape, spacing, self.plans)
+            crop_tiles = sliding_window_tiles(cropped.shape, spacing, self.plans)
+            message += f", {crop_tiles}/{full_tiles} sliding-window tiles"
+        logger.info(message)
+
+        labels = np.zeros(image.shape, dtype=np.uint8)
+        labels[box] = self.predictor.predict(np.ascontiguousarray(cropped), spacing)
+        return labels
+
+
+def create_predictor(kind: Optional[str] = None) -> IPredictor:
+    """
+    Predictor named by `kind` or BONE_VIEWER_PREDICTOR ('nnunet' by default,
+    or 'stub'), cropped to the body unless BONE_VIEWER_BODY_CROP=0.
+    """
+    kind = (kind or os.environ.get("BONE_VIEWER_PREDICTOR", "nnunet")).lower()
+    if kind == "stub":
+        predictor = StubPredictor()
+    elif kind == "nnunet":
+        folds = os.environ.get("BONE_VIEWER_FOLDS")
+        predictor = NnUNetPredictor(folds=[int(f) for f in folds.split(",")] if folds else None,
+                                    device=os.environ.get("BONE_VIEWER_DEVICE"))
+    else:
+        raise ValueError(f"Unknown predictor '{kind}'. Use 'nnunet' or 'stub'")
+    if os.environ.get("BONE_VIEWER_BODY_CROP", "1") == "0":
+        return predictor
+    return BodyCropPredictor(predictor, plans=load_plans(default_model_dir()))
@@ -0,0 +1,222 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from ..domain.interfaces import IPredictor
+from .inference import create_predictor
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(kind: Optional[str], conn):
+    """Worker process: load the model once, then serve predictions until told to stop."""
+    try:
+        predictor = create_predictor(kind)
+        predictor.load()
+    except Exception as e:
+        conn.send(('failed', f"{type(e).__name__}: {e}"))
+        return
+    conn.send(('ready', None))
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        image_name, labels_name, shape, spacing = task
+        try:
+            image_shm = SharedMemory(name=image_name)
+            labels_shm = SharedMemory(name=labels_name)
+            try:
+                image = np.ndarray(shape, dtype=np.float32, buffer=image_shm.buf)
+                labels = np.ndarray(shape, dtype=np.uint8, buffer=labels_shm.buf)
+                labels[...] = predictor.predict(image, spacing)
+                del image, labels
+            finally:
+                image_shm.close()
+                labels_shm.close()
+            conn.send(('done', None))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class InferenceWorkerPool(IPredictor):
+    """
+    Long-lived worker processes that each load the model once at startup and
+    then take predictions from a shared queue, so no request pays for model
+    loading or CUDA / thread-pool initialisation.
+
+    Each worker has its own pipe and a thread here that feeds it from the
+    queue; volumes are handed over in shared memory rather than pickled. A
+    worker that dies is replaced, and the request it was serving fails
+    instead of hanging.
+    """
+
+    def __init__(self, kind: Optional[str] = None, workers: int = 1, start_method: str = 'spawn'):
+        self.kind = kind
+        self.workers = workers
+        # 'spawn' keeps CUDA usable in the workers
+        self._context = mp.get_context(start_method)
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._processes = {}
+        self._ready = set()
+        self._failed = set()
+        self._busy = 0
+        self._served = 0
+        self._load_errors = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopping = False
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for slot in range(self.workers):
+                thread = threading.Thread(target=self._serve, args=(slot,), name=f'inference-{slot}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started {self.workers} inference workers")
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for process in list(self._processes.values()):
+            if process.is_alive():
+                process.terminate()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'ready': len(self._ready),
+                'busy': self._busy,
+                'queued': self._tasks.qsize(),
+                'served': self._served,
+                'load_errors': list(self._load_errors)
+            }
+
+    # ----------------------------------------------------------------- workers
+    def _set_state(self, slot: int, ready: bool, error: Optional[str] = None):
+        with self._lock:
+            if ready:
+                self._ready.add(slot)
+            else:
+                self._ready.discard(slot)
+            if error is not None:
+                self._failed.add(slot)
+                self._load_errors.append(error)
+            self._changed.notify_all()
+
+    def _serve(self, slot: int):
+        """Run one worker process and feed it requests, restarting it if it dies."""
+        while not self._stopping:
+            conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=_worker_main, args=(self.kind, child_conn),
+                                            name=f'inference-{slot}', daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes[slot] = process
+            try:
+                state, detail = conn.recv()
+            except EOFError:
+                state, detail = 'failed', f"worker exited with code {process.join(1) or process.exitcode}"
+            if state != 'ready':
+                logger.error(f"Inference worker {slot} could not load the model: {detail}")
+                self._set_state(slot, False, detail)
+                return
+            self._set_state(slot, True)
+
+            if self._feed(slot, process, conn):
+                conn.send(None)
+                process.join(timeout=5)
+                return
+            self._set_state(slot, False)
+            process.join(timeout=1)
+            logger.warning(f"Inference worker {slot} exited ({process.exitcode}); restarting it")
+
+    def _feed(self, slot: int, process, conn) -> bool:
+        """Serve requests until told to stop (True) or the worker dies (False)."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return True
+            future, payload = task
+            if not process.is_alive():
+                # Died while idle: hand the request to the next worker
+                self._tasks.put(task)
+                return False
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._busy += 1
+            try:
+                conn.send(payload)
+                state, detail = conn.recv()
+            except (EOFError, OSError):
+                future.set_exception(RuntimeError(f"Inference worker {slot} exited during prediction"))
+                return False
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._served += 1
+            if state == 'done':
+                future.set_result(slot)
+            else:
+                future.set_exception(RuntimeError(detail))
+
+    # -------------------------------------------------------------- predictor
+    def load(self):
+        """Start the workers if needed and wait until one has its model loaded."""
+        self.start()
+        with self._lock:
+            while not self._ready:
+                if len(self._failed) == self.workers:
+                    raise RuntimeError(f"Inference workers could not load the model: {'; '.join(self._load_errors)}")
+                self._changed.wait(timeout=1.0)
+        return self
+
+    def predict(self, image: np.ndarray, spacing: Sequence[float]) -> np.ndarray:
+        self.load()
+        image = np.asarray(image, dtype=np.float32)
+        shape = tuple(int(x) for x in image.shape)
+        start = time.perf_counter()
+        image_shm = SharedMemory(create=True, size=max(image.nbytes, 1))
+        labels_shm = SharedMemory(create=True, size=max(image.size, 1))
+        try:
+            np.ndarray(shape, dtype=np.float32, buffer=image_shm.buf)[...] = image
+            future = Future()
+            self._tasks.put((future, (image_shm.name, labels_shm.name, shape, tuple(float(s) for s in spacing))))
+            slot = future.result()
+            labels = np.ndarray(shape, dtype=np.uint8, buffer=labels_shm.buf).copy()
+        finally:
+            image_shm.close()
+            image_shm.unlink()
+            labels_shm.close()
+            labels_shm.unlink()
+        logger.info(f"Inference worker {slot} predicted {shape} in {time.perf_counter() - start:.1f} s")
+        return labels
+
+
+def create_inference_pool(kind: Optional[str] = None, workers: Optional[int] = None) -> IPredictor:
+    """
+    Worker pool of BONE_VIEWER_INFERENCE_WORKERS processes, or the predictor
+    itself, in-process, when that is 0 (the default).
+    """
+    if workers is None:
+        workers = int(os.environ.get("BONE_VIEWER_INFERENCE_WORKERS", 0))
+    if workers <= 0:
+        return create_predictor(kind)
+    return InferenceWorkerPool(kind, workers)
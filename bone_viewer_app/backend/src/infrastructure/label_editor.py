@@ -0,0 +1,276 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from ..domain.interfaces import ILabelEditor
+from .brick_store import BrickLabelStore
+from .gltf_exporter import read_glb_points, write_glb
+from .imaging import encode_png
+from .nifti_processor import BONE_COLORS, LABELS, SCENE_FILE, SURFACE_DIR, THUMBNAIL_FILE, NiftiBoneProcessor
+from .thumbnail import render_thumbnail
+
+logger = logging.getLogger(__name__)
+
+EDIT_SHAPES = ('sphere', 'box')
+EDIT_MODES = ('paint', 'erase')
+
+
+def _inside(voxels: np.ndarray, start: Sequence[int], stop: Sequence[int]) -> np.ndarray:
+    return np.all((voxels >= np.asarray(start)) & (voxels < np.asarray(stop)), axis=1)
+
+
+class LabelEditor(ILabelEditor):
+    """
+    Applies brush / erase operations to a job's stored label volume and
+    splices the affected region into each touched bone's outputs.
+
+    Only the region an operation covers is read and rewritten. Points and
+    surface voxels inside it (plus a one-voxel margin for the surface, whose
+    status and normals depend on the neighbours) are dropped and recomputed;
+    everything outside is kept as it is, down to the lines of the bone's PLY
+    file, which are copied rather than formatted again. Caches keyed by the volume version
+    or the surface file mtime pick the change up on their own.
+    """
+
+    def __init__(self, processor: NiftiBoneProcessor):
+        self.processor = processor
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _job_lock(self, job_dir: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(job_dir, threading.Lock())
+
+    # -------------------------------------------------------------- operations
+    def _operation_mask(self, op: Dict[str, Any], shape: Sequence[int],
+                        spacing: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Voxel ROI [start, stop) of one operation and its boolean mask within it (world mm input)."""
+        if op.get('shape') not in EDIT_SHAPES:
+            raise ValueError(f"Unknown shape '{op.get('shape')}'. Use one of: {', '.join(EDIT_SHAPES)}")
+        if op.get('mode') not in EDIT_MODES:
+            raise ValueError(f"Unknown mode '{op.get('mode')}'. Use one of: {', '.join(EDIT_MODES)}")
+        if op.get('label') not in LABELS or op['label'] == 0:
+            raise ValueError(f"Unknown label id: {op.get('label')}")
+
+        if op['shape'] == 'sphere':
+            if op.get('center') is None or op.get('radius') is None or op['radius'] <= 0:
+                raise ValueError("A sphere needs a center and a positive radius (mm)")
+            center = np.asarray(op['center'], dtype=np.float64)
+            low, high = center - op['radius'], center + op['radius']
+        else:
+            if op.get('min') is None or op.get('max') is None:
+                raise ValueError("A box needs min and max corners (mm)")
+            low = np.asarray(op['min'], dtype=np.float64)
+            high = np.asarray(op['max'], dtype=np.float64)
+        if low.shape != (3,) or high.shape != (3,):
+            raise ValueError("Coordinates must have three components")
+
+        start = np.clip(np.ceil(low / spacing), 0, shape).astype(np.int64)
+        stop = np.clip(np.floor(high / spacing) + 1, 0, shape).astype(np.int64)
+        stop = np.maximum(stop, start)
+        grid = [np.arange(a, b) * s for a, b, s in zip(start, stop, spacing)]
+        if op['shape'] == 'sphere':
+            x, y, z = np.meshgrid(*grid, indexing='ij', sparse=True)
+            mask = (x - center[0]) ** 2 + (y - center[1]) ** 2 + (z - center[2]) ** 2 <= op['radius'] ** 2
+        else:
+            mask = np.ones(tuple(stop - start), dtype=bool)
+        return start, stop, np.broadcast_to(mask, tuple(stop - start))
+
+    # ------------------------------------------------------------------- bones
+    def _load_bone(self, job_path: Path, bone: Dict[str, Any], scene_points: Dict[str, np.ndarray]):
+        surface_file = job_path / SURFACE_DIR / f"{bone['name']}.npy"
+        points = np.asarray(scene_points.get(bone['name'], np.zeros((0, 3))), dtype=np.float64)
+        return {
+            'meta': dict(bone),
+            'points': points,
+            # Line of the current PLY file each point comes from (-1: new point)
+            'ply_rows': np.arange(len(points)),
+            'surface': np.load(surface_file).astype(np.float64),
+            'normals': np.load(surface_file.with_suffix('.normals.npy')).astype(np.float64)
+        }
+
+    def _new_bone(self, label_id: int) -> Dict[str, Any]:
+        name = LABELS[label_id]
+        return {
+            'meta': {
+                'name': name,
+                'label_id': int(label_id),
+                'filename': f"{name}.ply",
+                'num_voxels': 0,
+                'color': list(BONE_COLORS.get(name, (150, 150, 150)))
+            },
+            'points': np.zeros((0, 3)),
+            'ply_rows': np.zeros(0, dtype=np.int64),
+            'surface': np.zeros((0, 3)),
+            'normals': np.zeros((0, 3))
+        }
+
+    def _splice(self, bone: Dict[str, Any], volume: BrickLabelStore, spacing: np.ndarray,
+                start: np.ndarray, stop: np.ndarray, before: np.ndarray, after: np.ndarray,
+                downsample_factor: int):
+        label_id = bone['meta']['label_id']
+        old_voxels = int((before == label_id).sum())
+        new_voxels = np.argwhere(after == label_id) + start
+
+        # Display points: replace the ROI's share at the bone's point density
+        if downsample_factor > 1 and max(bone['meta']['num_voxels'], len(new_voxels)) > 1000:
+            new_voxels_shown = new_voxels[::downsample_factor]
+        else:
+            new_voxels_shown = new_voxels
+        keep = ~_inside(np.rint(bone['points'] / spacing).astype(np.int64), start, stop)
+        bone['points'] = np.vstack([bone['points'][keep], new_voxels_shown * spacing])
+        bone['ply_rows'] = np.concatenate([bone['ply_rows'][keep], np.full(len(new_voxels_shown), -1)])
+        bone['meta']['num_voxels'] += len(new_voxels) - old_voxels
+
+        # Surface: recompute the ROI plus a one-voxel margin from a two-voxel halo
+        zone_start = np.maximum(start - 1, 0)
+        zone_stop = np.minimum(stop + 1, volume.shape)
+        halo_start = np.maximum(zone_start - 1, 0)
+        halo = volume.read_region(halo_start, np.minimum(zone_stop + 1, volume.shape))
+        coords = np.argwhere(halo == label_id) + halo_start
+
+        keep = ~_inside(np.rint(bone['surface'] / spacing).astype(np.int64), zone_start, zone_stop)
+        surface, normals = [bone['surface'][keep]], [bone['normals'][keep]]
+        if len(coords):
+            surface_voxels, surface_normals = self.processor.extract_surface_voxels(coords, spacing)
+            in_zone = _inside(surface_voxels, zone_start, zone_stop)
+            surface.append(surface_voxels[in_zone] * spacing)
+            normals.append(surface_normals[in_zone])
+        bone['surface'] = np.vstack(surface)
+        bone['normals'] = np.vstack(normals)
+
+    def _finish_bone(self, job_path: Path, bone: Dict[str, Any], volume: BrickLabelStore, spacing: np.ndarray):
+        meta = bone['meta']
+        self.processor.splice_ply_file(bone['points'], job_path / meta['filename'], bone['ply_rows'],
+                                       np.tile(meta['color'], (len(bone['points']), 1)))
+        surface_dir = job_path / SURFACE_DIR
+        surface_dir.mkdir(exist_ok=True)
+        np.save(surface_dir / f"{meta['name']}.npy", bone['surface'].astype(np.float32))
+        np.save(surface_dir / f"{meta['name']}.normals.npy", bone['normals'].astype(np.float32))
+
+        # Extreme voxels are always surface voxels, so the surface gives the bounding box
+        bbox_min = bone['surface'].min(axis=0)
+        bbox_max = bone['surface'].max(axis=0)
+        start = np.rint(bbox_min / spacing).astype(np.int64)
+        stop = np.rint(bbox_max / spacing).astype(np.int64) + 1
+        mask = volume.read_region(start, stop) == meta['label_id']
+
+        meta.update({
+            'num_points': int(len(bone['points'])),
+            'num_surface_points': int(len(bone['surface'])),
+            'digest': self.processor.mask_digest(mask, start, spacing),
+            'bounding_box': {
+                'min': [float(x) for x in bbox_min],
+                'max': [float(x) for x in bbox_max],
+                'center': [float(a + b) / 2 for a, b in zip(bbox_min, bbox_max)]
+            }
+        })
+
+    def _remove_bone(self, job_path: Path, meta: Dict[str, Any]):
+        for path in (job_path / meta['filename'], job_path / SURFACE_DIR / f"{meta['name']}.npy",
+                     job_path / SURFACE_DIR / f"{meta['name']}.normals.npy"):
+            path.unlink(missing_ok=True)
+
+    def _refresh_thumbnail(self, job_path: Path, volume: BrickLabelStore, spacing: np.ndarray) -> Dict[str, Any]:
+        thumbnail = render_thumbnail(volume.to_dense(), spacing)
+        # Replaced in one step: the gallery may be serving the old one
+        tmp = job_path / f"{THUMBNAIL_FILE}.tmp"
+        tmp.write_bytes(encode_png(thumbnail, compress_level=9))
+        tmp.replace(job_path / THUMBNAIL_FILE)
+        return {'filename': THUMBNAIL_FILE, 'width': int(thumbnail.shape[1]), 'height': int(thumbnail.shape[0])}
+
+    # -------------------------------------------------------------------- edit
+    def apply(self, job_dir: str, volume: BrickLabelStore, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if not operations:
+            raise ValueError("No operations given")
+        job_path = Path(job_dir)
+        if not (job_path / SCENE_FILE).exists():
+            raise ValueError("This job predates label editing; upload it again to edit it")
+
+        with self._job_lock(job_dir):
+            # The caller opened the store before taking the lock; another edit may
+            # have rewritten its index since, so start from what is on disk now
+            volume = BrickLabelStore(str(volume.path))
+            start_time = time.perf_counter()
+            with open(job_path / 'metadata.json', 'r') as f:
+                metadata = json.load(f)
+            spacing = np.asarray(metadata['spacing'], dtype=np.float64)
+            downsample_factor = metadata.get('downsample_factor', 2)
+            scene_points = read_glb_points(str(job_path / SCENE_FILE))
+            bones = {b['label_id']: b for b in metadata['bones']}
+            touched = {}
+            changed_voxels = 0
+            rewritten_bricks = 0
+
+            for op in operations:
+                start, stop, mask = self._operation_mask(op, volume.shape, spacing)
+                if not mask.any():
+                    continue
+                before = volume.read_region(start, stop)
+                after = before.copy()
+                if op['mode'] == 'paint':
+                    after[mask] = op['label']
+                else:
+                    after[mask & (before == op['label'])] = 0
+                changed = before != after
+                if not changed.any():
+                    continue
+
+                changed_voxels += int(changed.sum())
+                rewritten_bricks += volume.write_region(start, after)
+                for label_id in np.union1d(before[changed], after[changed]):
+                    label_id = int(label_id)
+                    if label_id == 0:
+                        continue
+                    if label_id not in touched:
+                        touched[label_id] = (self._load_bone(job_path, bones[label_id], scene_points)
+                                             if label_id in bones else self._new_bone(label_id))
+                    self._splice(touched[label_id], volume, spacing, start, stop, before, after,
+                                 downsample_factor)
+
+            removed = []
+            for label_id, bone in touched.items():
+                if bone['meta']['num_voxels'] <= 0:
+                    self._remove_bone(job_path, bone['meta'])
+                    bones.pop(label_id, None)
+                    scene_points.pop(bone['meta']['name'], None)
+                    removed.append(bone['meta']['name'])
+                    continue
+                self._finish_bone(job_path, bone, volume, spacing)
+                bones[label_id] = bone['meta']
+                scene_points[bone['meta']['name']] = bone['points']
+
+            if touched:
+                ordered = [bones[label_id] for label_id in sorted(bones)]
+                scene_bytes = write_glb(str(job_path / SCENE_FILE), [
+                    (b['name'], b['label_id'], scene_points.get(b['name'], np.zeros((0, 3))), b['color'])
+                    for b in ordered])
+                metadata['bones'] = ordered
+                metadata['total_bones'] = len(ordered)
+                metadata['scene']['size_bytes'] = int(scene_bytes)
+                metadata['edit_revision'] = metadata.get('edit_revision', 0) + 1
+                metadata['thumbnail'] = self._refresh_thumbnail(job_path, volume, spacing)
+                if 'label_store' in metadata:
+                    metadata['label_store'].update({
+                        'stored_bricks': int((volume.offsets >= 0).sum()),
+                        'disk_bytes': volume.disk_usage()
+                    })
+                with open(job_path / 'metadata.json', 'w') as f:
+                    json.dump(metadata, f, indent=2)
+
+            elapsed = (time.perf_counter() - start_time) * 1000
+            logger.info(f"Applied {len(operations)} label edits to {job_path.name}: "
+                        f"{changed_voxels:,} voxels changed in {elapsed:.0f} ms")
+            return {
+                'changed_voxels': changed_voxels,
+                'rewritten_bricks': rewritten_bricks,
+                'edit_revision': metadata.get('edit_revision', 0),
+                'bones': [bones[label_id] for label_id in sorted(touched) if label_id in bones],
+                'removed_bones': removed,
+                'time_ms': round(elapsed, 2)
+            }
@@ -0,0 +1,156 @@
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'
+}
+
+
+def load_mesh(path: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Load an implant mesh (STL, PLY or OBJ).
+    Returns (vertices (N, 3) float64, triangles (M, 3) int64 or None).
+    """
+    ext = Path(path).suffix.lower()
+    if ext == '.stl':
+        return _load_stl(path)
+    if ext == '.ply':
+        return _load_ply(path)
+    if ext == '.obj':
+        return _load_obj(path)
+    raise ValueError(f"Unsupported mesh format: {ext}")
+
+
+def mesh_sample_points(vertices: np.ndarray, triangles: Optional[np.ndarray]) -> np.ndarray:
+    """Vertices plus triangle centroids, so large flat faces are also sampled."""
+    if triangles is None or len(triangles) == 0:
+        return vertices
+    centroids = vertices[triangles].mean(axis=1)
+    return np.vstack([vertices, centroids])
+
+
+def _load_stl(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # Binary STL: 80-byte header, uint32 count, 50 bytes per triangle
+    if len(data) >= 84:
+        count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+        if 84 + count * 50 == len(data):
+            record = np.dtype([('normal', '<f4', 3), ('v', '<f4', (3, 3)), ('attr', '<u2')])
+            tris = np.frombuffer(data, dtype=record, count=count, offset=84)['v']
+            return _weld(tris.reshape(-1, 3).astype(np.float64))
+
+    coords = [line.split()[1:4] for line in data.decode('ascii', errors='ignore').splitlines()
+              if line.strip().startswith('vertex')]
+    return _weld(np.asarray(coords, dtype=np.float64))
+
+
+def _weld(corners):
+    """Merge duplicated triangle corners into shared vertices."""
+    vertices, inverse = np.unique(corners, axis=0, return_inverse=True)
+    return vertices, inverse.reshape(-1, 3).astype(np.int64)
+
+
+def _load_ply(path):
+    with open(path, 'rb') as f:
+        header = []
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"Truncated PLY header: {path}")
+            line = line.decode('ascii', errors='ignore').strip()
+            header.append(line)
+            if line == 'end_header':
+                break
+        body = f.read()
+
+    fmt = 'ascii'
+    elements = []  # [name, count, [(prop name, dtype | list spec)]]
+    for line in header:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == 'format':
+            fmt = parts[1]
+        elif parts[0] == 'element':
+            elements.append([parts[1], int(parts[2]), []])
+        elif parts[0] == 'property' and elements:
+            if parts[1] == 'list':
+                elements[-1][2].append((parts[4], ('list', PLY_TYPES[parts[2]], PLY_TYPES[parts[3]])))
+            else:
+                elements[-1][2].append((parts[2], PLY_TYPES[parts[1]]))
+
+    vertices, triangles = None, None
+    if fmt == 'ascii':
+        lines = body.decode('ascii', errors='ignore').splitlines()
+        pos = 0
+        for name, count, props in elements:
+            rows = lines[pos:pos + count]
+            pos += count
+            if name == 'vertex':
+                names = [p[0] for p in props]
+                table = np.asarray([r.split()[:len(names)] for r in rows], dtype=np.float64)
+                vertices = table[:, [names.index('x'), names.index('y'), names.index('z')]]
+            elif name == 'face':
+                triangles = _triangulate([list(map(int, r.split()[1:])) for r in rows])
+    else:
+        endian = '<' if fmt == 'binary_little_endian' else '>'
+        offset = 0
+        for name, count, props in elements:
+            if any(isinstance(p[1], tuple) for p in props):
+                # List properties (faces) have variable length records
+                faces = []
+                for _ in range(count):
+                    row = []
+                    for _, spec in props:
+                        if isinstance(spec, tuple):
+                            n = int(np.frombuffer(body, dtype=endian + spec[1], count=1, offset=offset)[0])
+                            offset += np.dtype(spec[1]).itemsize
+                            row = np.frombuffer(body, dtype=endian + spec[2], count=n, offset=offset).tolist()
+                            offset += n * np.dtype(spec[2]).itemsize
+                        else:
+                            offset += np.dtype(spec).itemsize
+                    faces.append(row)
+                if name == 'face':
+                    triangles = _triangulate(faces)
+                continue
+            dtype = np.dtype([(p[0], endian + p[1]) for p in props])
+            table = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+            offset += count * dtype.itemsize
+            if name == 'vertex':
+                vertices = np.stack([table['x'], table['y'], table['z']], axis=1).astype(np.float64)
+
+    if vertices is None:
+        raise ValueError(f"PLY file has no vertex element: {path}")
+    return vertices, triangles
+
+
+def _load_obj(path):
+    vertices, faces = [], []
+    with open(path, 'r', errors='ignore') as f:
+        for line in f:
+            if line.startswith('v '):
+                vertices.append(line.split()[1:4])
+            elif line.startswith('f '):
+                faces.append([int(tok.split('/')[0]) - 1 for tok in line.split()[1:]])
+    vertices = np.asarray(vertices, dtype=np.float64)
+    # Negative OBJ indices are relative to the end of the vertex list
+    faces = [[i if i >= 0 else len(vertices) + i + 1 for i in face] for face in faces]
+    return vertices, _triangulate(faces)
+
+
+def _triangulate(faces):
+    """Fan-triangulate polygon faces."""
+    tris = [(face[0], face[i], face[i + 1]) for face in faces for i in range(1, len(face) - 1)]
+    if not tris:
+        return None
+    return np.asarray(tris, dtype=np.int64)
@@ -1,13 +1,35 @@
 import numpy as np
 import nibabel as nib
 from pathlib import Path
+import hashlib
 import json
 import logging
-from typing import Dict, Any
+import shutil
+import time
+from typing import Dict, Any, Callable, Optional, Tuple
+from scipy import ndimage
 from ..domain.interfaces import IBoneProcessor
+from .brick_store import BrickLabelStore, LABEL_STORE_DIR, MAX_LABEL_ID
+from .gltf_exporter import write_glb, read_glb_points
+from .imaging import encode_png
+from .postprocessing import ConnectedComponentFilter
+from .thumbnail import render_thumbnail
 
 logger = logging.getLogger(__name__)
 
+# Sub-directory of a job holding per-bone surface points and normals (.npy)
+SURFACE_DIR = "surfaces"
+
+# Single-file binary glTF holding every bone of a job
+SCENE_FILE = "scene.glb"
+
+# Small preview image shown in the job gallery
+THUMBNAIL_FILE = "thumbnail.png"
+
+# 26-neighbourhood offsets used to estimate surface normals
+NEIGHBOUR_OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                              if (i, j, k) != (0, 0, 0)])
+
 # Dataset labels
 LABELS = {
     0: "background",
@@ -33,7 +55,17 @@ BONE_COLORS = {
     'Threshold-200-MAX': (150, 150, 150)  # Gray
 }
 
+# Vertices formatted per %-operation when writing ASCII PLY files
+PLY_BLOCK_ROWS = 65536
+
+# Labels exported as they are predicted: the threshold class is fragmented by nature
+ISLAND_FILTER_SKIP_LABELS = (8,)
+
 class NiftiBoneProcessor(IBoneProcessor):
+    def __init__(self, brick_size: int = 32, component_filter: Optional[ConnectedComponentFilter] = None):
+        self.brick_size = brick_size
+        self.component_filter = component_filter or ConnectedComponentFilter(skip_labels=ISLAND_FILTER_SKIP_LABELS)
+
     def extract_bone_voxels(self, segmentation_data, label_id, spacing):
         """Extract voxels for a specific bone and convert to world coordinates"""
         bone_mask = (segmentation_data == label_id)
@@ -41,47 +73,262 @@ class NiftiBoneProcessor(IBoneProcessor):
         world_coords = voxel_coords * spacing
         return voxel_coords, world_coords
 
-    def write_ply_file(self, vertices, output_path, colors=None):
-        """Write PLY file with optional vertex colors"""
-        num_vertices = len(vertices)
+    @staticmethod
+    def to_label_array(seg_data) -> np.ndarray:
+        """uint8 copy of a label volume; out-of-range ids are rejected before the cast could wrap them"""
+        seg_data = np.asarray(seg_data)
+        if seg_data.dtype == np.uint8:
+            return seg_data
+        if not np.issubdtype(seg_data.dtype, np.integer):
+            seg_data = np.rint(seg_data)
+        if seg_data.size and (seg_data.min() < 0 or seg_data.max() > MAX_LABEL_ID):
+            raise ValueError(f"Label ids must be within 0..{MAX_LABEL_ID}, "
+                             f"got {seg_data.min():g}..{seg_data.max():g}")
+        return seg_data.astype(np.uint8)
+
+    def load_label_volume(self, nifti_path):
+        """Load a segmentation as a compact uint8 label array (no float64 copy)"""
+        nii = nib.load(nifti_path)
+        return self.to_label_array(np.asanyarray(nii.dataobj)), nii.header.get_zooms()[:3]
+
+    def extract_surface_voxels(self, voxel_coords, spacing=(1.0, 1.0, 1.0)):
+        """
+        Voxels of a bone with at least one 6-neighbour outside the bone, and
+        their outward unit normals (world frame) from the 26-neighbourhood
+        """
+        lo = voxel_coords.min(axis=0) - 1
+        crop_shape = tuple(voxel_coords.max(axis=0) - lo + 2)
+        mask = np.zeros(crop_shape, dtype=bool)
+        local = voxel_coords - lo
+        mask[local[:, 0], local[:, 1], local[:, 2]] = True
         
+        interior = mask[1:-1, 1:-1, 1:-1].copy()
+        for axis in range(3):
+            for shift in (-1, 1):
+                interior &= np.roll(mask, shift, axis=axis)[1:-1, 1:-1, 1:-1]
+        surface = mask[1:-1, 1:-1, 1:-1] & ~interior
+        surface_local = np.argwhere(surface) + 1
+        
+        # Normals point away from the bone voxels around each surface voxel
+        normals = np.zeros(surface_local.shape, dtype=np.float64)
+        for offset in NEIGHBOUR_OFFSETS:
+            n = surface_local + offset
+            normals -= mask[n[:, 0], n[:, 1], n[:, 2]][:, None] * offset
+        normals /= np.asarray(spacing, dtype=np.float64)
+        length = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals = np.divide(normals, length, out=np.zeros_like(normals), where=length > 0)
+        
+        return surface_local + lo, normals
+
+    def label_digests(self, segmentation_data, spacing) -> Dict[int, str]:
+        """
+        Digest of each label's mask, cropped to its bounding box. Position,
+        crop shape and spacing are hashed too, so two labels only match when
+        they produce identical geometry.
+        """
+        digests = {}
+        boxes = ndimage.find_objects(segmentation_data, max_label=max(LABELS))
+        for label_id, box in enumerate(boxes, start=1):
+            if box is not None:
+                digests[label_id] = self.mask_digest(segmentation_data[box] == label_id,
+                                                     [s.start for s in box], spacing)
+        return digests
+
+    @staticmethod
+    def mask_digest(mask, start, spacing) -> str:
+        """Digest of one label mask cropped to its bounding box, which starts at voxel `start`."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.array(list(start) + list(mask.shape), dtype='<i8').tobytes())
+        h.update(np.asarray(spacing, dtype='<f8').tobytes())
+        h.update(np.packbits(mask).tobytes())
+        return h.hexdigest()
+
+    def load_reusable_bones(self, previous_output_dir: Optional[str], digests: Dict[int, str],
+                            downsample_factor: int) -> Dict[str, Tuple[Dict[str, Any], np.ndarray]]:
+        """Bones of a previous job whose digest is unchanged: name -> (metadata, scene points)."""
+        if previous_output_dir is None:
+            return {}
+        previous_path = Path(previous_output_dir)
+        metadata_file = previous_path / 'metadata.json'
+        scene_file = previous_path / SCENE_FILE
+        if not metadata_file.exists() or not scene_file.exists():
+            return {}
+        with open(metadata_file, 'r') as f:
+            previous = json.load(f)
+        if previous.get('downsample_factor') != downsample_factor:
+            return {}
+
+        scene_points = read_glb_points(str(scene_file))
+        reusable = {}
+        for bone in previous['bones']:
+            name = bone['name']
+            files = [previous_path / bone['filename'], previous_path / SURFACE_DIR / f"{name}.npy",
+                     previous_path / SURFACE_DIR / f"{name}.normals.npy"]
+            if (bone.get('digest') is not None and bone['digest'] == digests.get(bone['label_id'])
+                    and name in scene_points and all(f.exists() for f in files)):
+                reusable[name] = (bone, scene_points[name])
+        return reusable
+
+    def copy_bone_outputs(self, previous_output_dir: str, output_path: Path, bone: Dict[str, Any]):
+        """Copy a bone's PLY and surface arrays from a previous job."""
+        previous_path = Path(previous_output_dir)
+        (output_path / SURFACE_DIR).mkdir(exist_ok=True)
+        shutil.copyfile(previous_path / bone['filename'], output_path / bone['filename'])
+        for suffix in ('.npy', '.normals.npy'):
+            name = f"{bone['name']}{suffix}"
+            shutil.copyfile(previous_path / SURFACE_DIR / name, output_path / SURFACE_DIR / name)
+
+    @staticmethod
+    def _ply_header(num_vertices, colors=None, properties=None) -> str:
         header = f"ply\nformat ascii 1.0\ncomment Created from bone segmentation\nelement vertex {num_vertices}\nproperty float x\nproperty float y\nproperty float z\n"
         
         if colors is not None:
             header += "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+        for name in properties or {}:
+            header += f"property uchar {name}\n"
         
-        header += "end_header\n"
-        
+        return header + "end_header\n"
+
+    @staticmethod
+    def _ply_rows(vertices, colors=None, properties=None):
+        """ASCII PLY vertex lines, formatted a block at a time with one %-format per block"""
+        row = "%.6f %.6f %.6f"
+        columns = [np.asarray(vertices, dtype=np.float64).reshape(-1, 3)]
+        if colors is not None:
+            row += " %d %d %d"
+            columns.append(np.asarray(colors, dtype=np.float64).reshape(-1, 3))
+        for values in (properties or {}).values():
+            row += " %d"
+            columns.append(np.asarray(values, dtype=np.float64).reshape(-1, 1))
+        row += "\n"
+        table = np.hstack(columns)
+        for block in range(0, len(table), PLY_BLOCK_ROWS):
+            rows = table[block:block + PLY_BLOCK_ROWS]
+            yield (row * len(rows)) % tuple(rows.ravel().tolist())
+
+    def write_ply_file(self, vertices, output_path, colors=None, properties=None):
+        """Write PLY file with optional vertex colors and extra per-vertex uchar properties (name -> values)"""
+        num_vertices = len(vertices)
         with open(output_path, 'w') as f:
-            f.write(header)
-            for i in range(num_vertices):
-                line = f"{vertices[i, 0]:.6f} {vertices[i, 1]:.6f} {vertices[i, 2]:.6f}"
-                if colors is not None:
-                    line += f" {int(colors[i, 0])} {int(colors[i, 1])} {int(colors[i, 2])}"
-                line += "\n"
-                f.write(line)
+            f.write(self._ply_header(num_vertices, colors, properties))
+            for text in self._ply_rows(vertices, colors, properties):
+                f.write(text)
         
         logger.info(f"Wrote PLY file: {output_path} ({num_vertices:,} vertices)")
 
-    def process_segmentation(self, nifti_path: str, output_dir: str, downsample_factor: int = 2) -> Dict[str, Any]:
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+    def splice_ply_file(self, vertices, output_path, source_rows, colors=None):
+        """
+        Rewrite a PLY written by write_ply_file after some of its vertices
+        changed. Row i of the new file is line source_rows[i] of the current
+        file, or vertices[i] formatted anew where source_rows[i] is -1, so
+        runs of unchanged lines are copied as bytes and only the changed
+        vertices are formatted. Falls back to a full write when the current
+        file does not have the expected layout.
+        """
+        output_path = Path(output_path)
+        source_rows = np.asarray(source_rows, dtype=np.int64)
+        kept = source_rows >= 0
+        body = None
+        if kept.any() and output_path.exists():
+            data = output_path.read_bytes()
+            header_end = data.find(b"end_header\n") + len(b"end_header\n")
+            line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8, offset=header_end) == 10) + 1
+            expected = self._ply_header(len(line_ends), colors).encode('ascii')
+            if data[:header_end] == expected and source_rows.max() < len(line_ends):
+                body = memoryview(data)[header_end:]
+                line_starts = np.concatenate([[0], line_ends[:-1]])
+        if body is None:
+            self.write_ply_file(vertices, output_path, colors)
+            return
+
+        # Runs of new rows, and of rows that were consecutive lines of the old file
+        breaks = np.flatnonzero((kept[1:] != kept[:-1]) |
+                                (kept[1:] & (source_rows[1:] != source_rows[:-1] + 1))) + 1
+        bounds = np.concatenate([[0], breaks, [len(source_rows)]])
+        vertices = np.asarray(vertices)
+        tmp = output_path.with_name(output_path.name + ".tmp")
+        with open(tmp, 'wb') as f:
+            f.write(self._ply_header(len(source_rows), colors).encode('ascii'))
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                if kept[a]:
+                    f.write(body[line_starts[source_rows[a]]:line_ends[source_rows[b - 1]]])
+                else:
+                    run_colors = None if colors is None else np.asarray(colors)[a:b]
+                    for text in self._ply_rows(vertices[a:b], run_colors):
+                        f.write(text.encode('ascii'))
+        tmp.replace(output_path)
+        logger.info(f"Spliced PLY file: {output_path} ({len(source_rows):,} vertices, "
+                    f"{int((~kept).sum()):,} rewritten)")
+
+    def process_segmentation(self, nifti_path: str, output_dir: str, downsample_factor: int = 2,
+                             progress: Optional[Callable[..., None]] = None,
+                             previous_output_dir: Optional[str] = None,
+                             remove_islands: bool = False) -> Dict[str, Any]:
+        progress = progress or (lambda stage, **data: None)
+        start = time.perf_counter()
         
         logger.info(f"Loading segmentation: {nifti_path}")
-        nii = nib.load(nifti_path)
-        seg_data = nii.get_fdata()
-        spacing = nii.header.get_zooms()
+        seg_data, spacing = self.load_label_volume(nifti_path)
         
         logger.info(f"Segmentation shape: {seg_data.shape}")
+        progress('decoded', shape=[int(x) for x in seg_data.shape], spacing=[float(x) for x in spacing],
+                 stage_ms=round((time.perf_counter() - start) * 1000, 2))
+        
+        return self.process_volume(seg_data, spacing, output_dir, downsample_factor, progress,
+                                   previous_output_dir, start_time=start, remove_islands=remove_islands)
+
+    def process_volume(self, seg_data: np.ndarray, spacing, output_dir: str, downsample_factor: int = 2,
+                       progress: Optional[Callable[..., None]] = None,
+                       previous_output_dir: Optional[str] = None,
+                       start_time: Optional[float] = None, remove_islands: bool = False) -> Dict[str, Any]:
+        """
+        Export bones from an in-memory label volume (e.g. straight from the
+        predictor). With `remove_islands` (predictions only; uploaded labels
+        are exported as they are) stray islands are removed from `seg_data`
+        in place first.
+        """
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        progress = progress or (lambda stage, **data: None)
+        start = start_time or time.perf_counter()
+        seg_data = self.to_label_array(seg_data)
+        
+        islands = None
+        if remove_islands:
+            islands = self.component_filter.apply(seg_data, spacing)
+            progress('postprocessed', removed_voxels=islands['removed_voxels'], stage_ms=islands['time_ms'])
+        
+        # Brick-indexed copy of the labels; per-label extraction below and
+        # later slice/ROI queries only read the bricks holding each label
+        store = BrickLabelStore.build(seg_data, output_path / LABEL_STORE_DIR, spacing, self.brick_size)
+        present = set(store.labels_present())
+        total_bones = sum(1 for label_id, name in LABELS.items() if name != "background" and label_id in present)
+        
+        # Labels unchanged since the previous revision keep their geometry
+        digests = self.label_digests(seg_data, spacing)
+        reusable = self.load_reusable_bones(previous_output_dir, digests, downsample_factor)
         
         bones_metadata = []
+        scene_bones = []
         
         # Process each bone label
         for label_id, bone_name in LABELS.items():
-            if bone_name == "background":
+            if bone_name == "background" or label_id not in present:
                 continue
             
-            voxel_coords, world_coords = self.extract_bone_voxels(seg_data, label_id, spacing)
+            bone_start = time.perf_counter()
+            if bone_name in reusable:
+                bone, points = reusable[bone_name]
+                self.copy_bone_outputs(previous_output_dir, output_path, bone)
+                bones_metadata.append(bone)
+                scene_bones.append((bone_name, label_id, points, bone['color']))
+                logger.info(f"↺ {bone_name}: unchanged, reusing previous geometry")
+                progress('bone', index=len(bones_metadata), total=total_bones, bone=bone, reused=True,
+                         stage_ms=round((time.perf_counter() - bone_start) * 1000, 2))
+                continue
+            
+            voxel_coords = store.label_coords(label_id)
+            world_coords = voxel_coords * np.asarray(spacing, dtype=np.float64)
             
             if len(voxel_coords) > 0:
                 # Downsample for performance
@@ -98,6 +345,15 @@ class NiftiBoneProcessor(IBoneProcessor):
                 # Write PLY file
                 ply_file = output_path / f"{bone_name}.ply"
                 self.write_ply_file(world_coords_downsampled, ply_file, colors)
+                scene_bones.append((bone_name, label_id, world_coords_downsampled, color))
+                
+                # Surface points back the spatial index used for implant queries
+                surface_voxels, surface_normals = self.extract_surface_voxels(voxel_coords, spacing)
+                surface_coords = surface_voxels * np.asarray(spacing, dtype=np.float64)
+                surface_dir = output_path / SURFACE_DIR
+                surface_dir.mkdir(exist_ok=True)
+                np.save(surface_dir / f"{bone_name}.npy", surface_coords.astype(np.float32))
+                np.save(surface_dir / f"{bone_name}.normals.npy", surface_normals.astype(np.float32))
                 
                 # Calculate bounding box
                 bbox_min = [float(x) for x in world_coords.min(axis=0)]
@@ -111,6 +367,8 @@ class NiftiBoneProcessor(IBoneProcessor):
                     'filename': ply_file.name,
                     'num_voxels': int(len(voxel_coords)),
                     'num_points': int(len(world_coords_downsampled)),
+                    'num_surface_points': int(len(surface_coords)),
+                    'digest': digests[label_id],
                     'color': list(color),
                     'bounding_box': {
                         'min': bbox_min,
@@ -120,17 +378,43 @@ class NiftiBoneProcessor(IBoneProcessor):
                 })
                 
                 logger.info(f"✓ {bone_name}: {len(voxel_coords):,} voxels → {len(world_coords_downsampled):,} points")
+                progress('bone', index=len(bones_metadata), total=total_bones, bone=bones_metadata[-1],
+                         reused=False, stage_ms=round((time.perf_counter() - bone_start) * 1000, 2))
+        
+        # Gallery preview straight from the label map
+        thumbnail = render_thumbnail(seg_data, spacing)
+        (output_path / THUMBNAIL_FILE).write_bytes(encode_png(thumbnail, compress_level=9))
+        
+        # The whole scene in one request for clients that support glTF
+        scene_bytes = write_glb(str(output_path / SCENE_FILE), scene_bones)
+        progress('scene', filename=SCENE_FILE, size_bytes=int(scene_bytes))
         
         # Save metadata
         metadata = {
             'segmentation_shape': [int(x) for x in seg_data.shape],
             'spacing': [float(x) for x in spacing],
             'bones': bones_metadata,
-            'total_bones': len(bones_metadata)
+            'total_bones': len(bones_metadata),
+            'downsample_factor': downsample_factor,
+            'revision_of': Path(previous_output_dir).name if previous_output_dir else None,
+            'reused_bones': sorted(reusable),
+            'removed_islands': ({LABELS.get(label_id, str(label_id)): removed
+                                 for label_id, removed in islands['labels'].items()} if islands else None),
+            'scene': {'filename': SCENE_FILE, 'size_bytes': int(scene_bytes)},
+            'thumbnail': {'filename': THUMBNAIL_FILE, 'width': int(thumbnail.shape[1]),
+                          'height': int(thumbnail.shape[0])},
+            'label_store': {
+                'brick_size': store.brick_size,
+                'stored_bricks': int((store.offsets >= 0).sum()),
+                'total_bricks': int(len(store.offsets)),
+                'disk_bytes': store.disk_usage()
+            }
         }
         
         metadata_file = output_path / 'metadata.json'
         with open(metadata_file, 'w') as f:
             json.dump(metadata, f, indent=2)
         
+        progress('processed', total_bones=len(bones_metadata),
+                 total_ms=round((time.perf_counter() - start) * 1000, 2))
         return metadata
@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from ..domain.interfaces import IProgressBroker
+
+# Stages after which a job produces no further events
+TERMINAL_STAGES = ("complete", "error")
+
+
+class JobProgressBroker(IProgressBroker):
+    """
+    In-memory progress history per job. Processing threads publish events;
+    stream readers replay the history from any position and then follow new
+    events. Only the most recent `max_jobs` jobs are kept.
+    """
+
+    def __init__(self, max_jobs: int = 256):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs[job_id] = {'events': [], 'started': time.perf_counter()}
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def publish(self, job_id: str, stage: str, **data: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['events'].append({
+                'id': len(job['events']),
+                'stage': stage,
+                'elapsed_ms': round((time.perf_counter() - job['started']) * 1000, 2),
+                **data
+            })
+
+    def events_since(self, job_id: str, cursor: int = 0) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else job['events'][cursor:]
+
+    def is_finished(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job is not None and bool(job['events']) and job['events'][-1]['stage'] in TERMINAL_STAGES
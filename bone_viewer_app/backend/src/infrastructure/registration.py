@@ -0,0 +1,142 @@
+import logging
+import time
+from typing import Any, Dict, Sequence
+
+import numpy as np
+
+from ..domain.interfaces import IImplantRegistrar
+from .spatial_index import BoneProximityIndex, BoneSurfaceIndex
+
+logger = logging.getLogger(__name__)
+
+
+def rotation_from_vector(omega: np.ndarray) -> np.ndarray:
+    """Rodrigues' formula for a rotation vector (radians)."""
+    angle = float(np.linalg.norm(omega))
+    if angle < 1e-12:
+        return np.eye(3)
+    k = omega / angle
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+
+def point_to_plane_step(source: np.ndarray, target: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    """
+    One linearised point-to-plane least-squares step, rotating about the
+    source centroid. Returns the 4x4 incremental transform moving `source`
+    towards the target planes.
+    """
+    centre = source.mean(axis=0)
+    local = source - centre
+    residual = np.einsum('ij,ij->i', local + centre - target, normals)
+    J = np.hstack([np.cross(local, normals), normals])
+    x, *_ = np.linalg.lstsq(J, -residual, rcond=None)
+    rotation = rotation_from_vector(x[:3])
+    step = np.eye(4)
+    step[:3, :3] = rotation
+    step[:3, 3] = x[3:] + centre - rotation @ centre
+    return step
+
+
+class ImplantRegistrar(IImplantRegistrar):
+    """
+    Trimmed point-to-plane ICP of an implant onto one bone surface.
+
+    Correspondences come from the cached KD-trees of the bone's LOD levels,
+    running coarse-to-fine (16 mm, 4 mm, 1 mm cells) so the early iterations
+    work on a few hundred target points.
+    """
+
+    def __init__(self, proximity_index: BoneProximityIndex, max_source_points: int = 3000, seed: int = 0):
+        self.proximity_index = proximity_index
+        self.max_source_points = max_source_points
+        self.seed = seed
+
+    def _source_points(self, implant_path: str) -> np.ndarray:
+        points = self.proximity_index.load_implant_points(implant_path)
+        if len(points) <= self.max_source_points:
+            return points
+        rng = np.random.default_rng(self.seed)
+        return points[rng.choice(len(points), self.max_source_points, replace=False)]
+
+    def _align_level(self, index: BoneSurfaceIndex, depth: int, source: np.ndarray, transform: np.ndarray,
+                     overlap: float, max_iterations: int, tolerance: float, max_distance: float):
+        level = index.levels[depth]
+        tree = index.level_tree(depth)
+        normals = index.normals[level['rep_index']]
+
+        rms, inliers, iterations = np.inf, 0, 0
+        for iterations in range(1, max_iterations + 1):
+            moved = source @ transform[:3, :3].T + transform[:3, 3]
+            distances, nearest = tree.query(moved, k=1, distance_upper_bound=max_distance, workers=-1)
+            valid = np.flatnonzero(np.isfinite(distances))
+            valid = valid[np.any(normals[nearest[valid]], axis=1)]
+            if len(valid) < 6:
+                break
+
+            # Trim to the closest `overlap` share of the matched pairs
+            keep = max(6, int(len(valid) * overlap))
+            valid = valid[np.argpartition(distances[valid], keep - 1)[:keep]]
+            target = level['reps'][nearest[valid]]
+            plane_normals = normals[nearest[valid]]
+
+            step = point_to_plane_step(moved[valid], target, plane_normals)
+            transform = step @ transform
+
+            residual = np.einsum('ij,ij->i', moved[valid] - target, plane_normals)
+            rms, inliers = float(np.sqrt(np.mean(residual ** 2))), len(valid)
+            # Stop once the step moves the matched points by less than `tolerance` mm
+            shift = moved[valid] @ step[:3, :3].T + step[:3, 3] - moved[valid]
+            if np.sqrt(np.mean(np.sum(shift ** 2, axis=1))) < tolerance:
+                break
+        return transform, rms, inliers, iterations
+
+    def register(self, job_dir: str, bone: Dict[str, Any], implant_path: str,
+                 initial_transform: Sequence[Sequence[float]], overlap: float = 0.7,
+                 max_iterations: int = 30, tolerance: float = 1e-3) -> Dict[str, Any]:
+        start = time.perf_counter()
+        transform = np.asarray(initial_transform, dtype=np.float64)
+        if transform.shape != (4, 4):
+            raise ValueError("Transform must be a 4x4 matrix")
+        if not 0 < overlap <= 1:
+            raise ValueError("Overlap must be within (0, 1]")
+
+        index = self.proximity_index.get_index(job_dir, bone['name'])
+        if index.normals is None:
+            raise ValueError(f"No surface normals stored for {bone['name']}; re-process the job")
+
+        source = self._source_points(implant_path)
+        # LOD levels coarser than a fraction of the implant size cannot resolve it
+        extent = float(np.max(source.max(axis=0) - source.min(axis=0)))
+        depths = [d for d, level in enumerate(index.levels) if level['cell'] <= extent / 4]
+        if not depths:
+            depths = [len(index.levels) - 1]
+
+        stages = []
+        for stage, depth in enumerate(depths):
+            # The first level matches at any distance, so an implant placed away
+            # from the bone is still pulled in; later levels only trust pairs a
+            # few cells apart
+            max_distance = np.inf if stage == 0 else 4.0 * index.levels[depth]['cell']
+            transform, rms, inliers, iterations = self._align_level(
+                index, depth, source, transform, overlap, max_iterations, tolerance, max_distance)
+            if inliers < 6:
+                raise ValueError(f"Too few implant points near {bone['name']} to register at "
+                                 f"{index.levels[depth]['cell']} mm; move the implant closer to the bone")
+            stages.append({
+                'cell_mm': index.levels[depth]['cell'],
+                'iterations': iterations,
+                'rms_mm': round(rms, 4),
+                'inliers': inliers
+            })
+
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"Registered implant to {bone['name']} in {elapsed:.0f} ms (rms {stages[-1]['rms_mm']} mm)")
+        return {
+            'bone': bone['name'],
+            'transform': [[float(x) for x in row] for row in transform],
+            'rms_mm': stages[-1]['rms_mm'],
+            'fitness': round(stages[-1]['inliers'] / len(source), 4),
+            'stages': stages,
+            'time_ms': round(elapsed, 2)
+        }
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ..domain.interfaces import ILabelVolume, ISliceRenderer
+from .imaging import encode_png, label_color_lut
+
+# Voxel axis that each anatomical plane cuts through (RAS-ordered volumes)
+SLICE_AXES = {
+    'sagittal': 0,
+    'coronal': 1,
+    'axial': 2
+}
+
+SLICE_FORMATS = ('png', 'raw')
+
+
+class SliceRenderer(ISliceRenderer):
+    """
+    Renders orthogonal label slices and keeps the encoded results in an LRU
+    cache, so scrolling back and forth through a stack is served from memory.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.lut = label_color_lut()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render_slice(self, job_id: str, volume: ILabelVolume, axis: str, index: Optional[int] = None,
+                     fmt: str = 'png') -> Tuple[bytes, Tuple[int, int]]:
+        if axis not in SLICE_AXES:
+            raise ValueError(f"Unknown axis '{axis}'. Use one of: {', '.join(SLICE_AXES)}")
+        if fmt not in SLICE_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(SLICE_FORMATS)}")
+        if index is None:
+            index = volume.shape[SLICE_AXES[axis]] // 2
+
+        key = (job_id, volume.version, axis, index, fmt)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        plane = volume.read_slice(SLICE_AXES[axis], index)
+        # Display orientation: second in-plane axis up, first axis left-to-right
+        plane = np.ascontiguousarray(np.flipud(plane.T))
+
+        if fmt == 'png':
+            content = encode_png(self.lut[plane])
+        else:
+            content = plane.tobytes()
+        result = (content, plane.shape)
+
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
@@ -0,0 +1,228 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ..domain.interfaces import ILabelVolume, IProximityIndex
+from .mesh_io import load_mesh, mesh_sample_points
+from .nifti_processor import SURFACE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class _LRU:
+    """Small thread-safe LRU keyed by (path, mtime) tuples."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        value = build()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return value
+
+
+def _gather(starts: np.ndarray, order: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    """Concatenate the CSR groups `groups` (members listed in `order`)."""
+    first = starts[groups]
+    counts = starts[groups + 1] - first
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(first - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return order[np.arange(total) + shift]
+
+
+class BoneSurfaceIndex:
+    """
+    Multi-resolution index over one bone surface.
+
+    Each level keeps one representative point per occupied grid cell; cell
+    sizes are nested (every level divides the previous one), so a cell's
+    children and finally its surface points can be listed directly. Every
+    surface point lies within a level's `cell * sqrt(3)` of its cell's
+    representative, so distances from representatives bound the exact ones
+    and each level prunes the cells still worth visiting before their
+    full-resolution points are searched.
+    """
+
+    def __init__(self, points: np.ndarray, normals: Optional[np.ndarray] = None,
+                 cell_sizes: Sequence[float] = (16.0, 4.0, 1.0)):
+        self.points = points
+        self.normals = normals
+        self.levels = []
+        parent_of_point = None
+        for cell in cell_sizes:
+            keys = np.floor(points / cell).astype(np.int64)
+            _, first, cell_of = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+            cell_of = cell_of.reshape(-1)
+            level = {
+                'cell': cell,
+                'cover': cell * np.sqrt(3),
+                'rep_index': first,
+                'reps': points[first]
+            }
+            if parent_of_point is not None:
+                # Group this level's cells under their parent cells
+                parents = parent_of_point[first]
+                level['parent_order'] = np.argsort(parents, kind='stable')
+                level['parent_start'] = np.concatenate(
+                    [[0], np.cumsum(np.bincount(parents, minlength=len(self.levels[-1]['reps'])))])
+            self.levels.append(level)
+            parent_of_point = cell_of
+
+        # Surface points grouped by finest cell
+        self.point_order = np.argsort(parent_of_point, kind='stable')
+        self.point_start = np.concatenate(
+            [[0], np.cumsum(np.bincount(parent_of_point, minlength=len(self.levels[-1]['reps'])))])
+        # Full-resolution tree for the depth of implant points inside the bone
+        self.fine = cKDTree(points)
+        self._level_trees = {}
+
+    def level_tree(self, depth: int) -> cKDTree:
+        """KD-tree over the representatives of one LOD level, built on first use."""
+        if depth not in self._level_trees:
+            self._level_trees[depth] = cKDTree(self.levels[depth]['reps'])
+        return self._level_trees[depth]
+
+    def closest_pair(self, query_tree: cKDTree):
+        """
+        (query index, distance, surface point index) of the closest pair
+        between the points of `query_tree` and the bone surface.
+        """
+        cells = None
+        bound = np.inf
+        for depth, level in enumerate(self.levels):
+            reps = level['reps'] if cells is None else level['reps'][cells]
+            reach = bound + level['cover'] + 1e-6
+            dist, _ = query_tree.query(reps, k=1, distance_upper_bound=reach, workers=-1)
+            # Representatives are surface points themselves, so they tighten the bound
+            bound = min(bound, float(dist.min()))
+            kept = np.flatnonzero(dist <= bound + level['cover'] + 1e-6)
+            kept = kept if cells is None else cells[kept]
+
+            if depth + 1 < len(self.levels):
+                child = self.levels[depth + 1]
+                cells = _gather(child['parent_start'], child['parent_order'], kept)
+            else:
+                cells = _gather(self.point_start, self.point_order, kept)
+
+        distances, nearest = query_tree.query(self.points[cells], k=1, distance_upper_bound=bound + 1e-6,
+                                              workers=-1)
+        j = int(np.argmin(distances))
+        return int(nearest[j]), float(distances[j]), int(cells[j])
+
+
+class BoneProximityIndex(IProximityIndex):
+    """
+    Multi-resolution indexes over each bone's surface voxels, cached per
+    process. They are built when a job is processed (or on first use after a
+    restart) and answer implant distance / collision queries in world
+    millimetres, the same frame as the bone PLY files.
+    """
+
+    def __init__(self, max_trees: int = 64, max_implants: int = 16):
+        self._trees = _LRU(max_trees)
+        self._implants = _LRU(max_implants)
+
+    def _surface_file(self, job_dir: str, bone_name: str) -> Path:
+        return Path(job_dir) / SURFACE_DIR / f"{bone_name}.npy"
+
+    def get_index(self, job_dir: str, bone_name: str) -> BoneSurfaceIndex:
+        surface_file = self._surface_file(job_dir, bone_name)
+        key = (str(surface_file), surface_file.stat().st_mtime_ns)
+        normals_file = surface_file.with_suffix('.normals.npy')
+
+        def build():
+            points = np.load(surface_file).astype(np.float64)
+            normals = np.load(normals_file).astype(np.float64) if normals_file.exists() else None
+            return BoneSurfaceIndex(points, normals)
+
+        return self._trees.get_or_build(key, build)
+
+    def index_job(self, job_dir: str, bones: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        for bone in bones:
+            if self._surface_file(job_dir, bone['name']).exists():
+                self.get_index(job_dir, bone['name'])
+        logger.info(f"Indexed {len(bones)} bones in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def load_implant_points(self, implant_path: str) -> np.ndarray:
+        path = Path(implant_path)
+        key = (str(path), path.stat().st_mtime_ns)
+        return self._implants.get_or_build(key, lambda: mesh_sample_points(*load_mesh(str(path))))
+
+    def implant_distances(self, job_dir: str, bones: List[Dict[str, Any]], volume: ILabelVolume,
+                          spacing: Sequence[float], implant_path: str,
+                          transform: Sequence[Sequence[float]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        matrix = np.asarray(transform, dtype=np.float64)
+        if matrix.shape != (4, 4):
+            raise ValueError("Transform must be a 4x4 matrix")
+
+        local = self.load_implant_points(implant_path)
+        points = local @ matrix[:3, :3].T + matrix[:3, 3]
+        implant_tree = cKDTree(points)
+
+        # Label under every implant point, read only from the bricks it covers
+        spacing = np.asarray(spacing, dtype=np.float64)
+        voxels = np.rint(points / spacing).astype(np.int64)
+        inside_volume = np.all((voxels >= 0) & (voxels < np.asarray(volume.shape)), axis=1)
+        labels_at = np.zeros(len(points), dtype=np.int64)
+        if inside_volume.any():
+            lo = voxels[inside_volume].min(axis=0)
+            hi = voxels[inside_volume].max(axis=0) + 1
+            region = volume.read_region(lo, hi)
+            v = voxels[inside_volume] - lo
+            labels_at[inside_volume] = region[v[:, 0], v[:, 1], v[:, 2]]
+
+        results = []
+        for bone in bones:
+            if not self._surface_file(job_dir, bone['name']).exists():
+                continue
+            index = self.get_index(job_dir, bone['name'])
+            penetrating = labels_at == bone['label_id']
+
+            if penetrating.any():
+                # Depth of the deepest implant point inside the bone
+                inside = np.flatnonzero(penetrating)
+                distances, nearest = index.fine.query(points[inside], k=1, workers=-1)
+                j = int(np.argmax(distances))
+                i, penetration_depth, bone_point = int(inside[j]), float(distances[j]), int(nearest[j])
+                min_distance = 0.0
+            else:
+                i, min_distance, bone_point = index.closest_pair(implant_tree)
+                penetration_depth = 0.0
+
+            results.append({
+                'name': bone['name'],
+                'label_id': bone['label_id'],
+                'min_distance_mm': round(min_distance, 3),
+                'penetration_depth_mm': round(penetration_depth, 3),
+                'colliding': bool(penetrating.any()),
+                'num_penetrating_points': int(penetrating.sum()),
+                'contact_points': {
+                    'implant': [float(x) for x in points[i]],
+                    'bone': [float(x) for x in index.points[bone_point]]
+                }
+            })
+
+        return {
+            'bones': results,
+            'num_implant_points': int(len(points)),
+            'query_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
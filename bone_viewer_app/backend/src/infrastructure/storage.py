@@ -1,8 +1,30 @@
+import hashlib
+import json
+import logging
 import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import List
-from ..domain.interfaces import IStorageService
-from ..domain.entities import Implant
+from typing import List, Optional, Tuple
+
+import nibabel as nib
+import numpy as np
+from ..domain.interfaces import IStorageService, ILabelVolume
+from ..domain.entities import Implant, SegmentationJob
+from .brick_store import BrickLabelStore, LABEL_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Predictions are compressed to disk one at a time, off the request path
+_prediction_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prediction-writer')
+
+def content_job_id(path: str, length: int = 12) -> str:
+    """Job ID from the SHA-256 of a file, so the same input always maps to the same job."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:length]
 
 class FileSystemStorage(IStorageService):
     def __init__(self, base_path: str = "uploads"):
@@ -10,20 +32,23 @@ class FileSystemStorage(IStorageService):
         self.segmentation_dir = self.base_path / "segmentations"
         self.ply_dir = self.base_path / "ply"
         self.implant_dir = self.base_path / "implants"
+        self.ct_dir = self.base_path / "ct"
         
         # Create directories
-        for dir_path in [self.segmentation_dir, self.ply_dir, self.implant_dir]:
+        for dir_path in [self.segmentation_dir, self.ply_dir, self.implant_dir, self.ct_dir]:
             dir_path.mkdir(parents=True, exist_ok=True)
 
     def save_file(self, file_object, filename: str, directory_type: str) -> str:
         """
         Save a file object (like UploadFile.file) to disk.
-        directory_type: 'segmentation' or 'implant'
+        directory_type: 'segmentation', 'implant' or 'ct'
         """
         if directory_type == 'segmentation':
             target_dir = self.segmentation_dir
         elif directory_type == 'implant':
             target_dir = self.implant_dir
+        elif directory_type == 'ct':
+            target_dir = self.ct_dir
         else:
             raise ValueError(f"Unknown directory type: {directory_type}")
             
@@ -33,9 +58,42 @@ class FileSystemStorage(IStorageService):
             
         return str(file_path)
 
+    def load_image(self, file_path: str) -> Tuple[np.ndarray, Tuple[float, float, float], np.ndarray]:
+        """CT volume as float32 (no float64 copy), its voxel spacing and affine."""
+        nii = nib.load(file_path)
+        image = np.asanyarray(nii.dataobj).astype(np.float32, copy=False)
+        if image.ndim != 3:
+            raise ValueError(f"Expected a 3D volume, got shape {image.shape}")
+        return image, tuple(float(x) for x in nii.header.get_zooms()[:3]), nii.affine
+
+    def save_label_volume(self, labels: np.ndarray, affine: np.ndarray, filename: str) -> Future:
+        """
+        Write a label volume as gzipped NIfTI into the segmentations folder in
+        the background. The returned future resolves to the file path.
+        """
+        file_path = self.segmentation_dir / filename
+
+        def write():
+            tmp_path = file_path.with_name(f".{file_path.name}")
+            image = nib.Nifti1Image(labels, affine)
+            image.set_data_dtype(np.uint8)
+            nib.save(image, str(tmp_path))
+            tmp_path.replace(file_path)
+            logger.info(f"Saved prediction {file_path}")
+            return str(file_path)
+
+        future = _prediction_writer.submit(write)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"Saving {file_path} failed: {f.exception()}"))
+        return future
+
     def get_job_path(self, job_id: str) -> str:
         return str(self.ply_dir / job_id)
         
+    def get_implant_path(self, filename: str) -> Optional[str]:
+        implant_path = self.implant_dir / Path(filename).name
+        return str(implant_path) if implant_path.is_file() else None
+
     def list_implants(self) -> List[Implant]:
         implants = []
         for implant_file in self.implant_dir.iterdir():
@@ -47,3 +105,36 @@ class FileSystemStorage(IStorageService):
                     url=f"/implants/{implant_file.name}"
                 ))
         return implants
+
+    def get_label_volume(self, job_id: str) -> Optional[ILabelVolume]:
+        store_path = Path(self.get_job_path(job_id)) / LABEL_STORE_DIR
+        if not BrickLabelStore.exists(str(store_path)):
+            return None
+        return BrickLabelStore(str(store_path))
+
+    def list_jobs(self) -> List[SegmentationJob]:
+        # Uploads are stored as {job_id}_{filename}
+        uploads = {}
+        for upload in [*self.ct_dir.iterdir(), *self.segmentation_dir.iterdir()]:
+            job_id, _, filename = upload.name.partition('_')
+            uploads.setdefault(job_id, filename)
+
+        jobs = []
+        for job_dir in self.ply_dir.iterdir():
+            if not job_dir.is_dir():
+                continue
+            metadata_file = job_dir / "metadata.json"
+            if metadata_file.exists():
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+                status, stamp = "completed", metadata_file.stat().st_mtime
+            else:
+                metadata, status, stamp = {}, "processing", job_dir.stat().st_mtime
+            jobs.append(SegmentationJob(
+                job_id=job_dir.name,
+                filename=uploads.get(job_dir.name, ""),
+                created_at=datetime.fromtimestamp(stamp),
+                status=status,
+                metadata=metadata
+            ))
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
@@ -0,0 +1,48 @@
+from typing import Sequence
+
+import numpy as np
+
+from .imaging import label_color_lut
+
+# Projection axis and the (horizontal, vertical) display axes of each view,
+# matching the orientation of the slice endpoint
+THUMBNAIL_VIEWS = {
+    'coronal': (1, (0, 2)),
+    'sagittal': (0, (1, 2))
+}
+
+
+def _project(volume: np.ndarray, spacing: Sequence[float], axis: int, display_axes, height: int,
+             lut: np.ndarray) -> np.ndarray:
+    extent = np.asarray(volume.shape) * np.asarray(spacing, dtype=np.float64)
+    h_axis, v_axis = display_axes
+    width = int(np.clip(round(height * extent[h_axis] / extent[v_axis]), 1, 2 * height))
+
+    # Nearest-neighbour resample of the display axes before projecting, so
+    # only height * width * depth voxels are touched
+    index = [np.arange(n) for n in volume.shape]
+    index[h_axis] = np.linspace(0, volume.shape[h_axis] - 1, width).round().astype(np.int64)
+    index[v_axis] = np.linspace(0, volume.shape[v_axis] - 1, height).round().astype(np.int64)
+    sub = volume[np.ix_(*index)]
+
+    # Front-most label along the projection axis, darkened with depth
+    mask = sub > 0
+    first = np.argmax(mask, axis=axis)
+    hit = mask.any(axis=axis)
+    labels = np.take_along_axis(sub, np.expand_dims(first, axis), axis=axis).squeeze(axis)
+    shade = 1.0 - 0.6 * first / max(sub.shape[axis] - 1, 1)
+    image = lut[labels] * np.where(hit, shade, 0.0)[..., None]
+
+    # Rows are (h_axis, v_axis); display with the vertical axis up
+    if h_axis > v_axis:
+        image = image.transpose(1, 0, 2)
+    return np.flipud(image.transpose(1, 0, 2)).astype(np.uint8)
+
+
+def render_thumbnail(volume: np.ndarray, spacing: Sequence[float], height: int = 128, gap: int = 4) -> np.ndarray:
+    """Colour-coded coronal and sagittal label projections side by side, as an (H, W, 3) image."""
+    lut = label_color_lut()
+    views = [_project(volume, spacing, axis, display_axes, height, lut)
+             for axis, display_axes in THUMBNAIL_VIEWS.values()]
+    separator = np.zeros((height, gap, 3), dtype=np.uint8)
+    return np.hstack([views[0], separator, views[1]])
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from .storage import content_job_id
+
+logger = logging.getLogger(__name__)
+
+NIFTI_SUFFIXES = ('.nii.gz', '.nii')
+
+
+class WatchFolderIngestor:
+    """
+    Polls a directory tree (e.g. a shared nnUNet_preds folder) and turns each
+    new NIfTI file into a job once its size and mtime have stayed the same for
+    `stable_seconds`, so files still being written are never picked up.
+
+    Job IDs come from the file content: a file whose job already exists, or
+    whose content is already queued, is skipped. At most `max_in_flight` files
+    are processed at once; stable files beyond that wait for the next poll.
+    """
+
+    def __init__(self, watch_dir: str, process: Callable[[str, str], Any], job_exists: Callable[[str], bool],
+                 stable_seconds: float = 5.0, poll_seconds: float = 2.0, max_in_flight: int = 2):
+        self.watch_dir = Path(watch_dir)
+        self.process = process
+        self.job_exists = job_exists
+        self.stable_seconds = stable_seconds
+        self.poll_seconds = poll_seconds
+        self.max_in_flight = max_in_flight
+
+        self._candidates = {}  # path -> (size, mtime_ns, unchanged since)
+        self._handled = {}  # path -> (size, mtime_ns) when it was last taken
+        self._active_ids = set()
+        self._counts = {'processed': 0, 'duplicates': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='ingest')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='watch-folder', daemon=True)
+
+    def start(self):
+        self.watch_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Watching {self.watch_dir} for new segmentations "
+                    f"(stable {self.stable_seconds:g} s, max {self.max_in_flight} in flight)")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.poll_seconds + 1)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'watch_dir': str(self.watch_dir),
+                'pending': len(self._candidates),
+                'in_flight': len(self._active_ids),
+                'max_in_flight': self.max_in_flight,
+                **self._counts
+            }
+
+    # ------------------------------------------------------------------ scan
+    def scan(self, now: float = None) -> List[str]:
+        """Files that are new (or changed) and have been stable long enough."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        seen = set()
+        for path in self.watch_dir.rglob('*'):
+            if not path.name.endswith(NIFTI_SUFFIXES) or path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            key = str(path)
+            seen.add(key)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self._handled.get(key) == signature:
+                continue
+            previous = self._candidates.get(key)
+            if previous is None or previous[:2] != signature:
+                self._candidates[key] = (*signature, now)
+            elif stat.st_size > 0 and now - previous[2] >= self.stable_seconds:
+                ready.append(key)
+        # Forget files that disappeared before they were taken
+        for key in set(self._candidates) - seen:
+            del self._candidates[key]
+        return sorted(ready)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                for path in self.scan():
+                    if not self._slots.acquire(blocking=False):
+                        break
+                    with self._lock:
+                        self._handled[path] = self._candidates.pop(path)[:2]
+                    self._pool.submit(self._ingest, path)
+            except Exception:
+                logger.exception(f"Scanning {self.watch_dir} failed")
+
+    def _ingest(self, path: str):
+        job_id = None
+        try:
+            job_id = content_job_id(path)
+            with self._lock:
+                duplicate = job_id in self._active_ids
+                if not duplicate:
+                    self._active_ids.add(job_id)
+            if duplicate or self.job_exists(job_id):
+                logger.info(f"Skipping {path}: same content as job {job_id}")
+                with self._lock:
+                    self._counts['duplicates'] += 1
+                    if not duplicate:
+                        self._active_ids.discard(job_id)
+                return
+
+            logger.info(f"Ingesting {path} as job {job_id}")
+            self.process(path, job_id)
+            with self._lock:
+                self._counts['processed'] += 1
+                self._active_ids.discard(job_id)
+        except Exception:
+            logger.exception(f"Ingesting {path} failed")
+            with self._lock:
+                self._counts['failed'] += 1
+                self._active_ids.discard(job_id)
+        finally:
+            self._slots.release()
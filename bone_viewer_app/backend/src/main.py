@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -5,16 +6,33 @@ from pathlib import Path
 import uvicorn
 import logging
 
-from .presentation.api import router
+from .presentation.api import router, create_watch_folder_ingestor, create_inference_workers
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Optional ingestion of predictions dropped into BONE_VIEWER_WATCH_DIR
+    ingestor = create_watch_folder_ingestor()
+    if ingestor is not None:
+        ingestor.start()
+    # Inference workers load the model now, not on the first CT upload
+    inference_workers = create_inference_workers()
+    if inference_workers is not None:
+        inference_workers.start()
+    yield
+    if ingestor is not None:
+        ingestor.stop()
+    if inference_workers is not None:
+        inference_workers.stop()
+
 app = FastAPI(
     title="3D Bone Viewer API",
     description="Clean Architecture API for Medical Visualization",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -1,19 +1,128 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Response, Request, Header, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pathlib import Path
-from typing import List
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+from pydantic import BaseModel
 
 from ..application.services import BoneService
-from ..infrastructure.nifti_processor import NiftiBoneProcessor
+from ..infrastructure.nifti_processor import NiftiBoneProcessor, SCENE_FILE, THUMBNAIL_FILE
 from ..infrastructure.storage import FileSystemStorage
+from ..infrastructure.slice_renderer import SliceRenderer
+from ..infrastructure.spatial_index import BoneProximityIndex
+from ..infrastructure.registration import ImplantRegistrar
+from ..infrastructure.progress import JobProgressBroker, TERMINAL_STAGES
+from ..infrastructure.label_editor import LabelEditor
+from ..infrastructure.disagreement import LabelDisagreement
+from ..infrastructure.watch_folder import WatchFolderIngestor
+from ..infrastructure.inference import create_predictor
+from ..infrastructure.inference_pool import InferenceWorkerPool, create_inference_pool
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Process-wide caches shared by every request
+slice_renderer = SliceRenderer()
+proximity_index = BoneProximityIndex()
+implant_registrar = ImplantRegistrar(proximity_index)
+progress_broker = JobProgressBroker()
+label_editor = LabelEditor(NiftiBoneProcessor())
+disagreement_analyzer = LabelDisagreement(NiftiBoneProcessor())
+# In-process predictor until the app starts its inference workers
+predictor = create_predictor()
+watch_folder: Optional[WatchFolderIngestor] = None
+
+# Event stream pacing: proxies drop connections idle for 60 s
+EVENT_POLL_SECONDS = 0.25
+HEARTBEAT_SECONDS = 15
+
+IDENTITY = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]]
+
+class ImplantPlacement(BaseModel):
+    implant: str
+    # Row-major 4x4 implant-to-bone-world transform (bone PLY frame, mm)
+    transform: List[List[float]] = IDENTITY
+
+class ImplantRegistration(ImplantPlacement):
+    bone: str
+    # Share of closest correspondences kept each ICP iteration
+    overlap: float = 0.7
+    max_iterations: int = 30
+
+class LabelOperation(BaseModel):
+    shape: str  # 'sphere' or 'box'
+    mode: str  # 'paint' or 'erase'
+    label: int
+    # World millimetres, the frame of the bone PLY files
+    center: Optional[List[float]] = None
+    radius: Optional[float] = None
+    min: Optional[List[float]] = None
+    max: Optional[List[float]] = None
+
+class LabelEdit(BaseModel):
+    operations: List[LabelOperation]
+
 # Dependency Injection
 def get_bone_service():
     storage = FileSystemStorage()
     processor = NiftiBoneProcessor()
-    return BoneService(processor, storage)
+    return BoneService(processor, storage, slice_renderer=slice_renderer, proximity_index=proximity_index,
+                       implant_registrar=implant_registrar, progress_broker=progress_broker,
+                       label_editor=label_editor, disagreement_analyzer=disagreement_analyzer,
+                       predictor=predictor)
+
+def ingest_file(path: str, job_id: str):
+    service = get_bone_service()
+    filename = Path(path).name
+    with open(path, 'rb') as f:
+        job = service.start_job(f, filename, job_id=job_id)
+    # The watch folder receives model predictions; BONE_VIEWER_WATCH_REMOVE_ISLANDS=0 keeps them as they are
+    service.run_job(job["job_id"], job["file_path"], filename,
+                    remove_islands=os.environ.get("BONE_VIEWER_WATCH_REMOVE_ISLANDS", "1") != "0")
+
+def create_watch_folder_ingestor() -> Optional[WatchFolderIngestor]:
+    """Watch-folder ingestion, enabled by setting BONE_VIEWER_WATCH_DIR."""
+    global watch_folder
+    watch_dir = os.environ.get("BONE_VIEWER_WATCH_DIR")
+    if not watch_dir:
+        return None
+    watch_folder = WatchFolderIngestor(
+        watch_dir, ingest_file,
+        job_exists=lambda job_id: get_bone_service().get_job_metadata(job_id) is not None,
+        stable_seconds=float(os.environ.get("BONE_VIEWER_WATCH_STABLE_SECONDS", 5)),
+        poll_seconds=float(os.environ.get("BONE_VIEWER_WATCH_POLL_SECONDS", 2)),
+        max_in_flight=int(os.environ.get("BONE_VIEWER_WATCH_MAX_IN_FLIGHT", 2))
+    )
+    return watch_folder
+
+def create_inference_workers() -> Optional[InferenceWorkerPool]:
+    """Warm-model worker pool for CT uploads, if BONE_VIEWER_INFERENCE_WORKERS asks for one (default 0: in-process)."""
+    global predictor
+    workers = int(os.environ.get("BONE_VIEWER_INFERENCE_WORKERS", 0))
+    if workers <= 0:
+        return None
+    predictor = create_inference_pool(workers=workers)
+    return predictor
+
+def run_job_in_background(service: BoneService, job_id: str, file_path: str, filename: str,
+                          revision_of: Optional[str] = None, remove_islands: bool = False):
+    try:
+        service.run_job(job_id, file_path, filename, revision_of, remove_islands)
+    except Exception:
+        # Already reported to subscribers as an 'error' event
+        logger.exception(f"Job {job_id} failed")
+
+def run_ct_job_in_background(service: BoneService, job_id: str, file_path: str, filename: str):
+    try:
+        service.run_ct_job(job_id, file_path, filename)
+    except Exception:
+        logger.exception(f"CT job {job_id} failed")
 
 @router.get("/")
 async def root():
@@ -26,17 +135,140 @@ async def root():
 @router.post("/upload-segmentation")
 async def upload_segmentation(
     file: UploadFile = File(...),
+    revision_of: Optional[str] = None,
+    remove_islands: bool = False,
     service: BoneService = Depends(get_bone_service)
 ):
+    """Process a segmentation; set `remove_islands` for a model prediction to drop stray components."""
     if not file.filename.endswith(('.nii', '.nii.gz')):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload NIfTI.")
+    if revision_of and not service.get_job_metadata(revision_of):
+        raise HTTPException(status_code=404, detail="Job to revise not found")
     
     try:
-        result = service.process_segmentation(file.file, file.filename)
+        result = service.process_segmentation(file.file, file.filename, revision_of, remove_islands)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/jobs", status_code=202)
+async def create_job(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    revision_of: Optional[str] = None,
+    remove_islands: bool = False,
+    service: BoneService = Depends(get_bone_service)
+):
+    """
+    Accept a segmentation and process it in the background; follow /jobs/{job_id}/events.
+    With `revision_of`, bones unchanged since that job reuse its geometry. Set
+    `remove_islands` for a model prediction to drop stray components of each bone.
+    """
+    if not file.filename.endswith(('.nii', '.nii.gz')):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload NIfTI.")
+    if revision_of and not service.get_job_metadata(revision_of):
+        raise HTTPException(status_code=404, detail="Job to revise not found")
+
+    job = await run_in_threadpool(service.start_job, file.file, file.filename)
+    background_tasks.add_task(run_job_in_background, service, job["job_id"], job["file_path"], file.filename,
+                              revision_of, remove_islands)
+    return JSONResponse(status_code=202, content={
+        "job_id": job["job_id"],
+        "filename": file.filename,
+        "status": "processing",
+        "events_url": f"/jobs/{job['job_id']}/events",
+        "metadata_url": f"/bones/{job['job_id']}"
+    })
+
+@router.post("/upload-ct", status_code=202)
+async def upload_ct(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    service: BoneService = Depends(get_bone_service)
+):
+    """
+    Segment a raw CT with the trained model and export its bones in the
+    background; follow /jobs/{job_id}/events.
+    """
+    if not file.filename.endswith(('.nii', '.nii.gz')):
+        raise HTTPException(status_code=400, detail="Invalid file format. Please upload NIfTI.")
+
+    job = await run_in_threadpool(service.start_job, file.file, file.filename, None, 'ct')
+    background_tasks.add_task(run_ct_job_in_background, service, job["job_id"], job["file_path"], file.filename)
+    return JSONResponse(status_code=202, content={
+        "job_id": job["job_id"],
+        "filename": file.filename,
+        "status": "processing",
+        "events_url": f"/jobs/{job['job_id']}/events",
+        "metadata_url": f"/bones/{job['job_id']}"
+    })
+
+@router.get("/jobs")
+async def list_jobs(
+    offset: int = 0,
+    limit: int = 100,
+    inline_thumbnails: bool = False,
+    service: BoneService = Depends(get_bone_service)
+):
+    """Job gallery: summaries with thumbnail URLs (or inlined PNG data URIs)."""
+    if offset < 0 or not 0 < limit <= 1000:
+        raise HTTPException(status_code=400, detail="Invalid offset or limit")
+    return await run_in_threadpool(service.list_jobs, offset, limit, inline_thumbnails)
+
+@router.get("/jobs/{job_id}/thumbnail.png")
+async def get_thumbnail(job_id: str):
+    storage = FileSystemStorage()
+    thumbnail_path = Path(storage.get_job_path(job_id)) / THUMBNAIL_FILE
+
+    if not thumbnail_path.exists():
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    return FileResponse(thumbnail_path, media_type="image/png", headers={"Cache-Control": "public, max-age=3600"})
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    service: BoneService = Depends(get_bone_service)
+):
+    """Server-sent progress events; reconnecting clients resume after Last-Event-ID."""
+    cursor = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+    if service.get_job_events(job_id, cursor) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream(cursor):
+        yield "retry: 2000\n\n"
+        last_sent = time.monotonic()
+        while not await request.is_disconnected():
+            events = service.get_job_events(job_id, cursor) or []
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                cursor = event['id'] + 1
+                last_sent = time.monotonic()
+            if events and events[-1]['stage'] in TERMINAL_STAGES:
+                break
+            if time.monotonic() - last_sent > HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    return StreamingResponse(stream(cursor), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/ingest/status")
+async def get_ingest_status():
+    if watch_folder is None:
+        return {"enabled": False}
+    return {"enabled": True, **watch_folder.status()}
+
+@router.get("/inference/status")
+async def get_inference_status():
+    if not isinstance(predictor, InferenceWorkerPool):
+        return {"workers": 0, "predictor": os.environ.get("BONE_VIEWER_PREDICTOR", "nnunet")}
+    return {"predictor": predictor.kind or os.environ.get("BONE_VIEWER_PREDICTOR", "nnunet"),
+            **predictor.status()}
+
 @router.get("/bones/{job_id}")
 async def get_bones_list(
     job_id: str,
@@ -62,6 +294,100 @@ async def get_bone_ply(job_id: str, bone_name: str):
         
     return FileResponse(ply_path, media_type="application/octet-stream", filename=f"{bone_name}.ply")
 
+@router.get("/jobs/{job_id}/scene.glb")
+async def get_scene(job_id: str):
+    storage = FileSystemStorage()
+    scene_path = Path(storage.get_job_path(job_id)) / SCENE_FILE
+
+    if not scene_path.exists():
+        raise HTTPException(status_code=404, detail="Scene not found")
+
+    return FileResponse(scene_path, media_type="model/gltf-binary", filename=f"{job_id}.glb")
+
+@router.get("/jobs/{job_id}/slice")
+async def get_slice(
+    job_id: str,
+    axis: str = "axial",
+    index: Optional[int] = None,
+    format: str = "png",
+    service: BoneService = Depends(get_bone_service)
+):
+    try:
+        result = await run_in_threadpool(service.get_slice, job_id, axis, index, format)
+    except (ValueError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    content, (rows, cols) = result
+    media_type = "image/png" if format == "png" else "application/octet-stream"
+    return Response(content=content, media_type=media_type, headers={"X-Slice-Shape": f"{rows},{cols}"})
+
+@router.post("/jobs/{job_id}/implant-distance")
+async def get_implant_distance(
+    job_id: str,
+    placement: ImplantPlacement,
+    service: BoneService = Depends(get_bone_service)
+):
+    try:
+        result = await run_in_threadpool(service.measure_implant, job_id, placement.implant, placement.transform)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return result
+
+@router.post("/jobs/{job_id}/register-implant")
+async def register_implant(
+    job_id: str,
+    registration: ImplantRegistration,
+    service: BoneService = Depends(get_bone_service)
+):
+    try:
+        result = await run_in_threadpool(
+            service.register_implant, job_id, registration.implant, registration.bone, registration.transform,
+            overlap=registration.overlap, max_iterations=registration.max_iterations
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return result
+
+@router.patch("/jobs/{job_id}/labels")
+async def edit_labels(
+    job_id: str,
+    edit: LabelEdit,
+    service: BoneService = Depends(get_bone_service)
+):
+    """Paint or erase labels; only the edited region's geometry is recomputed."""
+    try:
+        result = await run_in_threadpool(service.edit_labels, job_id, [op.model_dump() for op in edit.operations])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return result
+
+@router.get("/jobs/{job_id}/disagreement")
+async def get_disagreement(
+    job_id: str,
+    reference: str,
+    service: BoneService = Depends(get_bone_service)
+):
+    """Compare this job (prediction) against a reference job on the same grid."""
+    try:
+        result = await run_in_threadpool(service.compare_jobs, job_id, reference)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return result
+
 @router.post("/upload-implant")
 async def upload_implant(
     file: UploadFile = File(...),
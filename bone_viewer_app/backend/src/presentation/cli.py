@@ -0,0 +1,135 @@
+"""
+Headless batch processing of NIfTI segmentations into viewer jobs.
+
+Runs the same pipeline as the upload endpoint over a directory or glob of
+files with a process pool, writing the usual job layout under the uploads
+directory. Job IDs are derived from the file content, so re-running over the
+same inputs skips everything already processed.
+
+Examples:
+    python -m src.presentation.cli ../../nnUNet_preds --workers 4
+    python -m src.presentation.cli "preds/**/*.nii.gz" --uploads uploads --summary summary.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from ..application.services import BoneService
+from ..infrastructure.nifti_processor import NiftiBoneProcessor
+from ..infrastructure.storage import FileSystemStorage, content_job_id
+
+NIFTI_SUFFIXES = ('.nii', '.nii.gz')
+
+
+def find_inputs(target: str):
+    """NIfTI files in a directory (recursively) or matching a glob pattern."""
+    if os.path.isdir(target):
+        files = [str(p) for p in Path(target).rglob('*') if p.name.endswith(NIFTI_SUFFIXES)]
+    else:
+        files = [f for f in glob.glob(target, recursive=True) if f.endswith(NIFTI_SUFFIXES)]
+    return sorted(files)
+
+
+def process_file(path: str, uploads: str, force: bool, remove_islands: bool = False):
+    """Process one file into a job; runs in a worker process."""
+    start = time.perf_counter()
+    storage = FileSystemStorage(uploads)
+    service = BoneService(NiftiBoneProcessor(), storage)
+
+    job_id = content_job_id(path)
+    if not force and service.get_job_metadata(job_id) is not None:
+        return {'file': path, 'job_id': job_id, 'status': 'skipped',
+                'seconds': round(time.perf_counter() - start, 3)}
+
+    filename = Path(path).name
+    try:
+        with open(path, 'rb') as f:
+            job = service.start_job(f, filename, job_id=job_id)
+        result = service.run_job(job['job_id'], job['file_path'], filename, remove_islands=remove_islands)
+    except Exception as e:
+        # Leave no half-written job behind, so the next run retries it
+        shutil.rmtree(storage.get_job_path(job_id), ignore_errors=True)
+        return {'file': path, 'job_id': job_id, 'status': 'failed', 'error': str(e),
+                'seconds': round(time.perf_counter() - start, 3)}
+    return {
+        'file': path,
+        'job_id': job_id,
+        'status': 'processed',
+        'bones': result['metadata']['total_bones'],
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+
+def print_summary(results, elapsed):
+    print("=" * 78)
+    print(f"{'file':<40} {'job':<13} {'status':<10} {'bones':>5} {'seconds':>7}")
+    print("-" * 78)
+    for r in results:
+        name = Path(r['file']).name
+        name = name if len(name) <= 40 else '...' + name[-37:]
+        print(f"{name:<40} {r['job_id'] or '-':<13} {r['status']:<10} {r.get('bones', ''):>5} {r['seconds']:>7.2f}")
+    print("-" * 78)
+    counts = {s: sum(1 for r in results if r['status'] == s) for s in ('processed', 'skipped', 'failed')}
+    processed = [r['seconds'] for r in results if r['status'] == 'processed']
+    print(f"Processed: {counts['processed']}  Skipped: {counts['skipped']}  Failed: {counts['failed']}  "
+          f"Wall time: {elapsed:.1f} s")
+    if processed:
+        print(f"Per file: mean {sum(processed) / len(processed):.2f} s  max {max(processed):.2f} s")
+    print("=" * 78)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch-process NIfTI segmentations into viewer jobs')
+    parser.add_argument('inputs', help='Directory (searched recursively) or glob pattern of NIfTI files')
+    parser.add_argument('--uploads', default='uploads', help='Uploads directory of the backend (default: uploads)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--force', action='store_true', help='Re-process inputs that already have a job')
+    parser.add_argument('--remove-islands', action='store_true',
+                        help='Inputs are model predictions: keep only the largest component of each bone')
+    parser.add_argument('--summary', help='Write the per-file results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    files = find_inputs(args.inputs)
+    if not files:
+        print(f"No NIfTI files found in {args.inputs}")
+        sys.exit(1)
+    print(f"Processing {len(files)} files with {args.workers} workers into {args.uploads}/")
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_file, f, args.uploads, args.force, args.remove_islands): f for f in files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died
+                result = {'file': futures[future], 'job_id': None, 'status': 'failed', 'error': str(e),
+                          'seconds': 0.0}
+            if result['status'] == 'failed':
+                print(f"✗ {result['file']}: {result['error']}")
+            else:
+                print(f"{'✓' if result['status'] == 'processed' else '·'} {result['file']} -> "
+                      f"{result['job_id']} ({result['status']}, {result['seconds']:.2f} s)")
+            results.append(result)
+
+    results.sort(key=lambda r: r['file'])
+    print_summary(results, time.perf_counter() - start)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Summary written to {args.summary}")
+    if any(r['status'] == 'failed' for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()